@@ -1,38 +1,42 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+import json
 import numpy as np
-import pickle
 import pandas as pd
+import os
+import sys
+import time
+
+# Shared model utilities live with the Streamlit app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crop (1)', 'crop'))
+from prediction_cache import PredictionCache, normalize_key
+from distillation import ServingStats
+
+from model_bundle import load_models
+from crop_dataset import FEATURE_ENCODER
 
 # Initialize the Flask application
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Change this to a random secret key
 
-# Load models and encoders
-model = pickle.load(open('model.pkl', 'rb'))
-scaler = pickle.load(open('scaler.pkl', 'rb'))
-fertilizer_encoder = pickle.load(open('fertilizer.pkl', 'rb'))
-soil_encoder = pickle.load(open('soil_encoder.pkl', 'rb'))
-crop_encoder = pickle.load(open('crop_encoder.pkl', 'rb'))
-
-# Dictionaries for encoding
-crop_dict = {
-    'rice': 1, 'maize': 2, 'jute': 3, 'cotton': 4, 'coconut': 5,
-    'papaya': 6, 'orange': 7, 'apple': 8, 'muskmelon': 9, 'watermelon': 10,
-    'grapes': 11, 'mango': 12, 'banana': 13, 'pomegranate': 14, 
-    'lentil': 15, 'blackgram': 16, 'mungbean': 17, 'mothbeans': 18, 
-    'pigeonpeas': 19, 'kidneybeans': 20, 'chickpea': 21, 'coffee': 22,
-    'groundnut': 23, 'wheat': 24, 'onion': 25, 'barley': 26, 'clover': 27,
-    'oats': 28
-}
-
-soil_dict = {
-    'Clayey': 1, 'Sandy': 2, 'Loam': 3, 'Silty': 4, 'Peaty': 5,
-    'Saline': 6, 'Red': 7, 'Black': 8, 'Alluvial': 9
-}
-
-season_dict = {
-    'Kharif': 1, 'Rabi': 2
-}
+# Load models and encoders (memory-mapped from model_bundle/ when it exists)
+models = load_models()
+model = models['model']
+scaler = models['scaler']
+fertilizer_encoder = models['fertilizer_encoder']
+soil_encoder = models['soil_encoder']
+crop_encoder = models['crop_encoder']
+compiled_model = models['compiled_model']
+model_version = models['version']
+recommendation_cache = PredictionCache()
+# Student distilled from the forest by `crop.py --distill`, if present
+fast_path = models.get('fast_path')
+serving_stats = ServingStats()
+
+# Vocabularies saved with the model, or the current ones for older artifacts
+feature_encoder = models.get('feature_encoder') or FEATURE_ENCODER
+crop_vocabulary = feature_encoder.target
+soil_vocabulary = feature_encoder.vocabularies['Soil']
+season_vocabulary = feature_encoder.vocabularies['season']
 
 # Input validation ranges
 input_ranges = {
@@ -44,6 +48,8 @@ input_ranges = {
     'ph': (0, 14),
     'rainfall': (0, 300)
 }
+
+short_term_crops = {'rice', 'maize', 'lentil', 'mungbean', 'blackgram', 'jute', 'onion','cotton'}
 fertilizer_dict = {
     "Urea": {
         "nutrient_content": "46% Nitrogen (N)",
@@ -133,21 +139,44 @@ fertilizer_dict = {
 
 
 def recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop, prev_duration, rec_duration, season):
-    soil_num = soil_dict.get(soil, -1)
-    prev_crop_num = crop_dict.get(prev_crop.lower(), -1)
-    season_num = season_dict.get(season, -1)
+    args = (N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop, prev_duration, rec_duration, season)
+    start = time.perf_counter()
+    path = 'cache'
+
+    def compute():
+        nonlocal path
+        error, recommended_crop, path = compute_recommendation(*args)
+        return error, recommended_crop
+
+    result = recommendation_cache.get_or_compute(normalize_key(args, model_version), compute)
+    if path is not None:
+        serving_stats.record(path, time.perf_counter() - start)
+    return result
+
+def predict_crop(features):
+    # The student answers when it is confident, the full forest otherwise
+    if fast_path is not None:
+        probabilities = fast_path.predict_proba(features)
+        if fast_path.confident(probabilities)[0]:
+            return fast_path.classes_[probabilities.argmax(axis=1)], 'student'
+    return compiled_model.predict(features), 'forest'
+
+def compute_recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop, prev_duration, rec_duration, season):
+    soil_num = soil_vocabulary.lookup(soil)
+    prev_crop_num = crop_vocabulary.lookup(prev_crop)
+    season_num = season_vocabulary.lookup(season)
     prev_duration_num = 1 if prev_duration.lower() == 'long' else 0
     rec_duration_num = 1 if rec_duration.lower() == 'long' else 0
 
     if soil_num == -1 or prev_crop_num == -1 or season_num == -1:
-        return "Invalid input for soil type, previous crop, or season.", None
+        return "Invalid input for soil type, previous crop, or season.", None, None
 
     features = np.array([[N, P, K, temperature, humidity, ph, rainfall, soil_num, prev_crop_num, prev_duration_num, season_num, rec_duration_num]]).astype(float)
     features = scaler.transform(features)
-    prediction = model.predict(features)
-    recommended_crop = next((name for name, num in crop_dict.items() if num == prediction[0]), None)
+    prediction, path = predict_crop(features)
+    recommended_crop = crop_vocabulary.decode(prediction)[0]
 
-    return None, recommended_crop
+    return None, recommended_crop, path
 
 def recommend_fertilizer(nitrogen, phosphorus, potassium, soil_type, temperature, crop_type):
     try:
@@ -176,7 +205,6 @@ def validate_inputs(N, P, K, temperature, humidity, ph, rainfall, prev_crop, pre
         if not (min_val <= locals()[param] <= max_val):
             return f"{param} should be in the range {min_val} to {max_val}."
     
-    short_term_crops = {'rice', 'maize', 'lentil', 'mungbean', 'blackgram', 'jute', 'onion','cotton'}
     if prev_crop.lower() in short_term_crops and prev_duration.lower() == 'long':
         return f"{prev_crop.capitalize()} is a short-term crop, so the previous duration should be 'short'."
     
@@ -444,5 +472,165 @@ def recommend_fertilizer(nitrogen, phosphorus, potassium, soil_type, temperature
     return fertilizer_name, fertilizer_details
 
 
+# JSON batch API
+API_BATCH_SIZE = 1000
+MAX_JSON_RECORDS = 10000
+
+crop_api_fields = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall',
+                   'soil', 'prev_crop', 'prev_duration', 'rec_duration', 'season']
+fertilizer_api_fields = ['N', 'P', 'K', 'soil_type', 'Temperature', 'Crop']
+
+
+def flag_errors(errors, mask, message):
+    # Only the first problem found for a record is reported.
+    mask = np.asarray(mask, dtype=bool) & errors.isna().to_numpy()
+    if isinstance(message, pd.Series):
+        message = message[mask]
+    errors[mask] = message
+
+
+def records_frame(records, fields):
+    errors = pd.Series([None] * len(records), dtype=object)
+    rows = []
+    for i, record in enumerate(records):
+        if isinstance(record, dict):
+            rows.append(record)
+        else:
+            rows.append({})
+            errors[i] = f"Invalid JSON: {record}" if isinstance(record, ValueError) else "Record must be a JSON object."
+
+    df = pd.DataFrame.from_records(rows, columns=fields)
+    missing = df.isna()
+    for i in np.flatnonzero(missing.any(axis=1).to_numpy() & errors.isna().to_numpy()):
+        errors[i] = "Missing field(s): " + ", ".join(missing.columns[missing.iloc[i].to_numpy()])
+    return df, errors
+
+
+def validate_crop_batch(records):
+    df, errors = records_frame(records, crop_api_fields)
+
+    numeric = df[list(input_ranges)].apply(pd.to_numeric, errors='coerce')
+    flag_errors(errors, numeric.isna().any(axis=1), "N, P, K, temperature, humidity, ph and rainfall must be numbers.")
+    for param, (min_val, max_val) in input_ranges.items():
+        flag_errors(errors, ~numeric[param].between(min_val, max_val), f"{param} should be in the range {min_val} to {max_val}.")
+
+    prev_crop = df['prev_crop'].astype(str).str.lower()
+    prev_long = df['prev_duration'].astype(str).str.lower() == 'long'
+    rec_long = df['rec_duration'].astype(str).str.lower() == 'long'
+    flag_errors(errors, prev_crop.isin(short_term_crops) & prev_long,
+                prev_crop.str.capitalize() + " is a short-term crop, so the previous duration should be 'short'.")
+
+    soil_num = soil_vocabulary.encode(df['soil'])
+    prev_crop_num = crop_vocabulary.encode(prev_crop)
+    season_num = season_vocabulary.encode(df['season'])
+    flag_errors(errors, (soil_num < 0) | (prev_crop_num < 0) | (season_num < 0),
+                "Invalid input for soil type, previous crop, or season.")
+
+    features = np.column_stack([
+        numeric.to_numpy(dtype=float), soil_num, prev_crop_num, prev_long, season_num, rec_long
+    ]).astype(float)
+    return features, errors
+
+
+def recommend_crop_batch(records, offset=0):
+    features, errors = validate_crop_batch(records)
+    valid = errors.isna().to_numpy()
+    predictions = iter([])
+    if valid.any():
+        predictions = iter(crop_vocabulary.decode(model.predict(scaler.transform(features[valid]))))
+
+    results = []
+    for i, error in enumerate(errors):
+        if error is None:
+            results.append({'index': offset + i, 'recommended_crop': next(predictions)})
+        else:
+            results.append({'index': offset + i, 'error': error})
+    return results
+
+
+def recommend_fertilizer_batch(records, offset=0):
+    df, errors = records_frame(records, fertilizer_api_fields)
+    numeric = df[['N', 'P', 'K', 'Temperature']].apply(pd.to_numeric, errors='coerce')
+    flag_errors(errors, numeric.isna().any(axis=1), "N, P, K and Temperature must be numbers.")
+    text = df[['soil_type', 'Crop']].astype(str).apply(lambda col: col.str.strip())
+    flag_errors(errors, (text == '').any(axis=1), "Soil Type and Crop Type are required fields.")
+
+    results = []
+    for i, error in enumerate(errors):
+        if error is not None:
+            results.append({'index': offset + i, 'error': error})
+            continue
+        fertilizer_name, fertilizer_details = recommend_fertilizer(
+            numeric['N'].iat[i], numeric['P'].iat[i], numeric['K'].iat[i],
+            text['soil_type'].iat[i], numeric['Temperature'].iat[i], text['Crop'].iat[i]
+        )
+        results.append({'index': offset + i, 'fertilizer_name': fertilizer_name,
+                        'fertilizer_details': fertilizer_details})
+    return results
+
+
+def ndjson_batches(stream):
+    batch = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            batch.append(json.loads(line))
+        except ValueError as e:
+            batch.append(e)
+        if len(batch) >= API_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def batch_api_response(score_batch):
+    if request.mimetype == 'application/x-ndjson':
+        # Stream large payloads: score each chunk as it is read and write
+        # one result per line.
+        def generate():
+            offset = 0
+            for batch in ndjson_batches(request.stream):
+                for result in score_batch(batch, offset):
+                    yield json.dumps(result) + '\n'
+                offset += len(batch)
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    body = request.get_json(silent=True)
+    records = body.get('records') if isinstance(body, dict) else body
+    if not isinstance(records, list):
+        return jsonify({'error': "Expected a JSON array of records or an object with a 'records' array."}), 400
+    if len(records) > MAX_JSON_RECORDS:
+        return jsonify({'error': f"At most {MAX_JSON_RECORDS} records per JSON request; use application/x-ndjson for larger batches."}), 413
+
+    results = []
+    for start in range(0, len(records), API_BATCH_SIZE):
+        results.extend(score_batch(records[start:start + API_BATCH_SIZE], start))
+    errors = sum('error' in result for result in results)
+    return jsonify({'count': len(results), 'errors': errors, 'results': results})
+
+
+@app.route('/api/v1/crop/recommend', methods=['POST'])
+def api_crop_recommend():
+    return batch_api_response(recommend_crop_batch)
+
+
+@app.route('/api/v1/fertilizer/recommend', methods=['POST'])
+def api_fertilizer_recommend():
+    return batch_api_response(recommend_fertilizer_batch)
+
+
+@app.route('/api/v1/crop/stats', methods=['GET'])
+def api_crop_stats():
+    # Fast-path fallback rate and latency percentiles of recommendation()
+    return jsonify(dict(
+        serving_stats.stats(),
+        cache=recommendation_cache.stats(),
+        fast_path=fast_path.report if fast_path is not None else None
+    ))
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,91 @@
+"""
+Timing, machine-spec and baseline-comparison helpers for the benchmark suite
+"""
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+
+def measure(fn, repeat=20, number=1, warmup=1):
+    """Call fn() number times per sample, repeat samples, and return
+    per-call timings in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number * 1000)
+    samples.sort()
+    return {
+        'median_ms': statistics.median(samples),
+        'min_ms': samples[0],
+        'p95_ms': samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        'mean_ms': statistics.fmean(samples),
+        'repeat': repeat,
+        'number': number
+    }
+
+
+def package_versions(names=('numpy', 'pandas', 'sklearn', 'flask', 'reportlab', 'matplotlib', 'streamlit')):
+    versions = {}
+    for name in names:
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        versions[name] = getattr(module, '__version__', 'unknown')
+    return versions
+
+
+def total_memory_bytes():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def machine_spec():
+    return {
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+        'cpu_count': os.cpu_count(),
+        'memory_bytes': total_memory_bytes(),
+        'python': sys.version.split()[0],
+        'packages': package_versions()
+    }
+
+
+def write_results(results, path):
+    report = {
+        'created_at': datetime.utcnow().isoformat(),
+        'machine': machine_spec(),
+        'results': results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare(results, baseline_path, threshold=0.2):
+    """Return (name, baseline_ms, current_ms, ratio) for every benchmark whose
+    median is more than `threshold` slower than in the baseline report."""
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results'] if 'median_ms' in r}
+
+    regressions = []
+    for result in results:
+        old = baseline.get(result['name'])
+        if old is None or 'median_ms' not in result or old['median_ms'] <= 0:
+            continue
+        ratio = result['median_ms'] / old['median_ms']
+        if ratio > 1 + threshold:
+            regressions.append((result['name'], old['median_ms'], result['median_ms'], ratio))
+    return regressions
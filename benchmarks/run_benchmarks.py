@@ -0,0 +1,421 @@
+"""
+Offline benchmark suite for the training, inference, PDF and diagram hot paths
+
+    python benchmarks/run_benchmarks.py                      # full run
+    python benchmarks/run_benchmarks.py --quick --only ml_models,flask
+    python benchmarks/run_benchmarks.py --output benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Results are written as JSON together with the machine spec. With --compare,
+any benchmark whose median is more than --threshold slower than the baseline
+is reported and the exit status is 1.
+"""
+import argparse
+import atexit
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import traceback
+import warnings
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+STREAMLIT_DIR = os.path.join(ROOT, 'crop (1)', 'crop')
+CSV_PATH = os.path.join(ROOT, 'crop recommendation with project.csv')
+
+sys.path.insert(0, BENCH_DIR)
+sys.path.append(ROOT)
+sys.path.append(STREAMLIT_DIR)
+from harness import measure, write_results, compare
+
+# Keep model artifacts built by the benchmarks out of the working tree,
+# and remove them when the run ends.
+SCRATCH_DIR = tempfile.mkdtemp(prefix='crop-bench-')
+atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+os.environ.setdefault('MODEL_STORE_DIR', os.path.join(SCRATCH_DIR, 'model_store'))
+os.environ.pop('INFERENCE_SIDECAR_URL', None)
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def prepare_crop_csv():
+    import crop
+
+    return crop.load_dataset(CSV_PATH)
+
+
+def fit_crop_py_model(X, y):
+    from sklearn.preprocessing import MinMaxScaler
+    from sklearn.ensemble import RandomForestClassifier
+    from crop import DEFAULT_PARAMS
+
+    scaler = MinMaxScaler()
+    X_scaled = scaler.fit_transform(X)
+    model = RandomForestClassifier(**DEFAULT_PARAMS)
+    model.fit(X_scaled, y)
+    return model, scaler
+
+
+def bench_crop_py(quick):
+    from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
+    from sklearn.preprocessing import MinMaxScaler
+    from sklearn.ensemble import RandomForestClassifier
+
+    yield 'crop_py.preprocess', measure(prepare_crop_csv, repeat=5 if quick else 20)
+
+    X, y = prepare_crop_csv()
+    X_train, _, y_train, _ = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train_scaled = MinMaxScaler().fit_transform(X_train)
+    yield 'crop_py.fit', measure(lambda: fit_crop_py_model(X_train, y_train), repeat=3 if quick else 10)
+
+    from crop import DEFAULT_PARAMS
+
+    model = RandomForestClassifier(**DEFAULT_PARAMS)
+    kfold = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+    yield 'crop_py.cross_val', measure(
+        lambda: cross_val_score(model, X_train_scaled, y_train, cv=kfold), repeat=2 if quick else 5
+    )
+
+
+def bench_generate_training_data(quick):
+    import ml_models
+
+    sizes = [2000, 100_000] if quick else [2000, 100_000, 1_000_000]
+    for size in sizes:
+        repeat = 10 if size <= 100_000 else 3
+        yield f'generate_training_data.{size}', measure(
+            lambda: ml_models.generate_training_data(size), repeat=2 if quick else repeat
+        )
+
+
+def bench_ml_models(quick):
+    import ml_models
+
+    df = ml_models.generate_training_data(ml_models.TRAINING_SAMPLES)
+
+    def train_both():
+        ml_models.CropRecommendationModel().train(df)
+        ml_models.YieldPredictionModel().train(df)
+
+    if not quick:
+        yield 'ml_models.train', measure(train_both, repeat=1, warmup=0)
+
+    crop_model, yield_model = ml_models.get_models()
+    rows = ml_models.generate_training_data(1000, seed=7)
+    crop_records = rows.drop(columns=['crop', 'yield']).to_dict('records')
+    yield_records = rows.drop(columns=['yield']).to_dict('records')
+
+    for name, wrapper, records in [('crop', crop_model, crop_records), ('yield', yield_model, yield_records)]:
+        position = iter(range(10 ** 9))
+        # predict_batch([row]) bypasses the prediction cache, so this is the cold single-row latency.
+        yield f'ml_models.{name}.predict_single', measure(
+            lambda: wrapper.predict_batch([records[next(position) % len(records)]]), repeat=50 if quick else 200
+        )
+        yield f'ml_models.{name}.predict_cached', measure(
+            lambda: wrapper.predict(records[0]), repeat=50 if quick else 200
+        )
+        for size in [100, 1000]:
+            batch = rows.iloc[:size]
+            yield f'ml_models.{name}.predict_batch.{size}', measure(
+                lambda: wrapper.predict_batch(batch), repeat=3 if quick else 10
+            )
+
+
+# Run in a fresh interpreter, so the peak RSS belongs to this training run alone
+TRAINING_MEMORY_SCRIPT = """
+import json, sys, time
+sys.path.append(sys.argv[1])
+import ml_models
+from streaming_training import peak_rss_mb
+
+df = ml_models.generate_training_data(int(sys.argv[2]))
+try:
+    # Linux: restart the high-water mark, so the peak below is the training's
+    # and not the data generator's.
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+except OSError:
+    pass
+data_rss = peak_rss_mb()
+start = time.perf_counter()
+data = ml_models.TrainingData(df)
+del df
+for wrapper in (ml_models.CropRecommendationModel(), ml_models.YieldPredictionModel()):
+    wrapper.model.set_params(n_estimators=int(sys.argv[3]))
+    wrapper.train(data)
+print(json.dumps({'seconds': time.perf_counter() - start, 'data_rss_mb': data_rss, 'peak_rss_mb': peak_rss_mb()}))
+"""
+
+# initialize_models() as the app runs it, with the two forests in worker
+# processes. RSS would count pages shared between the processes once per
+# process, so a sampling thread sums proportional set size (PSS) over this
+# process and its workers instead (Linux only).
+INITIALIZE_MEMORY_SCRIPT = """
+import glob, json, os, sys, threading, time
+sys.path.append(sys.argv[1])
+import ml_models
+
+def pss_mb(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            return sum(int(line.split()[1]) for line in f if line.startswith('Pss:')) / 1024
+    except OSError:
+        return 0.0
+
+def total_pss_mb():
+    pids = [os.getpid()]
+    for path in glob.glob(f'/proc/{os.getpid()}/task/*/children'):
+        with open(path) as f:
+            pids += f.read().split()
+    return sum(pss_mb(pid) for pid in pids)
+
+if __name__ == '__main__':
+    for cls in (ml_models.CropRecommendationModel, ml_models.YieldPredictionModel):
+        def small(self, init=cls.__init__):
+            init(self)
+            self.model.set_params(n_estimators=int(sys.argv[2]))
+        cls.__init__ = small
+
+    peak, done = [0.0], threading.Event()
+    def sample():
+        while not done.wait(0.02):
+            peak[0] = max(peak[0], total_pss_mb())
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    ml_models.initialize_models(cores=int(sys.argv[3]))
+    seconds = time.perf_counter() - start
+    done.set()
+    sampler.join()
+    print(json.dumps({'seconds': seconds, 'peak_pss_mb': peak[0] or None}))
+"""
+
+
+def bench_training_memory(quick):
+    """Peak RSS while encoding the synthetic rows and fitting both forests
+    (with few trees, so the data rather than the forests dominates), and
+    the RSS with only the generated rows in memory. Then the same through
+    initialize_models() with the forests in two worker processes, as peak
+    PSS summed over all processes."""
+    for size in [100_000] if quick else [100_000, 1_000_000]:
+        output = subprocess.run(
+            [sys.executable, '-c', TRAINING_MEMORY_SCRIPT, STREAMLIT_DIR, str(size), '10'],
+            check=True, capture_output=True, text=True
+        ).stdout
+        stats = json.loads(output.splitlines()[-1])
+        if stats['peak_rss_mb'] is None:
+            raise ImportError("peak RSS needs the resource module", name='resource')
+        ms = stats['seconds'] * 1000
+        yield f'ml_models.train_memory.{size}', {
+            'median_ms': ms, 'min_ms': ms, 'p95_ms': ms, 'mean_ms': ms, 'repeat': 1, 'number': 1,
+            'data_rss_mb': stats['data_rss_mb'], 'peak_rss_mb': stats['peak_rss_mb']
+        }
+
+        # Two worker processes, whatever this machine's core count
+        env = dict(os.environ, TRAINING_SAMPLES=str(size),
+                   MODEL_STORE_DIR=os.path.join(SCRATCH_DIR, f'initialize_memory_{size}'))
+        output = subprocess.run(
+            [sys.executable, '-c', INITIALIZE_MEMORY_SCRIPT, STREAMLIT_DIR, '10', '3'],
+            check=True, capture_output=True, text=True, env=env
+        ).stdout
+        stats = json.loads(output.splitlines()[-1])
+        if stats['peak_pss_mb'] is not None:
+            ms = stats['seconds'] * 1000
+            yield f'ml_models.initialize_memory.{size}', {
+                'median_ms': ms, 'min_ms': ms, 'p95_ms': ms, 'mean_ms': ms, 'repeat': 1, 'number': 1,
+                'peak_pss_mb': stats['peak_pss_mb']
+            }
+
+
+def build_flask_artifacts(directory):
+    from sklearn.preprocessing import LabelEncoder
+    from crop_dataset import FEATURE_ENCODER, crop_dict, soil_dict
+
+    X, y = prepare_crop_csv()
+    model, scaler = fit_crop_py_model(X, y)
+    objects = {
+        'model.pkl': model,
+        'scaler.pkl': scaler,
+        'fertilizer.pkl': LabelEncoder().fit(['Urea', 'DAP', 'MOP']),
+        'soil_encoder.pkl': LabelEncoder().fit(list(soil_dict)),
+        'crop_encoder.pkl': LabelEncoder().fit(list(crop_dict))
+    }
+    for filename, obj in objects.items():
+        with open(os.path.join(directory, filename), 'wb') as f:
+            pickle.dump(obj, f)
+    FEATURE_ENCODER.save(os.path.join(directory, 'encoders.json'))
+
+
+def bench_flask(quick):
+    import flask  # noqa: F401  (skip cleanly when Flask is not installed)
+
+    artifact_dir = os.path.join(SCRATCH_DIR, 'flask')
+    os.makedirs(artifact_dir, exist_ok=True)
+    build_flask_artifacts(artifact_dir)
+    with working_directory(artifact_dir):
+        flask_app = load_module('flask_app', os.path.join(ROOT, 'app.py'))
+
+    args = (90, 42, 43, 20.8, 82.0, 6.5, 202.9, 'Red', 'lentil', 'short', 'short', 'Kharif')
+    yield 'flask.recommendation', measure(
+        lambda: flask_app.compute_recommendation(*args), repeat=50 if quick else 200
+    )
+    yield 'flask.recommendation_cached', measure(
+        lambda: flask_app.recommendation(*args), repeat=50 if quick else 200
+    )
+
+    keys = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall',
+            'soil', 'prev_crop', 'prev_duration', 'rec_duration', 'season']
+    records = [dict(zip(keys, args))] * 1000
+    client = flask_app.app.test_client()
+    yield 'flask.api_crop_recommend.1000', measure(
+        lambda: client.post('/api/v1/crop/recommend', json=records), repeat=3 if quick else 10
+    )
+
+
+def bench_pdf(quick):
+    import pdf_generator
+    from ml_models import ORGANIC_FERTILIZERS
+    from crop_database import EXTENDED_MULTI_CROP_COMBINATIONS
+
+    main_crop, combo = next(iter(EXTENDED_MULTI_CROP_COMBINATIONS.items()))
+    reports = {
+        'generate_crop_recommendation_pdf': {
+            'nitrogen': 50, 'phosphorus': 40, 'potassium': 40, 'temperature': 25,
+            'humidity': 60, 'ph': 6.5, 'soil_type': 'Clay', 'season': 'Kharif (Monsoon)',
+            'previous_crop': 'Fallow', 'recommended_crop': 'Rice',
+            'top_3_crops': [('Rice', 0.6), ('Maize', 0.3), ('Cotton', 0.1)]
+        },
+        'generate_fertilizer_pdf': {
+            'crop': 'Rice', 'fertilizer_type': 'Organic', 'schedule': ORGANIC_FERTILIZERS
+        },
+        'generate_multi_crop_pdf': {
+            'main_crop': main_crop, 'companions': combo['companions'],
+            'spacing_main': combo['spacing_main'], 'spacing_companion': combo['spacing_companion'],
+            'benefits': combo['benefits'], 'irrigation': combo['irrigation'],
+            'yield_boost': combo.get('yield_boost', 'N/A')
+        },
+        'generate_yield_prediction_pdf': {
+            'crop': 'Rice', 'predicted_yield': 42.5, 'nitrogen': 60, 'phosphorus': 50,
+            'potassium': 50, 'temperature': 28, 'humidity': 65, 'ph': 6.5,
+            'soil_type': 'Clay', 'season': 'Kharif (Monsoon)'
+        },
+        'generate_farm_overview_pdf': {
+            'total_crops': '300', 'soil_types': '12', 'accuracy': '99.77%', 'seasons': '4'
+        }
+    }
+    for name, data in reports.items():
+        generator = getattr(pdf_generator, name)
+        yield f'pdf.{name}', measure(lambda: generator(data), repeat=5 if quick else 20)
+
+
+def bench_diagram(quick):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from crop_database import EXTENDED_MULTI_CROP_COMBINATIONS
+
+    with working_directory(STREAMLIT_DIR):
+        streamlit_app = load_module('streamlit_app', os.path.join(STREAMLIT_DIR, 'app.py'))
+
+    crops = list(EXTENDED_MULTI_CROP_COMBINATIONS)[:2 if quick else 4]
+    for main_crop in crops:
+        combo = EXTENDED_MULTI_CROP_COMBINATIONS[main_crop]
+
+        def render():
+            fig = streamlit_app.render_enhanced_crop_diagram(main_crop, combo)
+            with warnings.catch_warnings():
+                # The diagram labels use emoji the default font cannot draw.
+                warnings.simplefilter('ignore', UserWarning)
+                fig.savefig(BytesIO(), format='png')
+            plt.close(fig)
+
+        yield f'diagram.render_enhanced_crop_diagram.{main_crop}', measure(render, repeat=3 if quick else 10)
+
+
+SUITES = [
+    ('crop_py', bench_crop_py),
+    ('generate_training_data', bench_generate_training_data),
+    ('ml_models', bench_ml_models),
+    ('training_memory', bench_training_memory),
+    ('flask', bench_flask),
+    ('pdf', bench_pdf),
+    ('diagram', bench_diagram),
+]
+
+
+def run(quick=False, only=None):
+    results = []
+    for suite, bench in SUITES:
+        if only and suite not in only:
+            continue
+        try:
+            for name, stats in bench(quick):
+                results.append(dict(name=name, **stats))
+                memory = f", peak RSS {stats['peak_rss_mb']:.0f} MB" if 'peak_rss_mb' in stats else ''
+                if 'peak_pss_mb' in stats:
+                    memory = f", peak PSS of all processes {stats['peak_pss_mb']:.0f} MB"
+                print(f"{name:<55} {stats['median_ms']:>12.3f} ms (p95 {stats['p95_ms']:.3f}{memory})")
+        except ImportError as e:
+            results.append({'name': suite, 'skipped': f"missing dependency: {e.name}"})
+            print(f"{suite:<55} skipped (missing {e.name})")
+        except Exception as e:
+            results.append({'name': suite, 'error': repr(e)})
+            print(f"{suite:<55} failed: {e!r}")
+            traceback.print_exc()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite.")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes and fewer repeats")
+    parser.add_argument('--only', help="comma-separated suites to run (%s)" % ', '.join(s for s, _ in SUITES))
+    parser.add_argument('--output', help="where to write the JSON report")
+    parser.add_argument('--compare', metavar='BASELINE', help="baseline JSON report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown before a benchmark is flagged (default 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run(quick=args.quick, only=args.only.split(',') if args.only else None)
+    output = args.output or os.path.join(
+        BENCH_DIR, 'results', f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    write_results(results, output)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}:")
+            for name, old, new, ratio in regressions:
+                print(f"  {name:<53} {old:>10.3f} ms -> {new:>10.3f} ms ({ratio:.2f}x)")
+            return 1
+        print(f"\nNo slowdowns beyond {args.threshold:.0%} against {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
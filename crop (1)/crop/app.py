@@ -23,7 +23,8 @@ from crop_database import (
 ALL_CROPS = EXTENDED_CROPS
 from pdf_generator import (
     generate_crop_recommendation_pdf, generate_fertilizer_pdf,
-    generate_multi_crop_pdf, generate_yield_prediction_pdf, generate_farm_overview_pdf
+    generate_multi_crop_pdf, generate_yield_prediction_pdf, generate_farm_overview_pdf,
+    lazy_pdf
 )
 import base64
 
@@ -949,11 +950,9 @@ def render_fertilizer_guide():
         'fertilizer_type': fertilizer_type,
         'schedule': fertilizer_data
     }
-    pdf_buffer = generate_fertilizer_pdf(pdf_data)
-    
     st.download_button(
         label="📄 Download Fertilizer Schedule PDF",
-        data=pdf_buffer,
+        data=lazy_pdf(generate_fertilizer_pdf, pdf_data),
         file_name=f"fertilizer_schedule_{selected_crop}.pdf",
         mime="application/pdf"
     )
@@ -1220,11 +1219,9 @@ def render_multi_cropping():
             'irrigation': combo['irrigation'],
             'yield_boost': combo.get('yield_boost', 'N/A')
         }
-        pdf_buffer = generate_multi_crop_pdf(pdf_data)
-        
         st.download_button(
             label="📄 Download Multi-Cropping Plan PDF",
-            data=pdf_buffer,
+            data=lazy_pdf(generate_multi_crop_pdf, pdf_data),
             file_name=f"multicrop_plan_{selected_main_crop}.pdf",
             mime="application/pdf"
         )
@@ -1595,11 +1592,9 @@ def render_farm_overview():
         'accuracy': '99.77%',
         'seasons': '4'
     }
-    pdf_buffer = generate_farm_overview_pdf(pdf_data)
-    
     st.download_button(
         label="📄 Download Farm Overview PDF",
-        data=pdf_buffer,
+        data=lazy_pdf(generate_farm_overview_pdf, pdf_data),
         file_name="farm_overview_report.pdf",
         mime="application/pdf"
     )
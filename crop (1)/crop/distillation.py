@@ -0,0 +1,279 @@
+"""
+Distilled student model that answers easy crop queries before the forest
+
+A single shallow decision tree is fitted to the full forest's class
+probabilities over a dense synthetic sample of the input space. Each sample
+row is repeated once per class the forest gives a non-zero probability,
+weighted by that probability, so every student leaf holds the forest's mean
+probabilities for its region. When serving, the student answers if its
+top-class margin clears a threshold calibrated on fresh rows, and the full
+forest answers otherwise. ServingStats records which path answered and
+the end-to-end latency.
+
+    python distillation.py [--dry-run]    # Streamlit crop model in the model store
+    python ../../crop.py --distill        # root Flask model (writes fast_path.pkl)
+"""
+import argparse
+import copy
+import os
+import threading
+import warnings
+from collections import deque
+
+import numpy as np
+from sklearn.tree import DecisionTreeClassifier
+
+from forest_engine import compile_forest, median_ms
+
+DISTILL_GRID_ROWS = int(os.environ.get("DISTILL_GRID_ROWS", "100000"))
+DISTILL_MAX_DEPTH = int(os.environ.get("DISTILL_MAX_DEPTH", "12"))
+# Share of the student's answers that must match the forest on calibration rows
+DISTILL_MIN_AGREEMENT = float(os.environ.get("DISTILL_MIN_AGREEMENT", "0.995"))
+# Smallest share of queries the student must answer to be published
+DISTILL_MIN_COVERAGE = float(os.environ.get("DISTILL_MIN_COVERAGE", "0.25"))
+SERVING_LATENCY_SAMPLES = int(os.environ.get("SERVING_LATENCY_SAMPLES", "10000"))
+
+SERVING_PATHS = ('student', 'forest', 'cache')
+
+
+def top_margin(proba):
+    """Gap between the two most likely classes of each row."""
+    if proba.shape[1] < 2:
+        return np.ones(len(proba))
+    top_two = np.partition(proba, -2, axis=1)[:, -2:]
+    return top_two[:, 1] - top_two[:, 0]
+
+
+def sample_inputs(low, high, categorical, n_rows, seed=0):
+    """Rows drawn uniformly from the box [low, high]. Columns listed in
+    `categorical` ({column index: allowed codes}) draw from their codes."""
+    rng = np.random.default_rng(seed)
+    low, high = np.asarray(low, dtype=float), np.asarray(high, dtype=float)
+    X = rng.uniform(low, high, size=(n_rows, len(low)))
+    for column, codes in categorical.items():
+        X[:, column] = rng.choice(np.asarray(codes, dtype=float), n_rows)
+    return X
+
+
+def teacher_proba(teacher, X):
+    with warnings.catch_warnings():
+        # Forests fitted on DataFrames warn about missing feature names.
+        warnings.simplefilter('ignore', UserWarning)
+        return teacher.predict_proba(X)
+
+
+def fit_student(teacher, X, max_depth=None):
+    proba = teacher_proba(teacher, X)
+    rows, columns = np.nonzero(proba > 0)
+    classes = teacher.classes_
+    # One zero-weight row per class keeps the student's classes_ (and so its
+    # probability columns) identical to the teacher's.
+    X_fit = np.concatenate([X[rows], np.repeat(X[:1], len(classes), axis=0)])
+    y_fit = np.concatenate([classes[columns], classes])
+    weight = np.concatenate([proba[rows, columns], np.zeros(len(classes))])
+    student = DecisionTreeClassifier(max_depth=max_depth or DISTILL_MAX_DEPTH, random_state=0)
+    return student.fit(X_fit, y_fit, sample_weight=weight)
+
+
+def calibrate(student_proba, teacher_labels, min_agreement=None):
+    """Lowest margin at which the rows the student would answer agree with
+    the forest at least `min_agreement` of the time. Returns the threshold
+    (inf when no threshold qualifies) and the share of rows answered."""
+    min_agreement = DISTILL_MIN_AGREEMENT if min_agreement is None else min_agreement
+    margins = top_margin(student_proba)
+    order = np.argsort(-margins, kind='stable')
+    sorted_margins = margins[order]
+    agree = (student_proba.argmax(axis=1) == teacher_labels)[order]
+    # Every row in a student leaf shares its margin, and a threshold admits
+    # all rows tied with it, so only cut between distinct margin values.
+    ends = np.flatnonzero(np.append(sorted_margins[1:] != sorted_margins[:-1], True))
+    precision = np.cumsum(agree)[ends] / (ends + 1)
+    qualifying = ends[precision >= min_agreement]
+    if not len(qualifying):
+        return float('inf'), 0.0
+    threshold = float(sorted_margins[qualifying[-1]])
+    return threshold, float(np.mean(margins >= threshold))
+
+
+class FastPath:
+    """Compiled student tree plus the margin above which its answer is used.
+    `teacher_digest` identifies the forest it was distilled from."""
+
+    def __init__(self, student, threshold, teacher_digest=None, report=None):
+        self.engine = compile_forest(student)
+        self.classes_ = student.classes_
+        self.threshold = threshold
+        self.teacher_digest = teacher_digest
+        self.report = report or {}
+
+    def predict_proba(self, X):
+        return self.engine.predict_proba(X)
+
+    def confident(self, proba):
+        return top_margin(proba) >= self.threshold
+
+
+def distill(teacher, low, high, categorical, n_rows=None, max_depth=None,
+            min_agreement=None, seed=0):
+    """Fit and calibrate a FastPath for `teacher` over the input box."""
+    n_rows = n_rows or DISTILL_GRID_ROWS
+    student = fit_student(teacher, sample_inputs(low, high, categorical, n_rows, seed), max_depth)
+
+    X_check = sample_inputs(low, high, categorical, max(n_rows // 5, 1000), seed + 1)
+    teacher_labels = teacher_proba(teacher, X_check).argmax(axis=1)
+    engine = compile_forest(student)
+    student_proba = engine.predict_proba(X_check)
+    threshold, coverage = calibrate(student_proba, teacher_labels, min_agreement)
+
+    compiled_teacher = teacher if hasattr(teacher, 'digest') else compile_forest(teacher)
+    answered = top_margin(student_proba) >= threshold
+    agree = student_proba.argmax(axis=1) == teacher_labels
+    single_rows = [X_check[i:i + 1] for i in range(200)]
+    report = {
+        'grid_rows': n_rows,
+        'student_nodes': engine.node_count,
+        'student_depth': engine.max_depth,
+        'threshold': threshold,
+        'coverage': coverage,
+        'agreement_answered': float(np.mean(agree[answered])) if answered.any() else None,
+        'agreement_overall': float(np.mean(agree)),
+        'student_single_ms': median_ms(engine.predict_proba, single_rows),
+        'forest_single_ms': median_ms(compiled_teacher.predict_proba, single_rows)
+    }
+    return FastPath(student, threshold, compiled_teacher.digest(), report)
+
+
+def expected_ms(report):
+    """Mean single-row latency with the fast path: the student on every
+    query, plus the forest on the ones it declines."""
+    return report['student_single_ms'] + (1 - report['coverage']) * report['forest_single_ms']
+
+
+def publication_problems(report, min_coverage=None):
+    """Reasons the student would not pay off when serving; empty if it
+    would."""
+    min_coverage = DISTILL_MIN_COVERAGE if min_coverage is None else min_coverage
+    student, forest = report['student_single_ms'], report['forest_single_ms']
+    problems = []
+    if student >= forest:
+        problems.append(f"the student ({student:.3f} ms) is not faster than the forest ({forest:.3f} ms)")
+    if report['coverage'] < min_coverage:
+        problems.append(f"it answers {report['coverage']:.1%} of queries, below the {min_coverage:.0%} minimum")
+    if expected_ms(report) >= forest:
+        problems.append(f"queries would average {expected_ms(report):.3f} ms against {forest:.3f} ms without it")
+    return problems
+
+
+def format_report(report):
+    agreement = report['agreement_answered']
+    return (
+        f"Student tree: {report['student_nodes']} nodes, depth {report['student_depth']} "
+        f"(distilled over {report['grid_rows']} rows)\n"
+        f"  margin threshold {report['threshold']:.3f}: answers {report['coverage']:.1%} of queries, "
+        f"agreeing with the forest on {'n/a' if agreement is None else f'{agreement:.2%}'} of them\n"
+        f"  single row: student {report['student_single_ms']:.3f} ms, forest {report['forest_single_ms']:.3f} ms, "
+        f"with the fast path {expected_ms(report):.3f} ms on average"
+    )
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    values = np.asarray(samples) * 1000
+    return {
+        'count': len(values),
+        'mean_ms': float(values.mean()),
+        'p50_ms': float(np.percentile(values, 50)),
+        'p90_ms': float(np.percentile(values, 90)),
+        'p99_ms': float(np.percentile(values, 99)),
+        'max_ms': float(values.max())
+    }
+
+
+class ServingStats:
+    """Counts answers per path ('student', 'forest' or 'cache') and keeps the
+    most recent end-to-end latencies for percentiles."""
+
+    def __init__(self, max_samples=None):
+        self.max_samples = SERVING_LATENCY_SAMPLES if max_samples is None else max_samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = dict.fromkeys(SERVING_PATHS, 0)
+            self._latencies = {path: deque(maxlen=self.max_samples) for path in SERVING_PATHS}
+            self._all = deque(maxlen=self.max_samples)
+
+    def record(self, path, seconds):
+        with self._lock:
+            self.counts[path] += 1
+            self._latencies[path].append(seconds)
+            self._all.append(seconds)
+
+    def stats(self):
+        with self._lock:
+            computed = self.counts['student'] + self.counts['forest']
+            return {
+                'counts': dict(self.counts),
+                'fallback_rate': self.counts['forest'] / computed if computed else 0.0,
+                'latency': dict(
+                    {path: percentiles(list(samples)) for path, samples in self._latencies.items()},
+                    all=percentiles(list(self._all))
+                )
+            }
+
+
+def distill_crop_model(crop_model, n_rows=None, seed=0):
+    """FastPath for an ml_models CropRecommendationModel, over the range of
+    the synthetic training data and every known category."""
+    import ml_models
+
+    reference = ml_models.encode_features(
+        ml_models.generate_training_data(10000, seed=seed), crop_model.feature_cols, crop_model.label_encoders
+    ).to_numpy(dtype=float)
+    categorical = {
+        crop_model.feature_cols.index(col): vocabulary.codes
+        for col, vocabulary in crop_model.label_encoders.items()
+    }
+    return distill(crop_model.model, reference.min(axis=0), reference.max(axis=0), categorical,
+                   n_rows=n_rows, seed=seed)
+
+
+def distill_and_publish(dry_run=False):
+    import ml_models
+    from model_store import save_derived_artifact
+
+    crop_model, yield_model = ml_models.get_models(use_sidecar=False)
+    manifest = ml_models.model_manifest
+    fast_path = distill_crop_model(crop_model)
+    print(format_report(fast_path.report))
+    problems = publication_problems(fast_path.report)
+    if problems:
+        print(f"Not publishing: {'; '.join(problems)}")
+        return None
+    if dry_run:
+        return None
+
+    student_model = copy.copy(crop_model)
+    student_model.fast_path = fast_path
+    ml_models.refresh_cache_token(student_model)
+    new_manifest = save_derived_artifact(
+        {'crop_model': student_model, 'yield_model': yield_model}, manifest,
+        extra={'distillation': fast_path.report}
+    )
+    ml_models.crop_model = student_model
+    ml_models.model_manifest = new_manifest
+    ml_models.set_model_version(new_manifest['version'])
+    print(f"Published artifact {new_manifest['version']} with the student model")
+    return new_manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distil the crop forest into a fast-path student.")
+    parser.add_argument('--dry-run', action='store_true', help="report without publishing")
+    args = parser.parse_args()
+    # Run from the imported module so the pickled FastPath refers to
+    # distillation.FastPath rather than __main__.FastPath.
+    import distillation
+    distillation.distill_and_publish(args.dry_run)
@@ -0,0 +1,242 @@
+"""
+Integer-coded vocabularies and feature encoding shared by every model
+
+A Vocabulary maps category names to integer codes through a dict for small
+inputs and a pandas hash index for batches, and maps codes back through a dense
+array indexed by code. It also answers the parts of the LabelEncoder API
+the models use (classes_, transform, inverse_transform). A FeatureEncoder
+combines the vocabularies for one model's inputs with the feature order and
+can be written to JSON next to the model.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+# Below this many values a Python dict lookup beats building a pandas index.
+DICT_LOOKUP_ROWS = 32
+UNKNOWN_POLICIES = ('error', 'missing', 'default')
+
+
+class Vocabulary:
+    """`unknown` decides what happens to values outside the vocabulary:
+    'error' raises ValueError, 'missing' returns -1 and 'default' returns the
+    code of `default` (the first category when not given)."""
+
+    def __init__(self, categories, codes=None, unknown='error', default=None,
+                 aliases=None, case_sensitive=False, name=None):
+        if unknown not in UNKNOWN_POLICIES:
+            raise ValueError(f"unknown must be one of {', '.join(UNKNOWN_POLICIES)}, got {unknown!r}")
+        self.categories = [str(category) for category in categories]
+        self.codes = np.arange(len(self.categories)) if codes is None else np.asarray(codes, dtype=np.int64)
+        if len(self.codes) != len(self.categories):
+            raise ValueError("categories and codes must have the same length")
+        if len(self.codes) and self.codes.min() < 0:
+            raise ValueError("codes must be non-negative")
+        self.unknown = unknown
+        self.default = self.categories[0] if default is None and self.categories else default
+        self.aliases = dict(aliases or {})
+        self.case_sensitive = case_sensitive
+        self.name = name
+        self._compile()
+
+    def _normalize(self, value):
+        value = str(value).strip()
+        return value if self.case_sensitive else value.lower()
+
+    def _compile(self):
+        positions = {category: i for i, category in enumerate(self.categories)}
+        self._lookup = {}
+        for category, code in zip(self.categories, self.codes):
+            key = self._normalize(category)
+            if key in self._lookup:
+                raise ValueError(f"Duplicate category {category!r} in vocabulary {self.name or ''}".rstrip())
+            self._lookup[key] = int(code)
+        for alias, target in self.aliases.items():
+            self._lookup.setdefault(self._normalize(alias), int(self.codes[positions[target]]))
+
+        self._index = pd.Index(list(self._lookup))
+        self._forward = np.fromiter(self._lookup.values(), dtype=np.int64, count=len(self._lookup))
+        self._inverse = np.full(int(self.codes.max()) + 1 if len(self.codes) else 0, None, dtype=object)
+        self._inverse[self.codes] = self.categories
+        self.default_code = self._lookup[self._normalize(self.default)] if self.default is not None else MISSING
+
+    def __len__(self):
+        return len(self.categories)
+
+    def __contains__(self, value):
+        return self._normalize(value) in self._lookup
+
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _unknown_codes(self, codes, unknown_values):
+        if self.unknown == 'error':
+            shown = ', '.join(repr(str(v)) for v in pd.unique(np.asarray(unknown_values, dtype=object))[:5])
+            raise ValueError(f"Unknown {self.name or 'category'} value(s): {shown}")
+        if self.unknown == 'default':
+            codes[codes == MISSING] = self.default_code
+        return codes
+
+    def lookup(self, value):
+        code = self._lookup.get(self._normalize(value), MISSING)
+        if code == MISSING:
+            code = int(self._unknown_codes(np.array([MISSING]), [value])[0])
+        return code
+
+    def _codes(self, values):
+        """Codes for a 1-d object array, MISSING where a value is unknown."""
+        if len(values) <= DICT_LOOKUP_ROWS:
+            return np.fromiter(
+                (self._lookup.get(self._normalize(value), MISSING) for value in values),
+                dtype=np.int64, count=len(values)
+            )
+        keys = pd.Series(values, dtype=object).astype(str).str.strip()
+        if not self.case_sensitive:
+            keys = keys.str.lower()
+        positions = self._index.get_indexer(keys)
+        return np.where(positions < 0, MISSING, self._forward[np.maximum(positions, 0)])
+
+    def known(self, values):
+        """Boolean mask of the values the vocabulary recognises."""
+        return self._codes(np.asarray(values, dtype=object).ravel()) != MISSING
+
+    def encode(self, values):
+        if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+            return self._encode_categorical(pd.Series(values, copy=False))
+        values = np.asarray(values, dtype=object).ravel()
+        codes = self._codes(values)
+        unknown = codes == MISSING
+        if unknown.any():
+            codes = self._unknown_codes(codes, values[unknown])
+        return codes
+
+    def _encode_categorical(self, values):
+        # Each category is looked up once and rows take their category's
+        # code, so no per-row strings are built. Pandas codes missing values
+        # as -1, which picks the trailing MISSING.
+        lookup = np.append(self._codes(np.asarray(values.cat.categories, dtype=object)), MISSING)
+        codes = lookup[values.cat.codes.to_numpy()]
+        unknown = codes == MISSING
+        if unknown.any():
+            codes = self._unknown_codes(codes, values[unknown].to_numpy(dtype=object))
+        return codes
+
+    def decode(self, codes):
+        """Category names for `codes`; codes outside the vocabulary give None."""
+        codes = np.asarray(codes, dtype=np.intp)
+        valid = (codes >= 0) & (codes < len(self._inverse))
+        names = np.full(codes.shape, None, dtype=object)
+        names[valid] = self._inverse[codes[valid]]
+        return names
+
+    # LabelEncoder-compatible interface
+    @property
+    def classes_(self):
+        return np.asarray(self.categories, dtype=object)
+
+    def transform(self, values):
+        return self.encode(values)
+
+    def inverse_transform(self, codes):
+        return self.decode(codes)
+
+    @classmethod
+    def fit(cls, values, **options):
+        """Codes follow the sorted categories, as LabelEncoder assigns them."""
+        values = pd.Series(values, copy=False)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # The categories that occur, found from the codes alone
+            codes = values.cat.codes.to_numpy()
+            used = np.bincount(codes[codes >= 0], minlength=len(values.cat.categories)) > 0
+            values = pd.Series(values.cat.categories[used])
+        return cls(sorted(pd.unique(values.dropna().astype(str))), **options)
+
+    @classmethod
+    def from_mapping(cls, mapping, **options):
+        return cls(list(mapping), codes=list(mapping.values()), **options)
+
+    @classmethod
+    def from_label_encoder(cls, encoder, **options):
+        return cls(list(encoder.classes_), case_sensitive=True, **options)
+
+    def to_dict(self):
+        return {
+            'categories': self.categories,
+            'codes': self.codes.tolist(),
+            'unknown': self.unknown,
+            'default': self.default,
+            'aliases': self.aliases,
+            'case_sensitive': self.case_sensitive,
+            'name': self.name
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(**state)
+
+
+class FeatureEncoder:
+    """Turns records into a model's input columns: numeric features are
+    converted to float and categorical ones to their vocabulary codes."""
+
+    def __init__(self, feature_cols, vocabularies, target=None):
+        self.feature_cols = list(feature_cols)
+        self.vocabularies = dict(vocabularies)
+        self.target = target
+
+    @classmethod
+    def fit(cls, df, feature_cols, categorical_cols, target_col=None, **options):
+        vocabularies = {col: Vocabulary.fit(df[col], name=col, **options) for col in categorical_cols}
+        target = Vocabulary.fit(df[target_col], name=target_col) if target_col else None
+        return cls(feature_cols, vocabularies, target)
+
+    def transform(self, df):
+        columns = {}
+        for col in self.feature_cols:
+            if col in self.vocabularies:
+                columns[col] = self.vocabularies[col].encode(df[col])
+            else:
+                columns[col] = pd.to_numeric(df[col]).to_numpy(dtype=float)
+        return pd.DataFrame(columns, columns=self.feature_cols)
+
+    def matrix(self, df, dtype=np.float32, out=None):
+        """The same inputs as one column-major `dtype` array, filled column
+        by column (into `out` when given). Any leading block of its columns
+        is itself contiguous, and scikit-learn's trees take float32 input
+        without copying it."""
+        X = np.empty((len(df), len(self.feature_cols)), dtype=dtype, order='F') if out is None else out
+        for i, col in enumerate(self.feature_cols):
+            if col in self.vocabularies:
+                X[:, i] = self.vocabularies[col].encode(df[col])
+            else:
+                X[:, i] = pd.to_numeric(df[col])
+        return X
+
+    def to_dict(self):
+        return {
+            'feature_cols': self.feature_cols,
+            'vocabularies': {col: vocab.to_dict() for col, vocab in self.vocabularies.items()},
+            'target': self.target.to_dict() if self.target is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(
+            state['feature_cols'],
+            {col: Vocabulary.from_dict(vocab) for col, vocab in state['vocabularies'].items()},
+            Vocabulary.from_dict(state['target']) if state.get('target') else None
+        )
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,277 @@
+"""
+Shrinks trained forests and publishes them only if they stay accurate
+
+Three steps, checked on fresh synthetic rows the models were not trained on:
+greedy ensemble selection adds trees until they match the full forest on a
+validation set, subtrees whose leaves all agree (same class,
+or yields within COMPRESSION_LEAF_TOLERANCE) are collapsed into one leaf, and
+the inference engine stores thresholds/leaf values as float32 and feature
+indices as uint16. Size, latency and accuracy are then compared with the
+original on a separate test set, and the artifact is not published when
+either model loses more than COMPRESSION_MAX_LOSS (accuracy for the crop
+model, R² for the yield model).
+
+    python forest_compression.py [--dry-run]
+"""
+import argparse
+import copy
+import os
+import pickle
+import warnings
+
+import numpy as np
+
+from forest_engine import compile_forest, median_ms
+
+COMPRESSION_MAX_LOSS = float(os.environ.get("COMPRESSION_MAX_LOSS", "0.005"))
+# How far below the full forest the selected trees may score on the selection set
+COMPRESSION_SELECTION_TOLERANCE = float(os.environ.get("COMPRESSION_SELECTION_TOLERANCE", "0"))
+COMPRESSION_LEAF_TOLERANCE = float(os.environ.get("COMPRESSION_LEAF_TOLERANCE", "0.25"))
+COMPRESSION_VALIDATION_ROWS = int(os.environ.get("COMPRESSION_VALIDATION_ROWS", "5000"))
+
+TREE_LEAF = -1
+TREE_UNDEFINED = -2
+
+
+def score(is_classifier, y, predicted):
+    """Accuracy for class indices, R² for regression values."""
+    if is_classifier:
+        return float(np.mean(predicted == y))
+    residual = np.sum((y - predicted) ** 2)
+    total = np.sum((y - np.mean(y)) ** 2)
+    return float(1 - residual / total) if total else 0.0
+
+
+def tree_predictions(forest, X):
+    """Each tree's output on X: (trees, rows, classes) class probabilities
+    for a classifier, (trees, rows) values for a regressor."""
+    compiled = compile_forest(forest)
+    leaves = compiled.apply(X)
+    return np.moveaxis(compiled.value[leaves], 1, 0).astype(np.float32)
+
+
+def select_trees(forest, X, y, X_valid, y_valid, tolerance=None):
+    """Greedy forward selection without replacement: each step adds the tree
+    that most lowers the ensemble's squared error on X, y (Brier score for a
+    classifier). Stops as soon as the chosen trees score within `tolerance`
+    of the full forest on the separate validation rows, and returns their
+    indices."""
+    tolerance = COMPRESSION_SELECTION_TOLERANCE if tolerance is None else tolerance
+    predictions = tree_predictions(forest, X)
+    valid_predictions = tree_predictions(forest, X_valid)
+    is_classifier = predictions.ndim == 3
+    if is_classifier:
+        y = np.searchsorted(forest.classes_, y)
+        y_valid = np.searchsorted(forest.classes_, y_valid)
+        target = np.eye(predictions.shape[2], dtype=np.float32)[y]
+    else:
+        target = np.asarray(y, dtype=np.float32)
+
+    def valid_score(total, n_trees):
+        return score(is_classifier, y_valid, total.argmax(axis=1) if is_classifier else total / n_trees)
+
+    full_score = valid_score(valid_predictions.sum(axis=0), len(predictions))
+    order = []
+    remaining = list(range(len(predictions)))
+    total = np.zeros_like(predictions[0])
+    valid_total = np.zeros_like(valid_predictions[0])
+    while remaining:
+        candidates = (total + predictions[remaining]) / (len(order) + 1)
+        errors = ((candidates - target) ** 2).reshape(len(remaining), -1).sum(axis=1)
+        best = remaining.pop(int(np.argmin(errors)))
+        order.append(best)
+        total += predictions[best]
+        valid_total += valid_predictions[best]
+        if valid_score(valid_total, len(order)) >= full_score - tolerance:
+            break
+    return order
+
+
+def collapse_tree(estimator, is_classifier, tolerance=None):
+    """Copy of a fitted sklearn tree in which every subtree whose leaves agree
+    is replaced by a leaf holding the subtree root's value: the same
+    majority class for a classifier, values within `tolerance` for a
+    regressor. The root's value is the sample-weighted mean of its leaves,
+    so the collapsed leaf still votes for the agreed class."""
+    tolerance = COMPRESSION_LEAF_TOLERANCE if tolerance is None else tolerance
+    tree = estimator.tree_
+    left, right = tree.children_left, tree.children_right
+    value = tree.value[:, 0, :]
+
+    # Children always have larger ids than their parent, so a reverse pass
+    # sees both children before the node itself.
+    if is_classifier:
+        votes = value.argmax(axis=1)
+        agreed = np.where(left == TREE_LEAF, votes, -1)
+    else:
+        low, high = value[:, 0].copy(), value[:, 0].copy()
+    for node in range(tree.node_count - 1, -1, -1):
+        if left[node] == TREE_LEAF:
+            continue
+        a, b = left[node], right[node]
+        if is_classifier:
+            agreed[node] = agreed[a] if agreed[a] >= 0 and agreed[a] == agreed[b] else -1
+        else:
+            low[node] = min(low[a], low[b])
+            high[node] = max(high[a], high[b])
+    collapsible = agreed >= 0 if is_classifier else high - low <= tolerance
+
+    cls, args, state = tree.__reduce__()
+    nodes = state['nodes']
+    kept = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        kept.append(node)
+        if left[node] != TREE_LEAF and not collapsible[node]:
+            stack.extend([right[node], left[node]])
+    new_ids = np.full(tree.node_count, TREE_LEAF, dtype=np.intp)
+    new_ids[kept] = np.arange(len(kept))
+
+    new_nodes = nodes[kept].copy()
+    is_leaf = (left[kept] == TREE_LEAF) | collapsible[kept]
+    new_nodes['left_child'] = np.where(is_leaf, TREE_LEAF, new_ids[left[kept]])
+    new_nodes['right_child'] = np.where(is_leaf, TREE_LEAF, new_ids[right[kept]])
+    new_nodes['feature'][is_leaf] = TREE_UNDEFINED
+    new_nodes['threshold'][is_leaf] = TREE_UNDEFINED
+    if 'missing_go_to_left' in new_nodes.dtype.names:
+        new_nodes['missing_go_to_left'][is_leaf] = 0
+
+    depth = np.zeros(len(kept), dtype=np.intp)
+    for i in range(len(kept)):
+        if not is_leaf[i]:
+            depth[new_nodes['left_child'][i]] = depth[new_nodes['right_child'][i]] = depth[i] + 1
+
+    collapsed = cls(*args)
+    collapsed.__setstate__(dict(
+        state, max_depth=int(depth.max()), node_count=len(kept), nodes=new_nodes,
+        values=state['values'][kept]
+    ))
+    estimator = copy.deepcopy(estimator)
+    estimator.tree_ = collapsed
+    return estimator
+
+
+def compress_forest(forest, X_select, y_select, X_valid, y_valid):
+    """Return a copy of `forest` with the selected trees, each collapsed."""
+    is_classifier = hasattr(forest, 'classes_')
+    selected = select_trees(forest, X_select, y_select, X_valid, y_valid)
+    compressed = copy.copy(forest)
+    compressed.estimators_ = [collapse_tree(forest.estimators_[i], is_classifier) for i in selected]
+    compressed.n_estimators = len(selected)
+    return compressed
+
+
+def forest_stats(forest, X, y, compact, repeats=200):
+    compiled = compile_forest(forest, compact)
+    single_rows = [X[i % len(X):i % len(X) + 1] for i in range(repeats)]
+    with warnings.catch_warnings():
+        # Forests fitted on DataFrames warn about missing feature names.
+        warnings.simplefilter('ignore', UserWarning)
+        batch_ms = median_ms(forest.predict, [X] * 5)
+    return {
+        'trees': compiled.n_trees,
+        'nodes': compiled.node_count,
+        'pickle_bytes': len(pickle.dumps(forest, protocol=pickle.HIGHEST_PROTOCOL)),
+        'engine_bytes': compiled.nbytes,
+        'single_row_ms': median_ms(compiled.predict, single_rows),
+        'batch_ms': batch_ms,
+        'score': score(compiled.is_classifier, y, compiled.predict(X))
+    }
+
+
+def compress_wrapper(wrapper, frames, target):
+    """Compress one ml_models wrapper using the 'select', 'valid' and 'test'
+    frames of synthetic rows; `target` maps a frame to the model's y.
+    Returns the compressed wrapper and the comparison."""
+    import ml_models
+
+    X, y = {}, {}
+    for name, df in frames.items():
+        X[name], y[name] = wrapper.encoder.transform(df).to_numpy(dtype=np.float32), target(df)
+
+    compressed = copy.copy(wrapper)
+    compressed.model = compress_forest(wrapper.model, X['select'], y['select'], X['valid'], y['valid'])
+    compressed.compiled_model = None
+    compressed.compact = True
+    ml_models.refresh_cache_token(compressed)
+
+    before = forest_stats(wrapper.model, X['test'], y['test'], compact=getattr(wrapper, 'compact', False))
+    after = forest_stats(compressed.model, X['test'], y['test'], compact=True)
+    return compressed, {'before': before, 'after': after, 'loss': before['score'] - after['score']}
+
+
+def compress_models(crop_model, yield_model, n_rows=None, seed=2024):
+    import ml_models
+
+    n_rows = n_rows or COMPRESSION_VALIDATION_ROWS
+    frames = {}
+    for offset, name in enumerate(['select', 'valid', 'test']):
+        df = ml_models.generate_training_data(n_rows, seed=seed + offset)
+        # Crops the classifier has never seen cannot be scored
+        frames[name] = df[crop_model.crop_encoder.known(df['crop'])]
+
+    crop_small, crop_report = compress_wrapper(
+        crop_model, frames, lambda df: crop_model.crop_encoder.encode(df['crop'])
+    )
+    # A distilled student describes the uncompressed forest; rerun distillation.py
+    crop_small.fast_path = None
+    yield_small, yield_report = compress_wrapper(
+        yield_model, frames, lambda df: df['yield'].to_numpy(dtype=float)
+    )
+    return crop_small, yield_small, {'crop_model': crop_report, 'yield_model': yield_report}
+
+
+def format_comparison(report):
+    lines = []
+    for name, entry in report.items():
+        before, after = entry['before'], entry['after']
+        metric = 'accuracy' if name == 'crop_model' else 'R²'
+        lines.append(
+            f"{name}: {before['trees']} -> {after['trees']} trees, {before['nodes']} -> {after['nodes']} nodes\n"
+            f"  pickle {before['pickle_bytes'] / 1e6:.1f} -> {after['pickle_bytes'] / 1e6:.1f} MB, "
+            f"engine {before['engine_bytes'] / 1e6:.1f} -> {after['engine_bytes'] / 1e6:.1f} MB\n"
+            f"  single row {before['single_row_ms']:.3f} -> {after['single_row_ms']:.3f} ms, "
+            f"batch of {COMPRESSION_VALIDATION_ROWS} {before['batch_ms']:.1f} -> {after['batch_ms']:.1f} ms\n"
+            f"  {metric} {before['score']:.4f} -> {after['score']:.4f} (loss {entry['loss']:+.4f})"
+        )
+    return "\n".join(lines)
+
+
+def compress_and_publish(max_loss=None, dry_run=False):
+    """Compress the current artifact's models and publish them as a new
+    artifact. Returns the new manifest, or None when the accuracy guardrail
+    (or --dry-run) stopped publication."""
+    import ml_models
+    from model_store import save_derived_artifact
+
+    max_loss = COMPRESSION_MAX_LOSS if max_loss is None else max_loss
+    crop_model, yield_model = ml_models.get_models(use_sidecar=False)
+    manifest = ml_models.model_manifest
+    crop_small, yield_small, report = compress_models(crop_model, yield_model)
+    print(format_comparison(report))
+
+    failed = [name for name, entry in report.items() if entry['loss'] > max_loss]
+    if failed:
+        print(f"Not publishing: {', '.join(failed)} lost more than {max_loss} on the test set")
+        return None
+    if dry_run:
+        return None
+
+    new_manifest = save_derived_artifact(
+        {'crop_model': crop_small, 'yield_model': yield_small}, manifest, extra={'compression': report}
+    )
+    ml_models.crop_model, ml_models.yield_model = crop_small, yield_small
+    ml_models.model_manifest = new_manifest
+    ml_models.set_model_version(new_manifest['version'])
+    print(f"Published compressed artifact {new_manifest['version']}")
+    return new_manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compress the current model artifact.")
+    parser.add_argument('--max-loss', type=float, default=COMPRESSION_MAX_LOSS,
+                        help="largest accepted drop in test accuracy (crop) or R² (yield)")
+    parser.add_argument('--dry-run', action='store_true', help="report without publishing")
+    args = parser.parse_args()
+    compress_and_publish(args.max_loss, args.dry_run)
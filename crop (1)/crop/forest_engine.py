@@ -0,0 +1,251 @@
+"""
+Flat-array inference engine for fitted scikit-learn random forests
+
+All trees of a RandomForestClassifier/RandomForestRegressor are packed into
+contiguous node arrays (feature, threshold, children, leaf values) and every
+tree is walked in lock-step, one NumPy step per tree level. This skips the
+per-call validation and thread dispatch that dominates sklearn's latency for
+single rows while reproducing its predictions bit for bit.
+"""
+import hashlib
+import json
+import os
+import time
+import warnings
+
+import numpy as np
+import sklearn
+
+CHUNK_ROWS = 256
+ARRAY_FIELDS = ['feature', 'threshold', 'left', 'right', 'value', 'missing_left', 'roots']
+
+# Before scikit-learn 1.4 classifier trees stored raw class counts and
+# normalized them on every predict_proba call; newer trees store fractions.
+NORMALIZE_LEAF_COUNTS = tuple(int(part) for part in sklearn.__version__.split('.')[:2]) < (1, 4)
+
+# Compact engines narrow the node arrays: thresholds and leaf values as
+# float32, feature indices as uint16 and child pointers as uint32.
+COMPACT_DTYPES = {
+    'feature': np.uint16, 'threshold': np.float32, 'left': np.uint32,
+    'right': np.uint32, 'value': np.float32
+}
+WIDE_DTYPES = {
+    'feature': np.intp, 'threshold': np.float64, 'left': np.intp,
+    'right': np.intp, 'value': np.float64
+}
+
+
+def float32_thresholds(threshold):
+    """Round thresholds down to float32. Inputs are compared as float32, and
+    no float32 lies between a threshold and its rounded-down value, so every
+    `x <= threshold` test keeps its outcome."""
+    rounded = threshold.astype(np.float32)
+    above = rounded > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+def tree_arrays(tree, is_classifier):
+    """Node arrays for one fitted sklearn tree, with tree-local child ids."""
+    node_ids = np.arange(tree.node_count)
+    is_leaf = tree.children_left == -1
+
+    value = tree.value[:, 0, :]
+    if is_classifier and NORMALIZE_LEAF_COUNTS:
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        value = value / normalizer
+    elif not is_classifier:
+        value = value[:, 0]
+
+    return {
+        # Leaves point at themselves so extra steps past a shallow leaf are no-ops.
+        'feature': np.where(is_leaf, 0, tree.feature),
+        'threshold': tree.threshold,
+        'left': np.where(is_leaf, node_ids, tree.children_left),
+        'right': np.where(is_leaf, node_ids, tree.children_right),
+        'value': value,
+        # Trees fitted on data with NaNs learn which side missing values take.
+        'missing_left': getattr(
+            tree, 'missing_go_to_left', np.zeros(tree.node_count, dtype=np.uint8)
+        ).astype(bool),
+        'max_depth': tree.max_depth
+    }
+
+
+class CompiledForest:
+    def __init__(self, forest, compact=False):
+        if getattr(forest, 'n_outputs_', 1) != 1:
+            raise ValueError("Only single-output forests can be compiled")
+
+        self.is_classifier = hasattr(forest, 'classes_')
+        self.classes_ = getattr(forest, 'classes_', None)
+        self.n_features_in_ = forest.n_features_in_
+        # A single fitted decision tree compiles as a one-tree forest
+        estimators = getattr(forest, 'estimators_', [forest])
+        self._pack([tree_arrays(estimator.tree_, self.is_classifier) for estimator in estimators], compact)
+
+    def _pack(self, trees, compact=False):
+        offsets = np.cumsum([0] + [len(tree['feature']) for tree in trees[:-1]]).astype(np.intp)
+        arrays = {
+            name: np.concatenate([tree[name] for tree in trees])
+            for name in ('feature', 'threshold', 'value', 'missing_left')
+        }
+        for side in ('left', 'right'):
+            arrays[side] = np.concatenate([tree[side] + offset for tree, offset in zip(trees, offsets)])
+        if compact:
+            if len(arrays['feature']) > np.iinfo(np.uint32).max or arrays['feature'].max() > np.iinfo(np.uint16).max:
+                raise ValueError("Forest is too large for compact storage")
+            arrays['threshold'] = float32_thresholds(arrays['threshold'])
+
+        for name, dtype in (COMPACT_DTYPES if compact else WIDE_DTYPES).items():
+            setattr(self, name, np.ascontiguousarray(arrays[name], dtype=dtype))
+        self.missing_left = np.ascontiguousarray(arrays['missing_left'])
+        self.roots = offsets
+        self.n_trees = len(trees)
+        self.max_depth = max(tree['max_depth'] for tree in trees)
+
+    def save(self, path):
+        """Write the node arrays as individual .npy files so load() can
+        memory-map them."""
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_FIELDS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        if self.is_classifier:
+            np.save(os.path.join(path, "classes.npy"), self.classes_)
+        meta = {
+            'is_classifier': self.is_classifier,
+            'n_features_in': int(self.n_features_in_),
+            'n_trees': int(self.n_trees),
+            'max_depth': int(self.max_depth)
+        }
+        with open(os.path.join(path, "forest.json"), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, "forest.json")) as f:
+            meta = json.load(f)
+        forest = cls.__new__(cls)
+        forest.is_classifier = meta['is_classifier']
+        forest.n_features_in_ = meta['n_features_in']
+        forest.n_trees = meta['n_trees']
+        forest.max_depth = meta['max_depth']
+        forest.classes_ = np.load(os.path.join(path, "classes.npy")) if forest.is_classifier else None
+        for name in ARRAY_FIELDS:
+            setattr(forest, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode))
+        return forest
+
+    @property
+    def node_count(self):
+        return len(self.feature)
+
+    def digest(self):
+        """Short hash of the node arrays, identifying the fitted model."""
+        digest = hashlib.sha256()
+        for name in ARRAY_FIELDS:
+            digest.update(getattr(self, name).tobytes())
+        return digest.hexdigest()[:16]
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAY_FIELDS)
+
+    def _validate(self, X):
+        # sklearn evaluates its trees on float32 inputs, so do the same to
+        # take exactly the same branches.
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has {X.shape[1]} features, but the forest expects {self.n_features_in_}"
+            )
+        return X
+
+    def apply(self, X):
+        X = self._validate(X)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[nodes]]
+            go_left = (x <= self.threshold[nodes]) | (np.isnan(x) & self.missing_left[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def _mean_leaf_value(self, X):
+        X = self._validate(X)
+        chunks = []
+        for start in range(0, len(X), CHUNK_ROWS):
+            leaf_values = self.value[self.apply(X[start:start + CHUNK_ROWS])]
+            # Accumulate trees in order, as sklearn does, so sums match exactly.
+            total = np.cumsum(leaf_values, axis=1, dtype=np.float64)[:, -1]
+            chunks.append(total / self.n_trees)
+        if not chunks:
+            shape = (0, len(self.classes_)) if self.is_classifier else (0,)
+            return np.empty(shape)
+        return np.concatenate(chunks)
+
+    def predict_proba(self, X):
+        if not self.is_classifier:
+            raise AttributeError("predict_proba is only available for classifiers")
+        return self._mean_leaf_value(X)
+
+    def predict(self, X):
+        if self.is_classifier:
+            return self.classes_[np.argmax(self._mean_leaf_value(X), axis=1)]
+        return self._mean_leaf_value(X)
+
+
+def compile_forest(forest, compact=False):
+    return CompiledForest(forest, compact)
+
+
+def median_ms(fn, batches):
+    timings = []
+    for batch in batches:
+        start = time.perf_counter()
+        fn(batch)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1000
+
+
+def compare_latency(forest, X, repeats=200):
+    """Time single-row and whole-batch predictions for sklearn and the
+    compiled engine on the same rows and check the outputs agree."""
+    compiled = compile_forest(forest)
+    X = np.asarray(X, dtype=np.float64)
+    reference = forest.predict_proba if compiled.is_classifier else forest.predict
+    candidate = compiled.predict_proba if compiled.is_classifier else compiled.predict
+
+    single_rows = [X[i % len(X):i % len(X) + 1] for i in range(repeats)]
+    with warnings.catch_warnings():
+        # Forests fitted on DataFrames warn about missing feature names.
+        warnings.simplefilter('ignore', UserWarning)
+        report = {
+            'trees': compiled.n_trees,
+            'nodes': compiled.node_count,
+            'identical': bool(np.array_equal(reference(X), candidate(X))),
+            'sklearn_single_ms': median_ms(reference, single_rows),
+            'compiled_single_ms': median_ms(candidate, single_rows),
+            'sklearn_batch_ms': median_ms(reference, [X] * 5),
+            'compiled_batch_ms': median_ms(candidate, [X] * 5),
+            'batch_rows': len(X)
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import ml_models
+
+    crop_model, yield_model = ml_models.get_models()
+    df = ml_models.generate_training_data(1000)
+    for name, wrapper in [('crop', crop_model), ('yield', yield_model)]:
+        X = ml_models.encode_features(df, wrapper.feature_cols, wrapper.label_encoders)
+        report = compare_latency(wrapper.model, X.to_numpy(dtype=float))
+        print(f"{name}: {report['trees']} trees / {report['nodes']} nodes, "
+              f"identical={report['identical']}")
+        print(f"  single row  sklearn {report['sklearn_single_ms']:.3f} ms  "
+              f"compiled {report['compiled_single_ms']:.3f} ms")
+        print(f"  {report['batch_rows']} rows  sklearn {report['sklearn_batch_ms']:.1f} ms  "
+              f"compiled {report['compiled_batch_ms']:.1f} ms")
@@ -0,0 +1,191 @@
+"""
+Incremental retraining from the rows logged in farm_data and crop_history
+
+Only rows added since the checkpoint stored in the current artifact's
+manifest are read. They are used to grow extra trees on both forests
+(warm_start), sized in proportion to how much new data arrived, and the
+result is published as a new artifact in the model store.
+
+The new manifest describes everything the forests were trained on: its
+`n_rows` adds the new rows to the parent's, and its `data_hash` chains the
+parent's hash with the hash of the new rows. The new rows alone are
+recorded as `delta_rows` and `delta_hash`.
+
+    python incremental_training.py
+"""
+import hashlib
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+import ml_models
+from database import get_db, FarmData, CropHistory
+from model_store import data_hash, save_artifact
+from training_orchestrator import grow_forest
+
+INCREMENTAL_MIN_TREES = int(os.environ.get("INCREMENTAL_MIN_TREES", "5"))
+INCREMENTAL_MAX_TREES = int(os.environ.get("INCREMENTAL_MAX_TREES", "50"))
+INCREMENTAL_MAX_FOREST = int(os.environ.get("INCREMENTAL_MAX_FOREST", "1000"))
+
+CROP_FEATURES = ['N', 'P', 'K', 'temperature', 'humidity', 'ph',
+                 'soil_type', 'season', 'crop_duration', 'previous_crop']
+
+FARM_COLUMNS = {
+    'N': FarmData.nitrogen, 'P': FarmData.phosphorus, 'K': FarmData.potassium,
+    'temperature': FarmData.temperature, 'humidity': FarmData.humidity, 'ph': FarmData.ph,
+    'soil_type': FarmData.soil_type, 'season': FarmData.season,
+    'crop_duration': FarmData.crop_duration, 'previous_crop': FarmData.previous_crop,
+    'crop': FarmData.recommended_crop, 'created_at': FarmData.created_at
+}
+
+
+def query_frame(db, columns, *criteria):
+    query = db.query(*columns.values())
+    for criterion in criteria:
+        query = query.filter(criterion)
+    return pd.DataFrame(query.all(), columns=list(columns))
+
+
+def fetch_new_rows(db, checkpoint):
+    """Return the farm_data and crop_history rows past `checkpoint`, plus the
+    checkpoint to store once they have been trained on."""
+    farm = query_frame(db, dict(FARM_COLUMNS, id=FarmData.id), FarmData.id > checkpoint['farm_data'])
+    history = query_frame(db, {
+        'id': CropHistory.id, 'crop': CropHistory.crop_name, 'season': CropHistory.season,
+        'soil_type': CropHistory.soil_type, 'yield': CropHistory.yield_amount,
+        'created_at': CropHistory.created_at
+    }, CropHistory.id > checkpoint['crop_history'], CropHistory.yield_amount.isnot(None))
+
+    new_checkpoint = {
+        'farm_data': int(farm['id'].max()) if len(farm) else checkpoint['farm_data'],
+        'crop_history': int(history['id'].max()) if len(history) else checkpoint['crop_history']
+    }
+    return farm, history, new_checkpoint
+
+
+def yield_rows(db, history):
+    """crop_history holds real yields but no soil readings, so each record is
+    paired with the latest logged Crop Advisor run for the same crop, soil
+    type and season before it."""
+    columns = CROP_FEATURES + ['crop', 'yield']
+    if history.empty:
+        return pd.DataFrame(columns=columns)
+    conditions = query_frame(
+        db, FARM_COLUMNS, FarmData.recommended_crop.in_(history['crop'].unique().tolist())
+    )
+    keys = ['crop', 'soil_type', 'season']
+    merged = pd.merge_asof(
+        history.dropna(subset=keys + ['created_at']).sort_values('created_at'),
+        conditions.dropna(subset=keys + ['created_at']).sort_values('created_at'),
+        on='created_at', by=keys, direction='backward'
+    )
+    return merged.dropna(subset=CROP_FEATURES)[columns]
+
+
+def known_rows(df, label_encoders):
+    """Rows whose categorical values the fitted encoders have seen. Unknown
+    values would silently collapse onto code 0, so they are left for the
+    next full retrain instead."""
+    mask = np.ones(len(df), dtype=bool)
+    for col, encoder in label_encoders.items():
+        mask &= encoder.known(df[col])
+    return df[mask]
+
+
+def trees_to_add(n_trees, n_trained, n_new):
+    # Keep the new trees' share of the vote close to the new data's share.
+    wanted = math.ceil(n_trees * n_new / max(n_trained, 1))
+    return min(max(wanted, INCREMENTAL_MIN_TREES), INCREMENTAL_MAX_TREES)
+
+
+def extend_forest(wrapper, X, y, n_new_trees, classes=None):
+    grow_forest(wrapper.model, X, y, n_new_trees, classes)
+    wrapper.compiled_model = None
+    ml_models.refresh_cache_token(wrapper)
+
+
+def extend_crop_model(wrapper, rows, n_new_trees):
+    X = ml_models.encode_features(rows, wrapper.feature_cols, wrapper.label_encoders)
+    y = wrapper.crop_encoder.transform(rows['crop'])
+    extend_forest(wrapper, X, y, n_new_trees, classes=np.arange(len(wrapper.crop_encoder.classes_)))
+    # A distilled student describes the old forest; rerun distillation.py
+    wrapper.fast_path = None
+    return len(rows)
+
+
+def extend_yield_model(wrapper, rows, n_new_trees):
+    X = ml_models.encode_features(rows, wrapper.feature_cols, wrapper.label_encoders)
+    extend_forest(wrapper, X, rows['yield'].to_numpy(dtype=float), n_new_trees)
+    return len(rows)
+
+
+def retrain_incremental(db=None):
+    """Train on rows logged since the last checkpoint and publish a new
+    artifact. Returns its manifest, or None when there was nothing new."""
+    db = db or get_db()
+    if db is None:
+        raise RuntimeError("DATABASE_URL is not configured")
+
+    try:
+        crop_model, yield_model = ml_models.get_models(use_sidecar=False)
+        manifest = ml_models.model_manifest
+        checkpoint = manifest.get('checkpoint', {'farm_data': 0, 'crop_history': 0})
+        trained_rows = manifest.get('trained_rows', {
+            'crop_model': manifest['n_rows'], 'yield_model': manifest['n_rows']
+        })
+
+        farm, history, new_checkpoint = fetch_new_rows(db, checkpoint)
+        crop_rows = known_rows(farm.dropna(subset=CROP_FEATURES + ['crop']), crop_model.label_encoders)
+        crop_rows = crop_rows[crop_model.crop_encoder.known(crop_rows['crop'])]
+        yield_new = known_rows(yield_rows(db, history), yield_model.label_encoders)
+    finally:
+        db.close()
+
+    added = {}
+    delta = []
+    for name, wrapper, rows, extend in [
+        ('crop_model', crop_model, crop_rows, extend_crop_model),
+        ('yield_model', yield_model, yield_new, extend_yield_model)
+    ]:
+        n_trees = len(wrapper.model.estimators_)
+        if rows.empty:
+            continue
+        n_new_trees = trees_to_add(n_trees, trained_rows[name], len(rows))
+        if n_trees + n_new_trees > INCREMENTAL_MAX_FOREST:
+            print(f"{name} already has {n_trees} trees; run a full retrain instead")
+            continue
+        trained_rows[name] += extend(wrapper, rows, n_new_trees)
+        added[name] = n_new_trees
+        delta.append(rows[CROP_FEATURES + ['crop']] if name == 'crop_model' else rows)
+
+    skipped = (len(farm) - len(crop_rows)) + (len(history) - len(yield_new))
+    if not added:
+        print(f"No new trainable rows since checkpoint {checkpoint} ({skipped} skipped)")
+        return None
+
+    new_rows = pd.concat(delta, ignore_index=True)
+    delta_hash = data_hash(new_rows)
+    lineage_hash = hashlib.sha256(f"{manifest['data_hash']}:{delta_hash}".encode()).hexdigest()
+    new_manifest = save_artifact(
+        {'crop_model': crop_model, 'yield_model': yield_model},
+        (lineage_hash, manifest['n_rows'] + len(new_rows)), ml_models.training_spec(),
+        extra={
+            'parent': manifest['version'],
+            'delta_hash': delta_hash,
+            'delta_rows': len(new_rows),
+            'checkpoint': new_checkpoint,
+            'trained_rows': trained_rows,
+            'trees_added': added
+        }
+    )
+    ml_models.model_manifest = new_manifest
+    ml_models.set_model_version(new_manifest['version'])
+    print(f"Published {new_manifest['version']}: {len(crop_rows)} crop rows, "
+          f"{len(yield_new)} yield rows, trees added {added}, {skipped} rows skipped")
+    return new_manifest
+
+
+if __name__ == "__main__":
+    retrain_incremental()
@@ -0,0 +1,252 @@
+"""
+Local inference sidecar that holds one shared copy of the crop and yield models
+
+Several Streamlit processes can point INFERENCE_SIDECAR_URL at one server
+instead of each loading two forests. Requests that arrive within a few
+milliseconds of each other are merged into a single predict_batch() call.
+
+    python inference_server.py --host 127.0.0.1 --port 8765
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+INFERENCE_SIDECAR_URL = os.environ.get("INFERENCE_SIDECAR_URL", "")
+MICROBATCH_WINDOW_MS = float(os.environ.get("MICROBATCH_WINDOW_MS", "5"))
+MICROBATCH_MAX_ROWS = int(os.environ.get("MICROBATCH_MAX_ROWS", "512"))
+SIDECAR_TIMEOUT = float(os.environ.get("SIDECAR_TIMEOUT", "10"))
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch, window_ms=None, max_rows=None):
+        self.predict_batch = predict_batch
+        self.window = (MICROBATCH_WINDOW_MS if window_ms is None else window_ms) / 1000
+        self.max_rows = MICROBATCH_MAX_ROWS if max_rows is None else max_rows
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, records):
+        job = {'records': records, 'done': threading.Event()}
+        self._queue.put(job)
+        job['done'].wait()
+        if 'error' in job:
+            raise job['error']
+        return job['result']
+
+    def _collect(self):
+        jobs = [self._queue.get()]
+        n_rows = len(jobs[0]['records'])
+        deadline = time.monotonic() + self.window
+        while n_rows < self.max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            n_rows += len(job['records'])
+        return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._collect()
+            records = [record for job in jobs for record in job['records']]
+            try:
+                results = self.predict_batch(records)
+            except Exception as e:
+                for job in jobs:
+                    job['error'] = e
+                    job['done'].set()
+                continue
+
+            self.batches += 1
+            self.rows += len(records)
+            start = 0
+            for job in jobs:
+                job['result'] = results[start:start + len(job['records'])]
+                start += len(job['records'])
+                job['done'].set()
+
+
+def crop_results_to_json(results):
+    return [
+        {
+            'recommended_crop': str(r['recommended_crop']),
+            'top_3_crops': [[str(crop), float(prob)] for crop, prob in r['top_3_crops']]
+        }
+        for r in results
+    ]
+
+
+def crop_results_from_json(results):
+    return [
+        {
+            'recommended_crop': r['recommended_crop'],
+            'top_3_crops': [tuple(pair) for pair in r['top_3_crops']]
+        }
+        for r in results
+    ]
+
+
+def validate_records(records, model):
+    # Reject bad rows up front so one malformed request cannot fail the
+    # whole micro-batch it would have been merged into: numbers must parse
+    # and categories must encode under the model's unknown-value policy.
+    if not isinstance(records, list):
+        raise TypeError("'records' must be a list")
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise TypeError(f"record {i} is not an object")
+        missing = [col for col in model.feature_cols if col not in record]
+        if missing:
+            raise ValueError(f"record {i} is missing {', '.join(missing)}")
+        for col in model.feature_cols:
+            if col in model.label_encoders:
+                try:
+                    model.label_encoders[col].lookup(record[col])
+                except ValueError as e:
+                    raise ValueError(f"record {i}: {e}") from e
+            else:
+                float(record[col])
+
+
+def make_handler(batchers, models, info):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path != '/health':
+                self._send_json(404, {'error': 'not found'})
+                return
+            stats = {
+                name: {'batches': b.batches, 'rows': b.rows}
+                for name, b in batchers.items()
+            }
+            self._send_json(200, dict(info, batching=stats))
+
+        def do_POST(self):
+            name = self.path.rsplit('/', 1)[-1]
+            if not self.path.startswith('/predict/') or name not in batchers:
+                self._send_json(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                records = json.loads(self.rfile.read(length))['records']
+                validate_records(records, models[name])
+                results = batchers[name].submit(records)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            except Exception as e:
+                # Answer anyway, so the client does not mistake a failed
+                # prediction for an unreachable sidecar.
+                self._send_json(500, {'error': f"{type(e).__name__}: {e}"})
+                return
+            if name == 'crop':
+                results = crop_results_to_json(results)
+            else:
+                results = [float(v) for v in results]
+            self._send_json(200, {'results': results})
+
+        def log_message(self, format, *args):
+            pass
+
+    return InferenceHandler
+
+
+def serve(host='127.0.0.1', port=8765):
+    import ml_models
+
+    crop_model, yield_model = ml_models.get_models(use_sidecar=False)
+    batchers = {
+        'crop': MicroBatcher(crop_model.predict_batch),
+        'yield': MicroBatcher(lambda records: list(yield_model.predict_batch(records)))
+    }
+    models = {'crop': crop_model, 'yield': yield_model}
+    info = {'version': getattr(crop_model, 'version', None), 'pid': os.getpid()}
+    server = ThreadingHTTPServer((host, port), make_handler(batchers, models, info))
+    print(f"Inference sidecar serving model {info['version']} on http://{host}:{port}")
+    server.serve_forever()
+
+
+class RemoteModel:
+    """Client proxy with the same predict()/predict_batch() interface as the
+    in-process models. Batches are a list of dicts, a DataFrame, or an
+    ndarray whose columns are in `feature_cols` order."""
+
+    is_trained = True
+
+    def __init__(self, base_url, name, feature_cols=None):
+        self.url = f"{base_url.rstrip('/')}/predict/{name}"
+        self.name = name
+        self.feature_cols = list(feature_cols) if feature_cols is not None else None
+
+    def _post(self, records):
+        body = json.dumps({'records': records}).encode()
+        request = urllib.request.Request(
+            self.url, data=body, headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=SIDECAR_TIMEOUT) as response:
+                return json.loads(response.read())['results']
+        except urllib.error.HTTPError as e:
+            message = json.loads(e.read()).get('error', str(e))
+            if e.code >= 500:
+                raise RuntimeError(f"Inference sidecar failed: {message}") from e
+            raise ValueError(message) from e
+        except urllib.error.URLError as e:
+            raise ConnectionError(f"Inference sidecar at {self.url} is unavailable: {e}") from e
+
+    def predict(self, input_data):
+        return self.predict_batch([input_data])[0]
+
+    def predict_batch(self, data):
+        if isinstance(data, np.ndarray):
+            if self.feature_cols is None:
+                raise TypeError("ndarray input needs the model's feature_cols to name its columns")
+            data = pd.DataFrame(np.atleast_2d(data), columns=self.feature_cols)
+        if isinstance(data, pd.DataFrame):
+            data = data.to_dict('records')
+        data = list(data)
+        for i, record in enumerate(data):
+            if not isinstance(record, dict):
+                raise TypeError(
+                    f"record {i} is a {type(record).__name__}; expected a dict, a DataFrame or an ndarray"
+                )
+        records = [
+            {key: value.item() if isinstance(value, np.generic) else value
+             for key, value in record.items()}
+            for record in data
+        ]
+        results = self._post(records)
+        if self.name == 'crop':
+            return crop_results_from_json(results)
+        return np.asarray(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    serve(args.host, args.port)
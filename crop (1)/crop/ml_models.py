@@ -1,9 +1,43 @@
 import numpy as np
 import pandas as pd
+import sklearn
 from sklearn.ensemble import RandomForestClassifier, RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
 import pickle
+import hashlib
 import os
+import threading
+import time
+import uuid
+from functools import partial
+from multiprocessing import shared_memory
+from model_store import save_artifact, load_latest, row_hashes, data_hash
+from forest_engine import compile_forest
+from prediction_cache import PredictionCache, normalize_key
+from feature_encoder import FeatureEncoder, Vocabulary
+from training_orchestrator import TrainingJob, train_concurrently, train_wrapper, timings, uses_processes
+from distillation import ServingStats
+from streaming_training import ShardedDataset, shards_for, grow_from_shards, evaluate, peak_rss_mb
+
+MODEL_VERSION = 3
+TRAINING_SAMPLES = int(os.environ.get("TRAINING_SAMPLES", "2000"))
+# Above this many rows the models are trained out of core (streaming_training)
+TRAINING_STREAM_ROWS = int(os.environ.get("TRAINING_STREAM_ROWS", "2000000"))
+# When the forests train in worker processes, the training matrix lives in
+# shared memory that each worker maps instead of receiving a pickled copy.
+TRAINING_SHARED_MEMORY = os.environ.get("TRAINING_SHARED_MEMORY", "1") != "0"
+
+# Small batches go through the flat-array engine, which avoids sklearn's
+# per-call overhead; larger ones are faster in sklearn's compiled traversal.
+USE_COMPILED_FOREST = os.environ.get("COMPILED_FOREST", "1") != "0"
+COMPILED_FOREST_MAX_ROWS = 64
+
+# When set, get_models() returns proxies to a shared inference_server.py
+# process instead of loading the forests into this one.
+INFERENCE_SIDECAR_URL = os.environ.get("INFERENCE_SIDECAR_URL", "")
+
+# What predictions do with a category the encoders were not fitted on:
+# 'default' (use the first category), 'missing' (code -1) or 'error'.
+UNKNOWN_CATEGORY = os.environ.get("UNKNOWN_CATEGORY", "default")
 
 CROPS = ['Rice', 'Wheat', 'Maize', 'Cotton', 'Sugarcane', 'Groundnut', 'Soybean', 
          'Sunflower', 'Tomato', 'Potato', 'Onion', 'Chilli', 'Cabbage', 'Cauliflower',
@@ -104,75 +138,227 @@ MULTI_CROP_COMBINATIONS = {
     }
 }
 
-def generate_training_data(n_samples=2000):
-    np.random.seed(42)
-    
-    data = {
-        'N': np.random.uniform(0, 140, n_samples),
-        'P': np.random.uniform(5, 145, n_samples),
-        'K': np.random.uniform(5, 205, n_samples),
-        'temperature': np.random.uniform(8, 45, n_samples),
-        'humidity': np.random.uniform(14, 100, n_samples),
-        'ph': np.random.uniform(3.5, 10, n_samples),
-        'soil_type': np.random.choice(SOIL_TYPES, n_samples),
-        'season': np.random.choice(SEASONS, n_samples),
-        'crop_duration': np.random.choice(CROP_DURATIONS, n_samples),
-        'previous_crop': np.random.choice(CROPS + ['Fallow'], n_samples)
-    }
+TRAINING_CHUNK_SIZE = 250_000
+
+CROP_CATEGORICAL_COLS = ['soil_type', 'season', 'crop_duration', 'previous_crop']
+CROP_FEATURE_COLS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph'] + CROP_CATEGORICAL_COLS
+YIELD_CATEGORICAL_COLS = CROP_CATEGORICAL_COLS + ['crop']
+YIELD_FEATURE_COLS = CROP_FEATURE_COLS + ['crop']
+
+def _codes(values, vocabulary):
+    return np.array([vocabulary.index(v) for v in values])
+
+def _generate_chunk(seed_seq, n_samples):
+    rng = np.random.default_rng(seed_seq)
+    previous_crops = CROPS + ['Fallow']
     
-    crops = []
-    yields = []
+    # Categorical columns are drawn as integer codes and only wrapped as
+    # pandas categoricals at the end, which avoids building string arrays.
+    n = rng.uniform(0, 140, n_samples)
+    p = rng.uniform(5, 145, n_samples)
+    k = rng.uniform(5, 205, n_samples)
+    temp = rng.uniform(8, 45, n_samples)
+    hum = rng.uniform(14, 100, n_samples)
+    ph = rng.uniform(3.5, 10, n_samples)
+    soil = rng.integers(0, len(SOIL_TYPES), n_samples)
+    season = rng.integers(0, len(SEASONS), n_samples)
+    duration = rng.integers(0, len(CROP_DURATIONS), n_samples)
+    previous = rng.integers(0, len(previous_crops), n_samples)
+    short_pick = rng.choice(_codes(['Tomato', 'Onion', 'Cabbage', 'Carrot'], CROPS), n_samples)
+    long_pick = rng.choice(_codes(['Mango', 'Sugarcane', 'Cotton'], CROPS), n_samples)
+    noise = rng.normal(0, 5, n_samples)
     
-    for i in range(n_samples):
-        n, p, k = data['N'][i], data['P'][i], data['K'][i]
-        temp, hum, ph = data['temperature'][i], data['humidity'][i], data['ph'][i]
-        soil = data['soil_type'][i]
-        season = data['season'][i]
-        duration = data['crop_duration'][i]
-        
-        if temp > 25 and hum > 60 and season == 'Kharif (Monsoon)':
-            if n > 80 and soil in ['Clay', 'Clay Loam']:
-                crop = 'Rice'
-            elif n > 60 and p > 40:
-                crop = 'Maize'
-            else:
-                crop = 'Cotton'
-        elif temp < 25 and season == 'Rabi (Winter)':
-            if n > 100 and ph > 6:
-                crop = 'Wheat'
-            elif p > 60:
-                crop = 'Potato'
-            else:
-                crop = 'Peas'
-        elif season == 'Zaid (Summer)':
-            if temp > 30:
-                crop = 'Watermelon'
-            elif hum < 50:
-                crop = 'Sunflower'
-            else:
-                crop = 'Cucumber'
-        else:
-            if soil in ['Sandy', 'Sandy Loam'] and temp > 20:
-                crop = 'Groundnut'
-            elif k > 100:
-                crop = 'Sugarcane'
-            elif duration == 'Short-term (< 4 months)':
-                crop = np.random.choice(['Tomato', 'Onion', 'Cabbage', 'Carrot'])
-            else:
-                crop = np.random.choice(['Mango', 'Sugarcane', 'Cotton'])
-        
-        base_yield = 25
-        yield_val = base_yield + (n/10) + (p/15) + (k/20) - abs(ph - 6.5) * 3
-        yield_val += np.random.normal(0, 5)
-        yield_val = max(10, min(60, yield_val))
+    kharif = (temp > 25) & (hum > 60) & (season == SEASONS.index('Kharif (Monsoon)'))
+    rabi = (temp < 25) & (season == SEASONS.index('Rabi (Winter)'))
+    zaid = season == SEASONS.index('Zaid (Summer)')
+    clay = np.isin(soil, _codes(['Clay', 'Clay Loam'], SOIL_TYPES))
+    sandy = np.isin(soil, _codes(['Sandy', 'Sandy Loam'], SOIL_TYPES))
+    short_term = duration == CROP_DURATIONS.index('Short-term (< 4 months)')
+    
+    # np.select takes the first matching rule, mirroring the original if/elif chain.
+    rules = [
+        (kharif & (n > 80) & clay, 'Rice'),
+        (kharif & (n > 60) & (p > 40), 'Maize'),
+        (kharif, 'Cotton'),
+        (rabi & (n > 100) & (ph > 6), 'Wheat'),
+        (rabi & (p > 60), 'Potato'),
+        (rabi, 'Peas'),
+        (zaid & (temp > 30), 'Watermelon'),
+        (zaid & (hum < 50), 'Sunflower'),
+        (zaid, 'Cucumber'),
+        (sandy & (temp > 20), 'Groundnut'),
+        (k > 100, 'Sugarcane'),
+    ]
+    crop = np.select(
+        [cond for cond, _ in rules] + [short_term],
+        [CROPS.index(name) for _, name in rules] + [short_pick],
+        long_pick
+    )
+    
+    base_yield = 25
+    yield_val = base_yield + (n/10) + (p/15) + (k/20) - np.abs(ph - 6.5) * 3 + noise
+    yield_val = np.clip(yield_val, 10, 60)
+    
+    return pd.DataFrame({
+        'N': n, 'P': p, 'K': k,
+        'temperature': temp, 'humidity': hum, 'ph': ph,
+        'soil_type': pd.Categorical.from_codes(soil, SOIL_TYPES),
+        'season': pd.Categorical.from_codes(season, SEASONS),
+        'crop_duration': pd.Categorical.from_codes(duration, CROP_DURATIONS),
+        'previous_crop': pd.Categorical.from_codes(previous, previous_crops),
+        'crop': pd.Categorical.from_codes(crop, CROPS),
+        'yield': yield_val
+    })
+
+def _chunk_plan(n_samples, seed):
+    sizes = [min(TRAINING_CHUNK_SIZE, n_samples - start)
+             for start in range(0, n_samples, TRAINING_CHUNK_SIZE)]
+    return np.random.SeedSequence(seed).spawn(len(sizes)), sizes
+
+def generate_training_data(n_samples=2000, seed=42, n_jobs=1):
+    """Generate synthetic training rows in fixed-size chunks.
+    
+    Chunk i always draws from the i-th child of SeedSequence(seed), so the
+    output for a given seed is the same however many processes build it.
+    """
+    seeds, sizes = _chunk_plan(n_samples, seed)
+    if not sizes:
+        return _generate_chunk(np.random.SeedSequence(seed), 0)
+    
+    if n_jobs == 1 or len(sizes) < 2:
+        chunks = [_generate_chunk(s, size) for s, size in zip(seeds, sizes)]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        workers = None if n_jobs == -1 else n_jobs
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks = list(pool.map(_generate_chunk, seeds, sizes))
+    
+    return pd.concat(chunks, ignore_index=True)
+
+def iter_training_data(n_samples=2000, seed=42):
+    """The chunks generate_training_data() concatenates, one at a time."""
+    for s, size in zip(*_chunk_plan(n_samples, seed)):
+        yield _generate_chunk(s, size)
+
+def to_frame(data, feature_cols):
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, np.ndarray):
+        return pd.DataFrame(np.atleast_2d(data), columns=feature_cols)
+    return pd.DataFrame.from_records(list(data))
+
+def encode_features(data, feature_cols, label_encoders):
+    """Build the model input for a whole batch, encoding each categorical
+    column in one vectorized vocabulary lookup."""
+    return FeatureEncoder(feature_cols, label_encoders).transform(to_frame(data, feature_cols))
+
+class TrainingData:
+    """Training rows encoded once for both models.
+    
+    The inputs are a single column-major float32 matrix in the yield model's
+    column order. The crop model's inputs are its leading columns and its
+    labels are the crop column, so both models read the same memory, and
+    scikit-learn takes float32 without making its own copy. The vocabularies
+    are fitted once and shared by the two encoders.
+    
+    With `shared=True` the arrays are built in shared memory segments, and
+    pickling sends only the segment names, so worker processes map the
+    same pages rather than holding copies. Call release() afterwards.
+    """
+    
+    ARRAYS = ('X', 'crop_labels', 'yields')
+    
+    def __init__(self, df, shared=False):
+        vocabularies = {
+            col: Vocabulary.fit(df[col], name=col, unknown=UNKNOWN_CATEGORY) for col in YIELD_CATEGORICAL_COLS
+        }
+        # As before, the crop model's classes are the crops that occur.
+        target = Vocabulary(vocabularies['crop'].categories, name='crop')
+        self.crop_encoder = FeatureEncoder(
+            CROP_FEATURE_COLS, {col: vocabularies[col] for col in CROP_CATEGORICAL_COLS}, target
+        )
+        self.yield_encoder = FeatureEncoder(YIELD_FEATURE_COLS, vocabularies)
         
-        crops.append(crop)
-        yields.append(yield_val)
+        self._segments = {}
+        self._owner = shared
+        n_rows = len(df)
+        self.X = self._allocate('X', (n_rows, len(YIELD_FEATURE_COLS)), np.float32, 'F')
+        self.yield_encoder.matrix(df, out=self.X)
+        self.crop_labels = self._allocate('crop_labels', (n_rows,), np.intp)
+        self.crop_labels[:] = self.X[:, -1]
+        self.yields = self._allocate('yields', (n_rows,), np.float64)
+        self.yields[:] = df['yield']
     
-    data['crop'] = crops
-    data['yield'] = yields
+    def _allocate(self, name, shape, dtype, order='C'):
+        if not self._owner:
+            return np.empty(shape, dtype=dtype, order=order)
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        segment = self._segments[name] = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        return np.ndarray(shape, dtype=dtype, buffer=segment.buf, order=order)
     
-    return pd.DataFrame(data)
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._segments:
+            state['_segments'] = {
+                name: (segment.name, getattr(self, name).shape, getattr(self, name).dtype.str,
+                       'F' if getattr(self, name).flags.f_contiguous and getattr(self, name).ndim > 1 else 'C')
+                for name, segment in self._segments.items()
+            }
+            for name in self.ARRAYS:
+                del state[name]
+        return state
+    
+    def __setstate__(self, state):
+        segments = state.pop('_segments', None) or {}
+        self.__dict__.update(state, _segments={}, _owner=False)
+        for name, (segment_name, shape, dtype, order) in segments.items():
+            segment = self._segments[name] = shared_memory.SharedMemory(name=segment_name)
+            setattr(self, name, np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf, order=order))
+    
+    def release(self):
+        """Free the shared memory segments (owner) or detach from them."""
+        for name in self.ARRAYS:
+            setattr(self, name, None)
+        for segment in self._segments.values():
+            if self._owner:
+                segment.unlink()
+            try:
+                segment.close()
+            except BufferError:
+                # A view is still alive somewhere; the mapping goes with it.
+                pass
+        self._segments = {}
+    
+    def __len__(self):
+        return len(self.X)
+    
+    def yield_inputs(self):
+        # A DataFrame view keeps the feature names on the fitted forests.
+        return pd.DataFrame(self.X, columns=YIELD_FEATURE_COLS, copy=False)
+    
+    def crop_inputs(self):
+        return self.yield_inputs().iloc[:, :len(CROP_FEATURE_COLS)]
+
+crop_prediction_cache = PredictionCache()
+# Which path answered CropRecommendationModel.predict and how long it took
+crop_serving_stats = ServingStats()
+yield_prediction_cache = PredictionCache()
+
+def refresh_cache_token(wrapper):
+    # Cached predictions are keyed on this token, so it must change whenever
+    # the wrapper's forest or fast path does, including on copies.
+    wrapper.cache_token = uuid.uuid4().hex
+
+def cache_key(wrapper, input_data):
+    return normalize_key(input_data, (getattr(wrapper, 'version', None), getattr(wrapper, 'cache_token', None)))
+
+def select_forest(wrapper, n_rows):
+    if not USE_COMPILED_FOREST or n_rows > COMPILED_FOREST_MAX_ROWS:
+        return wrapper.model
+    if getattr(wrapper, 'compiled_model', None) is None:
+        # Artifacts from forest_compression use the float32/uint16 engine
+        wrapper.compiled_model = compile_forest(wrapper.model, compact=getattr(wrapper, 'compact', False))
+    return wrapper.compiled_model
 
 class CropRecommendationModel:
     def __init__(self):
@@ -180,49 +366,71 @@ class CropRecommendationModel:
         self.label_encoders = {}
         self.is_trained = False
     
-    def train(self, df):
-        categorical_cols = ['soil_type', 'season', 'crop_duration', 'previous_crop']
-        df_encoded = df.copy()
+    def train(self, data):
+        """Fit on a training frame or on TrainingData shared with the yield model."""
+        if not isinstance(data, TrainingData):
+            data = TrainingData(data)
         
-        for col in categorical_cols:
-            self.label_encoders[col] = LabelEncoder()
-            df_encoded[col] = self.label_encoders[col].fit_transform(df[col])
+        self.encoder = data.crop_encoder
+        self.label_encoders = self.encoder.vocabularies
+        self.crop_encoder = self.encoder.target
         
-        self.crop_encoder = LabelEncoder()
-        y = self.crop_encoder.fit_transform(df['crop'])
-        
-        feature_cols = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 
-                       'soil_type', 'season', 'crop_duration', 'previous_crop']
-        X = df_encoded[feature_cols]
-        
-        self.model.fit(X, y)
+        self.model.fit(data.crop_inputs(), data.crop_labels)
+        self.compiled_model = None
+        refresh_cache_token(self)
         self.is_trained = True
-        self.feature_cols = feature_cols
+        self.feature_cols = CROP_FEATURE_COLS
     
     def predict(self, input_data):
         if not self.is_trained:
             return None
         
-        df = pd.DataFrame([input_data])
-        for col in ['soil_type', 'season', 'crop_duration', 'previous_crop']:
-            if col in self.label_encoders:
-                try:
-                    df[col] = self.label_encoders[col].transform(df[col])
-                except ValueError:
-                    df[col] = 0
+        key = cache_key(self, input_data)
         
-        X = df[self.feature_cols]
-        prediction = self.model.predict(X)
-        probabilities = self.model.predict_proba(X)[0]
+        start = time.perf_counter()
+        path = 'cache'
         
-        top_indices = np.argsort(probabilities)[-3:][::-1]
-        top_crops = self.crop_encoder.inverse_transform(top_indices)
-        top_probs = probabilities[top_indices]
+        def answer():
+            nonlocal path
+            result, path = self._predict_one(input_data)
+            return result
         
-        return {
-            'recommended_crop': self.crop_encoder.inverse_transform(prediction)[0],
-            'top_3_crops': list(zip(top_crops, top_probs))
-        }
+        result = crop_prediction_cache.get_or_compute(key, answer)
+        crop_serving_stats.record(path, time.perf_counter() - start)
+        # A copy, so callers cannot change the cached entry
+        return dict(result, top_3_crops=list(result['top_3_crops']))
+    
+    def _predict_one(self, input_data):
+        """Answer from the distilled student when it is confident, otherwise
+        from the forest. Returns the result and which of the two answered."""
+        X = self.encoder.transform(to_frame([input_data], self.feature_cols))
+        fast_path = getattr(self, 'fast_path', None)
+        if fast_path is not None:
+            probabilities = fast_path.predict_proba(X)
+            if fast_path.confident(probabilities)[0]:
+                return self._results(probabilities)[0], 'student'
+        return self._results(select_forest(self, 1).predict_proba(X))[0], 'forest'
+    
+    def predict_batch(self, data):
+        if not self.is_trained:
+            return None
+        
+        X = self.encoder.transform(to_frame(data, self.feature_cols))
+        return self._results(select_forest(self, len(X)).predict_proba(X))
+    
+    def _results(self, probabilities):
+        top_indices = np.argsort(probabilities, axis=1)[:, -3:][:, ::-1]
+        top_probs = np.take_along_axis(probabilities, top_indices, axis=1)
+        top_crops = self.crop_encoder.decode(top_indices)
+        recommended = self.crop_encoder.decode(np.argmax(probabilities, axis=1))
+        
+        return [
+            {
+                'recommended_crop': recommended[i],
+                'top_3_crops': list(zip(top_crops[i], top_probs[i]))
+            }
+            for i in range(len(probabilities))
+        ]
 
 class YieldPredictionModel:
     def __init__(self):
@@ -230,39 +438,35 @@ class YieldPredictionModel:
         self.label_encoders = {}
         self.is_trained = False
     
-    def train(self, df):
-        categorical_cols = ['soil_type', 'season', 'crop_duration', 'previous_crop', 'crop']
-        df_encoded = df.copy()
+    def train(self, data):
+        """Fit on a training frame or on TrainingData shared with the crop model."""
+        if not isinstance(data, TrainingData):
+            data = TrainingData(data)
         
-        for col in categorical_cols:
-            self.label_encoders[col] = LabelEncoder()
-            df_encoded[col] = self.label_encoders[col].fit_transform(df[col])
+        self.encoder = data.yield_encoder
+        self.label_encoders = self.encoder.vocabularies
         
-        feature_cols = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 
-                       'soil_type', 'season', 'crop_duration', 'previous_crop', 'crop']
-        X = df_encoded[feature_cols]
-        y = df['yield']
-        
-        self.model.fit(X, y)
+        self.model.fit(data.yield_inputs(), data.yields)
+        self.compiled_model = None
+        refresh_cache_token(self)
         self.is_trained = True
-        self.feature_cols = feature_cols
+        self.feature_cols = YIELD_FEATURE_COLS
     
     def predict(self, input_data):
         if not self.is_trained:
             return None
         
-        df = pd.DataFrame([input_data])
-        for col in ['soil_type', 'season', 'crop_duration', 'previous_crop', 'crop']:
-            if col in self.label_encoders:
-                try:
-                    df[col] = self.label_encoders[col].transform(df[col])
-                except ValueError:
-                    df[col] = 0
-        
-        X = df[self.feature_cols]
-        prediction = self.model.predict(X)[0]
+        key = cache_key(self, input_data)
+        return yield_prediction_cache.get_or_compute(
+            key, lambda: self.predict_batch([input_data])[0]
+        )
+    
+    def predict_batch(self, data):
+        if not self.is_trained:
+            return None
         
-        return round(prediction, 2)
+        X = self.encoder.transform(to_frame(data, self.feature_cols))
+        return np.round(select_forest(self, len(X)).predict(X), 2)
 
 def get_fertilizer_recommendation(crop, stage, fertilizer_type='organic'):
     if fertilizer_type.lower() == 'organic':
@@ -286,22 +490,160 @@ def get_multi_crop_recommendation(main_crop):
 
 crop_model = None
 yield_model = None
+model_manifest = None
+_models_lock = threading.Lock()
 
-def initialize_models():
-    global crop_model, yield_model
+def training_spec():
+    return {
+        'model_version': MODEL_VERSION,
+        'n_samples': TRAINING_SAMPLES,
+        'sklearn': sklearn.__version__
+    }
+
+def _crop_rows(crop_codes, block):
+    # Shard rows hold the yield model's inputs (crop code last) and the yield.
+    X = pd.DataFrame(block[:, :-2], columns=CROP_FEATURE_COLS)
+    return X, crop_codes[block[:, -2].astype(np.intp)]
+
+def _yield_rows(block):
+    return pd.DataFrame(block[:, :-1], columns=YIELD_FEATURE_COLS), block[:, -1]
+
+def train_wrapper_streaming(wrapper, encoder, dataset, prepare, classes=None, n_jobs=None):
+    wrapper.encoder = encoder
+    wrapper.label_encoders = encoder.vocabularies
+    if encoder.target is not None:
+        wrapper.crop_encoder = encoder.target
+    wrapper.feature_cols = encoder.feature_cols
+    grow_from_shards(wrapper.model, dataset, wrapper.model.n_estimators, prepare, classes, n_jobs=n_jobs)
+    wrapper.compiled_model = None
+    refresh_cache_token(wrapper)
+    wrapper.is_trained = True
+    return wrapper
+
+def train_models_streaming(n_samples, seed=42, cores=None):
+    """Train both models without holding the training data in memory.
+    
+    The synthetic rows are generated chunk by chunk, encoded and written to
+    on-disk shards (streaming_training), and each forest is grown one shard
+    at a time. Returns the two models, the (data hash, row count) of the
+    generated data and the manifest fields describing the run.
+    """
+    vocabularies = {
+        col: Vocabulary.fit(values, name=col, unknown=UNKNOWN_CATEGORY)
+        for col, values in [('soil_type', SOIL_TYPES), ('season', SEASONS),
+                            ('crop_duration', CROP_DURATIONS),
+                            ('previous_crop', CROPS + ['Fallow']), ('crop', CROPS)]
+    }
+    yield_encoder = FeatureEncoder(YIELD_FEATURE_COLS, vocabularies)
+    digest = hashlib.sha256()
+    seen_crops = np.zeros(len(CROPS), dtype=bool)
+    
+    with ShardedDataset(len(YIELD_FEATURE_COLS) + 1, shards_for(n_samples)) as dataset:
+        for chunk in iter_training_data(n_samples, seed):
+            digest.update(row_hashes(chunk))
+            X = yield_encoder.transform(chunk).to_numpy(dtype=np.float32)
+            seen_crops[X[:, -1].astype(np.intp)] = True
+            dataset.add(np.column_stack([X, chunk['yield'].to_numpy(dtype=np.float32)]))
+        
+        # As in train(), the crop model's classes are the crops that occur.
+        crop_vocabulary = vocabularies['crop']
+        target = Vocabulary(crop_vocabulary.decode(np.flatnonzero(seen_crops)), name='crop')
+        crop_codes = np.full(len(CROPS), -1)
+        crop_codes[seen_crops] = np.arange(len(target))
+        crop_encoder = FeatureEncoder(
+            CROP_FEATURE_COLS, {col: vocabularies[col] for col in CROP_CATEGORICAL_COLS}, target
+        )
+        prepare_crop = partial(_crop_rows, crop_codes)
+        
+        report = train_concurrently([
+            TrainingJob('crop_model', train_wrapper_streaming,
+                        (CropRecommendationModel(), crop_encoder, dataset, prepare_crop,
+                         np.arange(len(target))), weight=1),
+            TrainingJob('yield_model', train_wrapper_streaming,
+                        (YieldPredictionModel(), yield_encoder, dataset, _yield_rows), weight=2)
+        ], cores)
+        models = report['crop_model']['result'], report['yield_model']['result']
+        streaming = {
+            'shards': dataset.n_shards,
+            'train_rows': dataset.train_rows,
+            'crop_model': evaluate(models[0].model, dataset, prepare_crop),
+            'yield_model': evaluate(models[1].model, dataset, _yield_rows),
+            'peak_rss_mb': peak_rss_mb()
+        }
     
-    df = generate_training_data(2000)
+    extra = {'training': timings(report), 'streaming': streaming}
+    return models[0], models[1], (digest.hexdigest(), n_samples), extra
+
+def initialize_models(cores=None):
+    global crop_model, yield_model, model_manifest
     
-    crop_model = CropRecommendationModel()
-    crop_model.train(df)
+    if TRAINING_SAMPLES > TRAINING_STREAM_ROWS:
+        crop_model, yield_model, data, extra = train_models_streaming(TRAINING_SAMPLES, cores=cores)
+    else:
+        df = generate_training_data(TRAINING_SAMPLES)
+        # Only the encoded matrix is kept while the forests train.
+        data = (data_hash(df), len(df))
+        shared = TrainingData(df, shared=TRAINING_SHARED_MEMORY and uses_processes(2, cores))
+        del df
+        
+        # Both forests train at the same time, each on its share of the cores.
+        # The regressor takes about twice as long, so it gets twice the share.
+        try:
+            report = train_concurrently([
+                TrainingJob('crop_model', train_wrapper, (CropRecommendationModel(), shared), weight=1),
+                TrainingJob('yield_model', train_wrapper, (YieldPredictionModel(), shared), weight=2)
+            ], cores)
+        finally:
+            shared.release()
+        crop_model = report['crop_model']['result']
+        yield_model = report['yield_model']['result']
+        extra = {'training': timings(report), 'peak_rss_mb': peak_rss_mb()}
     
-    yield_model = YieldPredictionModel()
-    yield_model.train(df)
+    model_manifest = save_artifact(
+        {'crop_model': crop_model, 'yield_model': yield_model}, data, training_spec(), extra=extra
+    )
+    set_model_version(model_manifest['version'])
     
     return crop_model, yield_model
 
-def get_models():
+def load_models():
+    global crop_model, yield_model, model_manifest
+    
+    loaded = load_latest(training_spec())
+    if loaded is None:
+        return False
+    
+    models, model_manifest = loaded
+    crop_model, yield_model = models['crop_model'], models['yield_model']
+    set_model_version(model_manifest['version'])
+    return True
+
+remote_models = None
+
+def get_remote_models():
+    global remote_models
+    if remote_models is None:
+        from inference_server import RemoteModel
+        remote_models = (
+            RemoteModel(INFERENCE_SIDECAR_URL, 'crop', CROP_FEATURE_COLS),
+            RemoteModel(INFERENCE_SIDECAR_URL, 'yield', YIELD_FEATURE_COLS)
+        )
+    return remote_models
+
+def set_model_version(version):
+    # Cache keys carry the model version; clearing also frees the old entries.
+    crop_model.version = version
+    yield_model.version = version
+    crop_prediction_cache.clear()
+    yield_prediction_cache.clear()
+
+def get_models(use_sidecar=True):
     global crop_model, yield_model
+    if use_sidecar and INFERENCE_SIDECAR_URL:
+        return get_remote_models()
     if crop_model is None or yield_model is None:
-        initialize_models()
+        with _models_lock:
+            if crop_model is None or yield_model is None:
+                if not load_models():
+                    initialize_models()
     return crop_model, yield_model
@@ -0,0 +1,156 @@
+"""
+Versioned on-disk artifact store for the trained crop and yield models
+"""
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+import pandas as pd
+
+MODEL_STORE_DIR = os.environ.get(
+    "MODEL_STORE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_store")
+)
+MODEL_STORE_KEEP = int(os.environ.get("MODEL_STORE_KEEP", "3"))
+
+MANIFEST_FILE = "manifest.json"
+MODELS_FILE = "models.pkl"
+ENCODERS_FILE = "encoders.json"
+
+
+def row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).values.tobytes()
+
+
+def data_hash(df):
+    return hashlib.sha256(row_hashes(df)).hexdigest()
+
+
+def list_artifacts(store_dir=None):
+    store_dir = store_dir or MODEL_STORE_DIR
+    if not os.path.isdir(store_dir):
+        return []
+    versions = [
+        name for name in os.listdir(store_dir)
+        if os.path.isfile(os.path.join(store_dir, name, MANIFEST_FILE))
+    ]
+    return sorted(versions, reverse=True)
+
+
+def read_manifest(version, store_dir=None):
+    store_dir = store_dir or MODEL_STORE_DIR
+    with open(os.path.join(store_dir, version, MANIFEST_FILE)) as f:
+        return json.load(f)
+
+
+def save_artifact(models, df, spec, store_dir=None, extra=None):
+    """`df` is the training frame, or a (data hash, row count) pair for data
+    that was streamed in chunks."""
+    store_dir = store_dir or MODEL_STORE_DIR
+    os.makedirs(store_dir, exist_ok=True)
+
+    if isinstance(df, pd.DataFrame):
+        digest, n_rows = data_hash(df), len(df)
+    else:
+        digest, n_rows = df
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{digest[:8]}"
+    manifest = {
+        'version': version,
+        'data_hash': digest,
+        'n_rows': n_rows,
+        'spec': spec,
+        'models': sorted(models),
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+    manifest.update(extra or {})
+
+    # Write into a scratch directory and rename it into place so readers
+    # never observe a half-written artifact.
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=store_dir)
+    try:
+        with open(os.path.join(tmp_dir, MODELS_FILE), 'wb') as f:
+            pickle.dump(models, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # The vocabularies are also kept as JSON so other tools can encode
+        # inputs for this artifact without unpickling the models.
+        encoders = {
+            name: model.encoder.to_dict()
+            for name, model in models.items() if getattr(model, 'encoder', None) is not None
+        }
+        if encoders:
+            with open(os.path.join(tmp_dir, ENCODERS_FILE), 'w') as f:
+                json.dump(encoders, f, indent=2)
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_dir, os.path.join(store_dir, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    prune_artifacts(store_dir)
+    return manifest
+
+
+def save_derived_artifact(models, parent, extra=None, store_dir=None):
+    """Publish models derived from the artifact with manifest `parent` (e.g.
+    compressed or distilled) under the same data and training spec. The
+    incremental-training checkpoint carries over."""
+    inherited = {key: parent[key] for key in ('checkpoint', 'trained_rows') if key in parent}
+    return save_artifact(
+        models, (parent['data_hash'], parent['n_rows']), parent['spec'], store_dir,
+        extra=dict(inherited, parent=parent['version'], **(extra or {}))
+    )
+
+
+def load_artifact(version, store_dir=None):
+    store_dir = store_dir or MODEL_STORE_DIR
+    manifest = read_manifest(version, store_dir)
+    with open(os.path.join(store_dir, version, MODELS_FILE), 'rb') as f:
+        models = pickle.load(f)
+    return models, manifest
+
+
+def load_latest(spec, store_dir=None):
+    """Return (models, manifest) for the newest artifact built from `spec`,
+    or None when the store is empty or only holds stale artifacts."""
+    for version in list_artifacts(store_dir):
+        try:
+            if read_manifest(version, store_dir).get('spec') != spec:
+                continue
+            return load_artifact(version, store_dir)
+        except (OSError, ValueError, pickle.UnpicklingError, AttributeError, EOFError, ImportError):
+            # Unreadable, or pickled against code that has since moved;
+            # an older artifact or a retrain will do.
+            continue
+    return None
+
+
+def prune_artifacts(store_dir=None, keep=None):
+    store_dir = store_dir or MODEL_STORE_DIR
+    keep = MODEL_STORE_KEEP if keep is None else keep
+    for version in list_artifacts(store_dir)[keep:]:
+        shutil.rmtree(os.path.join(store_dir, version), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    import ml_models
+
+    ml_models.initialize_models()
+    manifest = ml_models.model_manifest
+    print(f"Exported model artifact {manifest['version']} "
+          f"({manifest['n_rows']} rows, data hash {manifest['data_hash'][:12]}) "
+          f"to {MODEL_STORE_DIR}")
+    for name, entry in manifest['training'].items():
+        print(f"  {name}: {entry['n_jobs']} core(s), wall {entry['wall_seconds']:.2f} s, "
+              f"CPU {entry['cpu_seconds']:.2f} s")
+    if manifest.get('peak_rss_mb') is not None:
+        print(f"  peak RSS {manifest['peak_rss_mb']:.0f} MB")
+    if 'streaming' in manifest:
+        streaming = manifest['streaming']
+        peak = streaming['peak_rss_mb']
+        print(f"  streamed through {streaming['shards']} shard(s): crop accuracy "
+              f"{streaming['crop_model']['accuracy']:.4f}, yield R² {streaming['yield_model']['r2']:.4f}, "
+              f"peak RSS {'unavailable' if peak is None else f'{peak:.0f} MB'}")
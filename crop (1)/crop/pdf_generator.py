@@ -10,6 +10,11 @@ from reportlab.platypus.flowables import HRFlowable
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from io import BytesIO
 from datetime import datetime
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import threading
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')
@@ -47,14 +52,16 @@ def create_styles():
         fontName='Helvetica-Bold'
     ))
     
-    styles.add(ParagraphStyle(
+    # getSampleStyleSheet() already defines BodyText, which add() refuses
+    # to redefine, so replace it directly.
+    styles.byName['BodyText'] = ParagraphStyle(
         name='BodyText',
         parent=styles['Normal'],
         fontSize=11,
         textColor=colors.HexColor('#333333'),
         spaceAfter=8,
         leading=14
-    ))
+    )
     
     styles.add(ParagraphStyle(
         name='SmallText',
@@ -366,3 +373,53 @@ def generate_farm_overview_pdf(data):
     doc.build(story)
     buffer.seek(0)
     return buffer
+
+
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+class PDFCache:
+    """Content-addressed cache of rendered reports, evicting the least
+    recently used PDFs once the total size exceeds max_bytes."""
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def key(generator, data):
+        payload = json.dumps(data, sort_keys=True, default=str)
+        return hashlib.sha256(f"{generator.__name__}:{payload}".encode()).hexdigest()
+    
+    def get_or_build(self, generator, data):
+        key = self.key(generator, data)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        
+        pdf_bytes = generator(data).getvalue()
+        
+        with self._lock:
+            if key not in self._entries and len(pdf_bytes) <= self.max_bytes:
+                self._entries[key] = pdf_bytes
+                self.total_bytes += len(pdf_bytes)
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.total_bytes -= len(evicted)
+        return pdf_bytes
+
+
+pdf_cache = PDFCache()
+
+
+def lazy_pdf(generator, data):
+    """Return a zero-argument callable for st.download_button, so the report
+    is only rendered (or fetched from the cache) when it is downloaded."""
+    return lambda: pdf_cache.get_or_build(generator, data)
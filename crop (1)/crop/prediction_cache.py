@@ -0,0 +1,82 @@
+"""
+Bounded LRU/TTL cache for model predictions
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from numbers import Number
+
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "4096"))
+PREDICTION_CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+
+
+def _normalize_value(value):
+    if isinstance(value, Number):
+        return round(float(value), 6)
+    return str(value)
+
+
+def normalize_key(values, version=None):
+    """Turn model inputs into a hashable key. Floats are rounded so slider
+    values such as 6.499999999 and 6.5 share an entry. Dicts are keyed by
+    their (name, value) pairs, so inputs with other fields never collide."""
+    if isinstance(values, dict):
+        return (version,) + tuple((str(name), _normalize_value(values[name])) for name in sorted(values, key=str))
+    return (version,) + tuple(_normalize_value(value) for value in values)
+
+
+class PredictionCache:
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = PREDICTION_CACHE_SIZE if maxsize is None else maxsize
+        self.ttl = PREDICTION_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
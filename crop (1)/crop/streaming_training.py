@@ -0,0 +1,194 @@
+"""
+Out-of-core training for datasets larger than memory
+
+Rows arrive in chunks and are scattered at random over float32 shard files
+on disk, with a held-out test share split off as they pass. Scaling
+statistics and column means are updated chunk by chunk. The forest is then
+grown shard by shard (warm_start), so at most one shard is in memory at a
+time and every tree sees a random sample of the whole dataset, however the
+source was ordered. Past STREAM_SHARD_ROWS rows per shard, trees train on a
+sample of their shard, which keeps both memory and forest size bounded.
+"""
+import math
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+from sklearn.base import is_classifier
+from sklearn.preprocessing import MinMaxScaler
+
+from training_orchestrator import grow_forest
+
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", "100000"))
+STREAM_SHARD_ROWS = int(os.environ.get("STREAM_SHARD_ROWS", "500000"))
+STREAM_WORK_DIR = os.environ.get("STREAM_WORK_DIR") or None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process or its largest finished worker
+    process, in MB. None where the resource module is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = max(resource.getrusage(who).ru_maxrss
+               for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+
+def format_peak_rss():
+    peak = peak_rss_mb()
+    return "unavailable" if peak is None else f"{peak:.0f} MB"
+
+
+def shards_for(n_rows, shard_rows=None, test_size=0.2):
+    shard_rows = shard_rows or STREAM_SHARD_ROWS
+    return max(1, math.ceil(n_rows * (1 - test_size) / shard_rows))
+
+
+class ShardedDataset:
+    """Float32 rows of `n_columns` values spread over `n_shards` files in a
+    scratch directory, removed by close() (or on leaving a `with` block)."""
+
+    def __init__(self, n_columns, n_shards, test_size=0.2, work_dir=None, random_state=42):
+        self.n_columns = n_columns
+        self.n_shards = n_shards
+        self.test_size = test_size
+        self.work_dir = tempfile.mkdtemp(prefix='stream-', dir=work_dir or STREAM_WORK_DIR)
+        self.rng = np.random.default_rng(random_state)
+        self.shard_rows = np.zeros(n_shards, dtype=np.int64)
+        self.test_rows = 0
+        self.scaler = MinMaxScaler()
+        self.sums = np.zeros(n_columns)
+        self.counts = np.zeros(n_columns, dtype=np.int64)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _path(self, name):
+        return os.path.join(self.work_dir, f"{name}.f32")
+
+    def _append(self, name, rows):
+        with open(self._path(name), 'ab') as f:
+            np.ascontiguousarray(rows, dtype=np.float32).tofile(f)
+
+    def _read(self, name):
+        return np.memmap(self._path(name), dtype=np.float32, mode='r').reshape(-1, self.n_columns)
+
+    @property
+    def train_rows(self):
+        return int(self.shard_rows.sum())
+
+    def add(self, rows):
+        """Split a chunk between the test file and random training shards,
+        updating the statistics with its training rows. NaN marks a missing
+        value."""
+        rows = np.asarray(rows, dtype=np.float32)
+        test = self.rng.random(len(rows)) < self.test_size
+        if test.any():
+            self._append('test', rows[test])
+            self.test_rows += int(test.sum())
+        train = rows[~test]
+        if not len(train):
+            return
+
+        self.scaler.partial_fit(train)
+        self.sums += np.nansum(train, axis=0, dtype=np.float64)
+        self.counts += np.count_nonzero(~np.isnan(train), axis=0)
+
+        shard = self.rng.integers(self.n_shards, size=len(train))
+        order = np.argsort(shard, kind='stable')
+        bounds = np.searchsorted(shard[order], np.arange(self.n_shards + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            self._append(i, train[order[bounds[i]:bounds[i + 1]]])
+            self.shard_rows[i] += bounds[i + 1] - bounds[i]
+
+    def column_means(self):
+        """Mean of each column over the training rows (NaN if it had none)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.sums / self.counts
+
+    def scaler_for(self, columns):
+        """A MinMaxScaler over `columns` with the ranges seen in the stream."""
+        return MinMaxScaler().fit(np.vstack([
+            self.scaler.data_min_[columns], self.scaler.data_max_[columns]
+        ]))
+
+    def shard(self, i, max_rows=None):
+        """Rows of shard `i`, or a uniform sample of `max_rows` of them."""
+        if not self.shard_rows[i]:
+            return np.empty((0, self.n_columns), dtype=np.float32)
+        data = self._read(i)
+        if max_rows and len(data) > max_rows:
+            return data[np.sort(self.rng.choice(len(data), max_rows, replace=False))]
+        return np.array(data)
+
+    def test_batches(self, batch_rows=None):
+        if not self.test_rows:
+            return
+        data = self._read('test')
+        batch_rows = batch_rows or STREAM_CHUNK_ROWS
+        for start in range(0, len(data), batch_rows):
+            yield np.array(data[start:start + batch_rows])
+
+
+def grow_from_shards(forest, dataset, n_trees, prepare, classes=None, max_rows=None, n_jobs=None):
+    """Grow `forest` to `n_trees` trees, fitting each batch of trees on one
+    shard. `prepare` turns a block of shard rows into (X, y); `classes` is
+    passed on to grow_forest for classifiers."""
+    shards = np.flatnonzero(dataset.shard_rows)[:n_trees]
+    if not len(shards):
+        raise ValueError("No training rows were streamed")
+    per_shard = math.ceil(n_trees / len(shards))
+
+    forest.set_params(n_jobs=n_jobs)
+    grown = 0
+    for i in shards:
+        X, y = prepare(dataset.shard(i, max_rows or STREAM_SHARD_ROWS))
+        new_trees = min(per_shard, n_trees - grown)
+        grow_forest(forest, X, y, new_trees, classes)
+        grown += new_trees
+    # Single-row predictions are slower when spread over a thread pool.
+    forest.set_params(n_jobs=None)
+    return forest
+
+
+def evaluate(model, dataset, prepare, batch_rows=None):
+    """Score `model` on the held-out rows one batch at a time: accuracy for
+    classifiers, R² and mean absolute error for regressors."""
+    classifier = is_classifier(model)
+    n_rows = correct = 0
+    abs_error = sq_error = y_sum = y_sq = 0.0
+    for block in dataset.test_batches(batch_rows):
+        X, y = prepare(block)
+        predicted = model.predict(X)
+        n_rows += len(y)
+        if classifier:
+            correct += int(np.count_nonzero(predicted == y))
+        else:
+            y = np.asarray(y, dtype=np.float64)
+            error = y - predicted
+            abs_error += float(np.abs(error).sum())
+            sq_error += float(error @ error)
+            y_sum += float(y.sum())
+            y_sq += float(y @ y)
+
+    if not n_rows:
+        return {'test_rows': 0}
+    if classifier:
+        return {'test_rows': n_rows, 'accuracy': correct / n_rows}
+    variance = y_sq - y_sum ** 2 / n_rows
+    return {
+        'test_rows': n_rows,
+        'r2': 1 - sq_error / variance if variance else 0.0,
+        'mae': abs_error / n_rows
+    }
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ml_models
+from ml_models import CROP_DURATIONS, CROPS, SEASONS, SOIL_TYPES, generate_training_data
+
+SAMPLE_ROWS = 200_000
+# Agreement with the row-by-row generator the vectorized one replaced
+CROP_FREQUENCY_TOLERANCE = 0.002
+YIELD_MOMENT_TOLERANCE = 0.05
+
+
+def legacy_training_data(n_samples, seed=42):
+    """The generator before vectorization, one row at a time, on its own
+    RandomState instead of the global one."""
+    rng = np.random.RandomState(seed)
+    data = {
+        'N': rng.uniform(0, 140, n_samples),
+        'P': rng.uniform(5, 145, n_samples),
+        'K': rng.uniform(5, 205, n_samples),
+        'temperature': rng.uniform(8, 45, n_samples),
+        'humidity': rng.uniform(14, 100, n_samples),
+        'ph': rng.uniform(3.5, 10, n_samples),
+        'soil_type': rng.choice(SOIL_TYPES, n_samples),
+        'season': rng.choice(SEASONS, n_samples),
+        'crop_duration': rng.choice(CROP_DURATIONS, n_samples),
+        'previous_crop': rng.choice(CROPS + ['Fallow'], n_samples)
+    }
+
+    crops = []
+    yields = []
+    for i in range(n_samples):
+        n, p, k = data['N'][i], data['P'][i], data['K'][i]
+        temp, hum, ph = data['temperature'][i], data['humidity'][i], data['ph'][i]
+        soil = data['soil_type'][i]
+        season = data['season'][i]
+        duration = data['crop_duration'][i]
+
+        if temp > 25 and hum > 60 and season == 'Kharif (Monsoon)':
+            if n > 80 and soil in ['Clay', 'Clay Loam']:
+                crop = 'Rice'
+            elif n > 60 and p > 40:
+                crop = 'Maize'
+            else:
+                crop = 'Cotton'
+        elif temp < 25 and season == 'Rabi (Winter)':
+            if n > 100 and ph > 6:
+                crop = 'Wheat'
+            elif p > 60:
+                crop = 'Potato'
+            else:
+                crop = 'Peas'
+        elif season == 'Zaid (Summer)':
+            if temp > 30:
+                crop = 'Watermelon'
+            elif hum < 50:
+                crop = 'Sunflower'
+            else:
+                crop = 'Cucumber'
+        else:
+            if soil in ['Sandy', 'Sandy Loam'] and temp > 20:
+                crop = 'Groundnut'
+            elif k > 100:
+                crop = 'Sugarcane'
+            elif duration == 'Short-term (< 4 months)':
+                crop = rng.choice(['Tomato', 'Onion', 'Cabbage', 'Carrot'])
+            else:
+                crop = rng.choice(['Mango', 'Sugarcane', 'Cotton'])
+
+        yield_val = 25 + (n / 10) + (p / 15) + (k / 20) - abs(ph - 6.5) * 3
+        yield_val += rng.normal(0, 5)
+        crops.append(crop)
+        yields.append(max(10, min(60, yield_val)))
+
+    data['crop'] = crops
+    data['yield'] = yields
+    return pd.DataFrame(data)
+
+
+@pytest.fixture(scope='module')
+def samples():
+    return generate_training_data(SAMPLE_ROWS, seed=42), legacy_training_data(SAMPLE_ROWS)
+
+
+def test_crop_frequencies_match_the_row_by_row_generator(samples):
+    new, old = samples
+    frequencies = pd.concat([
+        new['crop'].astype(str).value_counts(normalize=True),
+        old['crop'].value_counts(normalize=True)
+    ], axis=1).fillna(0)
+    differences = (frequencies.iloc[:, 0] - frequencies.iloc[:, 1]).abs()
+    assert differences.max() <= CROP_FREQUENCY_TOLERANCE, differences.sort_values().tail(3)
+
+
+def test_yield_moments_match_the_row_by_row_generator(samples):
+    new, old = samples
+    assert new['yield'].mean() == pytest.approx(old['yield'].mean(), abs=YIELD_MOMENT_TOLERANCE)
+    assert new['yield'].std() == pytest.approx(old['yield'].std(), abs=YIELD_MOMENT_TOLERANCE)
+    assert new['yield'].between(10, 60).all()
+
+
+def test_same_seed_gives_the_same_frame_for_any_n_jobs(monkeypatch):
+    monkeypatch.setattr(ml_models, 'TRAINING_CHUNK_SIZE', 10_000)
+    serial = generate_training_data(45_000, seed=7)
+    pd.testing.assert_frame_equal(serial, generate_training_data(45_000, seed=7, n_jobs=3))
+    pd.testing.assert_frame_equal(serial, generate_training_data(45_000, seed=7))
+    assert not serial.equals(generate_training_data(45_000, seed=8))
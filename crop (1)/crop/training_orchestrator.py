@@ -0,0 +1,138 @@
+"""
+Runs independent training jobs side by side under a shared core budget
+
+Each job gets a share of TRAINING_CORES (all cores by default) in proportion
+to its weight and is run in its own worker process with that many
+`n_jobs`, so both forests train at the same time and each job's CPU time
+can be measured on its own. With fewer cores than jobs, the jobs run one
+after another in this process instead.
+"""
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+TRAINING_CORES = int(os.environ.get("TRAINING_CORES", "0")) or os.cpu_count() or 1
+# 'spawn' keeps workers clear of whatever threads the parent (e.g. Streamlit) runs.
+TRAINING_START_METHOD = os.environ.get("TRAINING_START_METHOD", "spawn")
+
+TrainingJob = namedtuple('TrainingJob', ['name', 'fn', 'args', 'weight'], defaults=[1])
+
+
+def split_cores(weights, budget):
+    """Share `budget` cores between jobs in proportion to `weights`, giving
+    every job at least one core (largest-remainder rounding)."""
+    names = list(weights)
+    spare = budget - len(names)
+    total = sum(weights.values()) or len(names)
+    exact = {name: spare * weights[name] / total for name in names}
+    cores = {name: 1 + int(exact[name]) for name in names}
+    leftover = budget - sum(cores.values())
+    for name in sorted(names, key=lambda name: exact[name] - int(exact[name]), reverse=True)[:leftover]:
+        cores[name] += 1
+    return cores
+
+
+def uses_processes(n_jobs, cores=None):
+    """Whether train_concurrently() runs `n_jobs` jobs in worker processes."""
+    cores = cores or TRAINING_CORES
+    return n_jobs > 1 and cores >= n_jobs
+
+
+def run_job(fn, args, n_jobs):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = fn(*args, n_jobs=n_jobs)
+    return result, time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+
+def train_concurrently(jobs, cores=None):
+    """Run `jobs` and return {name: {'result', 'n_jobs', 'wall_seconds',
+    'cpu_seconds'}}. CPU time covers all threads a job used."""
+    cores = cores or TRAINING_CORES
+    report = {}
+    if not uses_processes(len(jobs), cores):
+        for job in jobs:
+            result, wall, cpu = run_job(job.fn, job.args, cores)
+            report[job.name] = {'result': result, 'n_jobs': cores, 'wall_seconds': wall, 'cpu_seconds': cpu}
+        return report
+
+    budget = split_cores({job.name: job.weight for job in jobs}, cores)
+    context = multiprocessing.get_context(TRAINING_START_METHOD)
+    with ProcessPoolExecutor(max_workers=len(jobs), mp_context=context) as pool:
+        futures = {job.name: pool.submit(run_job, job.fn, job.args, budget[job.name]) for job in jobs}
+        for name, future in futures.items():
+            result, wall, cpu = future.result()
+            report[name] = {'result': result, 'n_jobs': budget[name], 'wall_seconds': wall, 'cpu_seconds': cpu}
+    return report
+
+
+def timings(report):
+    return {
+        name: {key: entry[key] for key in ('n_jobs', 'wall_seconds', 'cpu_seconds')}
+        for name, entry in report.items()
+    }
+
+
+def format_report(report):
+    return "\n".join(
+        f"  {name}: {entry['n_jobs']} core(s), wall {entry['wall_seconds']:.2f} s, "
+        f"CPU {entry['cpu_seconds']:.2f} s"
+        for name, entry in report.items()
+    )
+
+
+def fit_estimator(estimator, X, y, n_jobs=None):
+    estimator.set_params(n_jobs=n_jobs)
+    estimator.fit(X, y)
+    # Single-row predictions are slower when spread over a thread pool.
+    estimator.set_params(n_jobs=None)
+    return estimator
+
+
+def cross_validate(estimator, X, y, cv, n_jobs=None):
+    from joblib import parallel_config
+    from sklearn.model_selection import cross_val_score
+
+    # Threads rather than worker processes, so the folds count towards this
+    # job's CPU time.
+    with parallel_config(backend='threading'):
+        return cross_val_score(estimator, X, y, cv=cv, n_jobs=n_jobs)
+
+
+def grow_forest(forest, X, y, n_new_trees, classes=None, sample_weight=None):
+    """Add `n_new_trees` trees fitted on X, y to `forest` (warm_start).
+
+    warm_start resets classes_ from the labels it is given, so for a
+    classifier pass every class code in `classes`: each is appended once with
+    zero weight to keep the new trees' leaf values aligned with the others.
+    """
+    if sample_weight is None:
+        sample_weight = np.ones(len(y))
+    if classes is not None:
+        anchors = np.repeat(np.asarray(X)[:1], len(classes), axis=0)
+        if isinstance(X, pd.DataFrame):
+            X = pd.concat([X, pd.DataFrame(anchors, columns=X.columns)], ignore_index=True)
+        else:
+            X = np.concatenate([X, anchors])
+        y = np.concatenate([y, classes])
+        sample_weight = np.concatenate([sample_weight, np.zeros(len(classes))])
+
+    n_trees = len(getattr(forest, 'estimators_', []))
+    forest.set_params(warm_start=True, n_estimators=n_trees + n_new_trees)
+    forest.fit(X, y, sample_weight=sample_weight)
+    forest.set_params(warm_start=False)
+    return forest
+
+
+def train_wrapper(wrapper, data, n_jobs=None):
+    """Train one of the ml_models wrappers with `n_jobs` cores on a training
+    frame or on ml_models.TrainingData."""
+    wrapper.model.set_params(n_jobs=n_jobs)
+    wrapper.train(data)
+    wrapper.model.set_params(n_jobs=None)
+    return wrapper
@@ -1,80 +1,128 @@
 import numpy as np
-import pandas as pd
-from sklearn.model_selection import train_test_split, cross_val_score, StratifiedKFold
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.preprocessing import MinMaxScaler
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import accuracy_score
+from sklearn.metrics import accuracy_score, get_scorer
+import pandas as pd
+import argparse
 import pickle
+import os
+import sys
+from functools import partial
 
-crop = pd.read_csv(r"C:\Users\kowsh\OneDrive\csp project\crop recommendation with project.csv")
+# Shared model utilities live with the Streamlit app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crop (1)', 'crop'))
+from forest_engine import compile_forest
+from distillation import distill, publication_problems, format_report as format_distillation
+from training_orchestrator import TRAINING_CORES, TrainingJob, train_concurrently, format_report
+from streaming_training import (STREAM_CHUNK_ROWS, STREAM_SHARD_ROWS, ShardedDataset, shards_for,
+                                grow_from_shards, evaluate, format_peak_rss)
+from crop_dataset import (CROP_CSV, FEATURE_ENCODER, FEATURE_COLUMNS, CATEGORICAL_COLUMNS, crop_vocabulary,
+                          soil_vocabulary, season_vocabulary, load_dataset, encode_chunk, merge_unmapped,
+                          estimate_rows, print_report, cache_path_for)
+from experiment_cache import FoldCache, memoize, cache_key, cross_validate_cached, fit_cached
 
-crop_dict = {
-    'rice': 1, 'maize': 2, 'jute': 3, 'cotton': 4, 'coconut': 5,
-    'papaya': 6, 'orange': 7, 'apple': 8, 'muskmelon': 9, 'watermelon': 10,
-    'grapes': 11, 'mango': 12, 'banana': 13, 'pomegranate': 14, 
-    'lentil': 15, 'blackgram': 16, 'mungbean': 17, 'mothbeans': 18, 
-    'pigeonpeas': 19, 'kidneybeans': 20, 'chickpea': 21, 'coffee': 22,
-    'groundnut': 23, 'wheat': 24, 'onion': 25, 'barley': 26, 'clover': 27,
-    'oats': 28
+DEFAULT_PARAMS = {
+    'n_estimators': 30,
+    'max_depth': 8,
+    'min_samples_split': 10,
+    'min_samples_leaf': 5,
+    'random_state': 42
 }
 
-soil_dict = {
-    'Clayey': 1, 'Sandy': 2, 'Loam': 3, 'Silty': 4, 'Peaty': 5,
-    'Saline': 6, 'Red': 7, 'Black': 8, 'Alluvial': 9
-}
 
-season_dict = {
-    'Kharif': 1, 'Rabi': 2
-}
+def save_artifacts(model, scaler, fast_path=None):
+    with open('model.pkl', 'wb') as file:
+        pickle.dump(model, file)
+
+    with open('scaler.pkl', 'wb') as file:
+        pickle.dump(scaler, file)
+
+    FEATURE_ENCODER.save('encoders.json')
 
-crop['crop_num'] = crop['label'].map(crop_dict)
-crop.drop(['label'], axis=1, inplace=True)
-crop['Soil'] = crop['Soil'].map(soil_dict)
-crop['prev_crop'] = crop['prev_crop'].map(crop_dict)
-crop['prev_num'] = crop['prev_num'].map({'short': 0, 'long': 1})
-crop['season'] = crop['season'].map(season_dict)
-crop['rec_num'] = crop['rec_num'].map({'short': 0, 'long': 1})
+    if fast_path is not None:
+        with open('fast_path.pkl', 'wb') as file:
+            pickle.dump(fast_path, file)
 
-crop.fillna(crop.mean(), inplace=True)
 
-X = crop.drop(['crop_num'], axis=1)
-y = crop['crop_num']
+def distill_model(model, scaler):
+    """Student for the Flask fast path, or None when it would not make
+    recommendation() faster. The model sees scaled inputs, so the numeric
+    features span [0, 1] and each category code is scaled the same way."""
+    categorical = {}
+    for col, vocabulary in CATEGORICAL_COLUMNS.items():
+        i = FEATURE_COLUMNS.index(col)
+        categorical[i] = vocabulary.codes * scaler.scale_[i] + scaler.min_[i]
+    n_features = len(FEATURE_COLUMNS)
+    fast_path = distill(model, np.zeros(n_features), np.ones(n_features), categorical)
+    print(format_distillation(fast_path.report))
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    problems = publication_problems(fast_path.report)
+    if problems:
+        print(f"Not writing fast_path.pkl: {'; '.join(problems)}")
+        return None
+    return fast_path
+
+
+def prepare_experiment(path, test_size=0.2, random_state=42):
+    X, y = load_dataset(path)
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=random_state)
 
-scaler = MinMaxScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
+    scaler = MinMaxScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+    return X_train, y_train.to_numpy(), y_test.to_numpy(), scaler, X_train_scaled, X_test_scaled
 
-model = RandomForestClassifier(
-    n_estimators=30,        #
-    max_depth=8,            
-    min_samples_split=10,   
-    min_samples_leaf=5,     
-    random_state=42         
-)
 
-kfold = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-cv_scores = cross_val_score(model, X_train_scaled, y_train, cv=kfold)
-print(f"Cross-Validation Accuracy: {np.mean(cv_scores)}")
+def stream_rows(means, scaler, block):
+    X = block[:, :-1]
+    missing = np.isnan(X)
+    if missing.any():
+        X = np.where(missing, means, X)
+    return scaler.transform(X), block[:, -1].astype(np.int64)
 
-model.fit(X_train_scaled, y_train)
-y_pred = model.predict(X_test_scaled)
-test_accuracy = accuracy_score(y_test, y_pred)
-print(f"Test Accuracy: {test_accuracy}")
 
-# Save model and scaler
-with open('model.pkl', 'wb') as file:
-    pickle.dump(model, file)
+def train_streaming(path, chunk_rows=None, shard_rows=None, n_jobs=None):
+    """Out-of-core version of the training below for CSVs larger than memory.
+    The CSV is read `chunk_rows` at a time into on-disk shards, missing
+    categories are filled with the training mean and the forest is grown
+    shard by shard (see streaming_training)."""
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    shard_rows = shard_rows or STREAM_SHARD_ROWS
+    report = {'source': os.path.abspath(path), 'rows': 0, 'dropped_rows': 0, 'unmapped': {}}
+    classes = set()
 
-with open('scaler.pkl', 'wb') as file:
-    pickle.dump(scaler, file)
+    n_shards = shards_for(estimate_rows(path), shard_rows)
+    with ShardedDataset(len(FEATURE_COLUMNS) + 1, n_shards, random_state=42) as dataset:
+        for raw in pd.read_csv(path, chunksize=chunk_rows):
+            features, codes, labels, unmapped = encode_chunk(raw)
+            keep = labels >= 0
+            codes = codes.astype(np.float32)
+            codes[codes < 0] = np.nan
+            dataset.add(np.column_stack([features, codes, labels])[keep])
+            classes.update(np.unique(labels[keep]).tolist())
+            report['rows'] += int(keep.sum())
+            report['dropped_rows'] += int((~keep).sum())
+            merge_unmapped(report['unmapped'], unmapped)
+        print_report(report)
+
+        means = dataset.column_means()[:-1]
+        scaler = dataset.scaler_for(np.arange(len(FEATURE_COLUMNS)))
+        prepare = partial(stream_rows, means, scaler)
+        model = grow_from_shards(
+            RandomForestClassifier(**DEFAULT_PARAMS), dataset, DEFAULT_PARAMS['n_estimators'],
+            prepare, np.array(sorted(classes)), max_rows=shard_rows, n_jobs=n_jobs
+        )
+        scores = evaluate(model, dataset, prepare, chunk_rows)
+        report.update(shards=n_shards, train_rows=dataset.train_rows, test_rows=scores['test_rows'],
+                      test_accuracy=scores.get('accuracy'))
+    return model, scaler, report
 
 
 def recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop, prev_duration, rec_duration, season):
-    soil_num = soil_dict.get(soil, -1)
-    prev_crop_num = crop_dict.get(prev_crop.lower(), -1)
-    season_num = season_dict.get(season, -1)
+    soil_num = soil_vocabulary.lookup(soil)
+    prev_crop_num = crop_vocabulary.lookup(prev_crop)
+    season_num = season_vocabulary.lookup(season)
     prev_duration_num = 1 if prev_duration.lower() == 'long' else 0
     rec_duration_num = 1 if rec_duration.lower() == 'long' else 0
 
@@ -88,8 +136,8 @@ def recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop
     features = scaler.transform(features)
 
     
-    prediction = model.predict(features)
-    recommended_crop = next((name for name, num in crop_dict.items() if num == prediction[0]), None)
+    prediction = compiled_model.predict(features)
+    recommended_crop = crop_vocabulary.decode(prediction)[0]
 
     
     if recommended_crop:
@@ -99,18 +147,118 @@ def recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop
     
     return recommended_crop
 
-N = float(input("Enter Nitrogen value: "))
-P = float(input("Enter Phosphorus value: "))
-K = float(input("Enter Potassium value: "))
-temperature = float(input("Enter Temperature: "))
-humidity = float(input("Enter Humidity: "))
-ph = float(input("Enter pH value: "))
-rainfall = float(input("Enter Rainfall: "))
-soil = input("Enter soil type (Clayey, Sandy, Loam, etc.): ")
-prev_crop = input("Enter previous crop: ")
-prev_duration = input("Enter previous crop duration (short/long): ")
-rec_duration = input("Enter recommended crop duration (short/long): ")
-season = input("Enter season (Kharif/Rabi): ")
-
-
-recommended_crop = recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop, prev_duration, rec_duration, season)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the crop recommendation model.")
+    parser.add_argument('--data', default=CROP_CSV, help="path to the crop CSV")
+    parser.add_argument('--tune', action='store_true',
+                        help="search hyperparameters with successive halving before the final fit")
+    parser.add_argument('--candidates', type=int, default=27, help="number of sampled configurations")
+    parser.add_argument('--n-jobs', type=int, default=-1, help="worker processes for the search")
+    parser.add_argument('--cores', type=int, default=TRAINING_CORES,
+                        help="core budget shared by cross-validation and the final fit")
+    parser.add_argument('--results', default=None, help="sweep log to resume from (default tuning_results.jsonl)")
+    parser.add_argument('--n-estimators', type=int, default=DEFAULT_PARAMS['n_estimators'],
+                        help="trees per forest; fold models from earlier runs are grown or trimmed to fit")
+    parser.add_argument('--metrics', default='accuracy',
+                        help="comma-separated scikit-learn scorer names reported for CV and the test set")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="recompute the preprocessing and refit every fold (see experiment_cache.py)")
+    parser.add_argument('--distill', action='store_true',
+                        help="also distil a fast-path student model into fast_path.pkl")
+    parser.add_argument('--stream', action='store_true',
+                        help="train out of core, reading the CSV in chunks (for data larger than memory)")
+    parser.add_argument('--chunk-rows', type=int, default=STREAM_CHUNK_ROWS, help="rows read per CSV chunk")
+    parser.add_argument('--shard-rows', type=int, default=STREAM_SHARD_ROWS,
+                        help="most rows held in memory while fitting")
+    args = parser.parse_args()
+
+    # Streaming runs are non-interactive
+    if args.stream:
+        model, scaler, stream_report = train_streaming(args.data, args.chunk_rows, args.shard_rows, args.cores)
+        print(f"Trained {len(model.estimators_)} trees on {stream_report['train_rows']} rows "
+              f"from {stream_report['shards']} shard(s)")
+        print(f"Test Accuracy: {stream_report['test_accuracy']} ({stream_report['test_rows']} rows)")
+        print(f"Peak RSS: {format_peak_rss()}")
+        fast_path = distill_model(model, scaler) if args.distill else None
+        save_artifacts(model, scaler, fast_path)
+        sys.exit()
+
+    # The split and scaled matrices are stored under the dataset cache key
+    # (CSV hash and vocabularies), and fitted forests under that and the fold.
+    metrics = args.metrics.split(',')
+    if args.no_cache:
+        prepared, hit = prepare_experiment(args.data), False
+        fold_cache = FoldCache(None)
+    else:
+        data_key = cache_key(os.path.basename(cache_path_for(args.data)), 0.2, 42)
+        prepared, hit = memoize('prepare', data_key, partial(prepare_experiment, args.data))
+        fold_cache = FoldCache(data_key)
+    X_train, y_train, y_test, scaler, X_train_scaled, X_test_scaled = prepared
+    if hit:
+        print(f"Reused preprocessed split ({len(y_train)} training rows)")
+
+    params = dict(DEFAULT_PARAMS, n_estimators=args.n_estimators)
+    if args.tune:
+        from tuning import successive_halving
+
+        search = successive_halving(
+            X_train, y_train, n_candidates=args.candidates, n_jobs=args.n_jobs, results_path=args.results
+        )
+        params = dict(search['best_params'], n_estimators=search['n_estimators'], random_state=42)
+        print(f"Best parameters: {params}")
+        print(f"Cross-Validation Accuracy: {search['cv_score']}")
+        jobs = [TrainingJob('model', fit_cached, (fold_cache, params, X_train_scaled, y_train))]
+    else:
+        # Cross-validation and the final fit are independent, so they run
+        # side by side on a split of the core budget.
+        kfold = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+        jobs = [
+            TrainingJob('cross_validation', cross_validate_cached,
+                        (fold_cache, params, X_train_scaled, y_train, kfold, metrics),
+                        weight=kfold.get_n_splits()),
+            TrainingJob('model', fit_cached, (fold_cache, params, X_train_scaled, y_train))
+        ]
+
+    report = train_concurrently(jobs, args.cores)
+    if 'cross_validation' in report:
+        cv_result = report['cross_validation']['result']
+        for metric, scores in cv_result['scores'].items():
+            label = 'Accuracy' if metric == 'accuracy' else metric
+            print(f"Cross-Validation {label}: {np.mean(scores)}")
+        print(f"Fold models: {', '.join(cv_result['folds'])}")
+    print("Training time:")
+    print(format_report(report))
+
+    model, model_status = report['model']['result']
+    print(f"Final model: {model_status}")
+    compiled_model = compile_forest(model)
+    y_pred = model.predict(X_test_scaled)
+    test_accuracy = accuracy_score(y_test, y_pred)
+    print(f"Test Accuracy: {test_accuracy}")
+    for metric in metrics:
+        if metric != 'accuracy':
+            print(f"Test {metric}: {get_scorer(metric)(model, X_test_scaled, y_test)}")
+    print(f"Peak RSS: {format_peak_rss()}")
+
+    fast_path = distill_model(model, scaler) if args.distill else None
+
+    # Save model and scaler
+    save_artifacts(model, scaler, fast_path)
+
+    # Tuning runs are non-interactive
+    if not args.tune:
+        N = float(input("Enter Nitrogen value: "))
+        P = float(input("Enter Phosphorus value: "))
+        K = float(input("Enter Potassium value: "))
+        temperature = float(input("Enter Temperature: "))
+        humidity = float(input("Enter Humidity: "))
+        ph = float(input("Enter pH value: "))
+        rainfall = float(input("Enter Rainfall: "))
+        soil = input("Enter soil type (Clayey, Sandy, Loam, etc.): ")
+        prev_crop = input("Enter previous crop: ")
+        prev_duration = input("Enter previous crop duration (short/long): ")
+        rec_duration = input("Enter recommended crop duration (short/long): ")
+        season = input("Enter season (Kharif/Rabi): ")
+
+
+        recommended_crop = recommendation(N, P, K, temperature, humidity, ph, rainfall, soil, prev_crop, prev_duration, rec_duration, season)
@@ -1,10 +1,18 @@
-import requests
-import pandas as pd
+import argparse
+import os
 import time
 import random
 
-WEATHER_API_KEY = "721a6db02b65413ba71154158250503"
-YOUR_TOMORROW_API_KEY = "FLBkm7DWYVU9vKix9yMqMgtQxpcTZERG"
+from weather_client import format_report, provider_clients
+from weather_cache import WeatherCache
+from weather_collector import Collector
+from weather_writer import CheckpointedCSVWriter, items_key
+
+WEATHER_API_KEY = os.environ.get("WEATHER_API_KEY", "721a6db02b65413ba71154158250503")
+YOUR_TOMORROW_API_KEY = os.environ.get("TOMORROW_API_KEY", "FLBkm7DWYVU9vKix9yMqMgtQxpcTZERG")
+# Overridable so runs can target weather_stub.py instead of the real services
+WEATHERAPI_URL = os.environ.get("WEATHERAPI_URL", "http://api.weatherapi.com/v1/current.json")
+TOMORROW_URL = os.environ.get("TOMORROW_URL", "https://api.tomorrow.io/v4/weather/realtime")
 
 LOCATIONS = [
     {"city": "Bangalore", "lat": 12.9716, "lon": 77.5946},
@@ -12,17 +20,22 @@ LOCATIONS = [
     {"city": "Pune", "lat": 18.5204, "lon": 73.8567},
 ] * 50
 CSV_FILE = "weather_data.csv"
+# Columns of weather_record(); a checkpoint written with others is not resumed
+WEATHER_COLUMNS = ["Location", "Temperature", "Humidity", "Rainfall", "pH", "N", "P", "K", "Soil_Type",
+                   "Previous_Crop", "Previous_Duration", "Recommended_Duration", "Season", "Sources"]
 
 SEASONS = ["Kharif", "Rabi"]
 SOIL_TYPES = ["Clayey", "Sandy", "Loamy"]
 PREVIOUS_CROPS = ["Corn", "Soybean", "Cotton", "Barley"]
 DURATION_TYPES = ["short", "long"]
 
+# Pooled keep-alive sessions with timeouts and retries, one per provider
+CLIENTS = provider_clients()
+
 def fetch_weather_weatherapi(location):
-    url = f"http://api.weatherapi.com/v1/current.json?key={WEATHER_API_KEY}&q={location['city']}"
-    response = requests.get(url)
+    response = CLIENTS['weatherapi'].get(WEATHERAPI_URL, params={'key': WEATHER_API_KEY, 'q': location['city']})
 
-    if response.status_code == 200:
+    if response is not None and response.status_code == 200:
         data = response.json()
         return {
             "Temperature": data['current']['temp_c'],
@@ -32,10 +45,11 @@ def fetch_weather_weatherapi(location):
     return None
 
 def fetch_weather_tomorrow(location):
-    url = f"https://api.tomorrow.io/v4/weather/realtime?location={location['lat']},{location['lon']}&apikey={YOUR_TOMORROW_API_KEY}"
-    response = requests.get(url)
+    response = CLIENTS['tomorrow'].get(TOMORROW_URL, params={
+        'location': f"{location['lat']},{location['lon']}", 'apikey': YOUR_TOMORROW_API_KEY
+    })
 
-    if response.status_code == 200:
+    if response is not None and response.status_code == 200:
         data = response.json()
         return {
             "Temperature": data['data']['values']['temperature'],
@@ -44,49 +58,130 @@ def fetch_weather_tomorrow(location):
         }
     return None
 
+def weather_record(location, i, readings):
+    # `readings` maps each provider that answered to its values; Sources
+    # records which ones the averages came from.
+    def mean(field):
+        return round(sum(values[field] for values in readings.values()) / len(readings), 2)
+
+    temperature = mean("Temperature")
+    humidity = mean("Humidity")
+    rainfall = mean("Rainfall")
+
+    return {
+        "Location": location["city"],
+        "Temperature": temperature,
+        "Humidity": humidity,
+        "Rainfall": rainfall,
+        "pH": round(6 + (humidity / 100), 2),
+        "N": round(50 + (temperature / 2), 2),
+        "P": round(30 + (humidity / 3), 2),
+        "K": round(40 + (rainfall / 4), 2),
+        "Soil_Type": SOIL_TYPES[i % len(SOIL_TYPES)],
+        "Previous_Crop": PREVIOUS_CROPS[i % len(PREVIOUS_CROPS)],
+        "Previous_Duration": DURATION_TYPES[i % len(DURATION_TYPES)],
+        "Recommended_Duration": DURATION_TYPES[(i + 1) % len(DURATION_TYPES)],
+        "Season": SEASONS[i % len(SEASONS)],
+        "Sources": "+".join(sorted(readings))
+    }
+
 # Main function to fetch data
 def fetch_weather(location, i):
     data1 = fetch_weather_weatherapi(location)
     data2 = fetch_weather_tomorrow(location)
 
     if data1 and data2:
-        temperature = round((data1["Temperature"] + data2["Temperature"]) / 2, 2)
-        humidity = round((data1["Humidity"] + data2["Humidity"]) / 2, 2)
-        rainfall = round((data1["Rainfall"] + data2["Rainfall"]) / 2, 2)
+        return weather_record(location, i, {'weatherapi': data1, 'tomorrow': data2})
+    return None
 
-        return {
-            "Location": location["city"],
-            "Temperature": temperature,
-            "Humidity": humidity,
-            "Rainfall": rainfall,
-            "pH": round(6 + (humidity / 100), 2),
-            "N": round(50 + (temperature / 2), 2),
-            "P": round(30 + (humidity / 3), 2),
-            "K": round(40 + (rainfall / 4), 2),
-            "Soil_Type": SOIL_TYPES[i % len(SOIL_TYPES)],
-            "Previous_Crop": PREVIOUS_CROPS[i % len(PREVIOUS_CROPS)],
-            "Previous_Duration": DURATION_TYPES[i % len(DURATION_TYPES)],
-            "Recommended_Duration": DURATION_TYPES[(i + 1) % len(DURATION_TYPES)],
-            "Season": SEASONS[i % len(SEASONS)]
-        }
+async def fetch_weather_async(collector, location, i):
+    # Both providers at once; a provider still running when the merge
+    # window closes is left out and the record uses the other one.
+    readings = await collector.fan_out({
+        'weatherapi': collector.call('weatherapi', fetch_weather_weatherapi, location, cache_key=location['city']),
+        'tomorrow': collector.call('tomorrow', fetch_weather_tomorrow, location,
+                                   cache_key=f"{location['lat']},{location['lon']}")
+    })
+
+    if readings:
+        return weather_record(location, i, readings)
     return None
 
-# Collect weather data
-weather_data = []
-for i, location in enumerate(LOCATIONS):
-    print(f"Fetching data for {location['city']} ({i+1}/{len(LOCATIONS)})...")
-    data = fetch_weather(location, i)
-
-    if data:
-        weather_data.append(data)
-
-    if (i + 1) % 50 == 0:
-        print("Pausing for 60 seconds to avoid rate limits...")
-        time.sleep(60)
-    else:
-        time.sleep(1)
-
-# Save data to CSV
-df = pd.DataFrame(weather_data)
-df.to_csv(CSV_FILE, index=False)
-print(f"Weather data for {len(df)} locations saved to {CSV_FILE}")
\ No newline at end of file
+def collect(locations, writer, concurrency=None, cache=None, hedge_after=None):
+    collector = Collector(concurrency=concurrency, cache=cache, hedge_after=hedge_after)
+    distinct = len({location['city'] for location in locations}) if cache is not None else len(locations)
+    for name, limiter in collector.limiters.items():
+        CLIENTS[name].throttle = limiter.wait
+        seconds = limiter.minimum_seconds(distinct)
+        if seconds > 60:
+            print(f"Note: {distinct} {name} calls need at least {seconds / 60:.0f} min under its quota "
+                  f"{limiter.quota}")
+
+    def progress(i, location, data):
+        status = ("ok" if data["Sources"] == "tomorrow+weatherapi" else f"ok ({data['Sources']} only)") if data \
+            else "failed"
+        print(f"Fetched data for {location['city']} ({i+1}/{len(locations)}): {status}")
+        if data:
+            writer.write(i, data)
+
+    collector.run(locations, fetch_weather_async, progress, skip=writer.done)
+    return collector
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect weather readings for LOCATIONS into a CSV.")
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help="locations fetched at once (default COLLECTOR_CONCURRENCY)")
+    parser.add_argument('--stub', action='store_true',
+                        help="fetch from a local stand-in server (weather_stub.py) instead of the real APIs")
+    parser.add_argument('--stub-latency', type=float, default=0.2, help="stand-in response time in seconds")
+    parser.add_argument('--stub-fail-rate', type=float, default=0.0,
+                        help="share of stand-in responses that are 429/503 with Retry-After")
+    parser.add_argument('--stub-tail-rate', type=float, default=0.0,
+                        help="share of stand-in responses delayed by 3 s")
+    parser.add_argument('--hedge-after', type=float, default=None,
+                        help="send a second request to a provider that has not answered after this many "
+                             "seconds (default WEATHER_HEDGE_AFTER; 0 turns hedging off)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="fetch every location upstream instead of using weather_cache.sqlite")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the checkpoint left by an interrupted run and start over")
+    args = parser.parse_args()
+
+    server = None
+    if args.stub:
+        from weather_stub import StubWeatherServer
+
+        server = StubWeatherServer(latency=args.stub_latency, fail_rate=args.stub_fail_rate,
+                                   tail_rate=args.stub_tail_rate).start()
+        WEATHERAPI_URL, TOMORROW_URL = server.urls()['weatherapi'], server.urls()['tomorrow']
+
+    # Repeated locations within WEATHER_CACHE_BUCKET seconds are served from disk
+    cache = None if args.no_cache else WeatherCache()
+    if cache is not None:
+        cache.purge()
+
+    # Rows are appended to the CSV in batches as locations finish, so they
+    # follow completion order (sorted within each batch); an interrupted run
+    # resumes from its checkpoint
+    writer = CheckpointedCSVWriter(CSV_FILE, items_key(LOCATIONS), len(LOCATIONS), WEATHER_COLUMNS,
+                                   resume=not args.restart)
+    if writer.resumed:
+        print(f"Resuming: {writer.resumed} of {len(LOCATIONS)} locations already in {CSV_FILE}")
+
+    # Collect weather data
+    try:
+        with writer:
+            collector = collect(LOCATIONS, writer, args.concurrency, cache, args.hedge_after)
+    finally:
+        if cache is not None:
+            cache.close()
+        if server is not None:
+            server.stop()
+
+    print(f"Weather data for {writer.written} locations saved to {CSV_FILE} ({len(writer.done)} in total)")
+    if not writer.complete:
+        print(f"{len(LOCATIONS) - len(writer.done)} location(s) failed; rerun to retry them")
+    print(collector.report())
+    print(format_report(CLIENTS))
+    if server is not None:
+        print(f"Stand-in server: {server.connections} connection(s) for {sum(server.requests.values())} request(s)")
@@ -0,0 +1,198 @@
+"""
+Pre-encoded cache of the crop recommendation CSV
+
+The CSV is parsed once, its categorical columns are matched case-insensitively
+against the vocabularies below, and the result is stored as an .npz file
+(float32 features, int8 codes) named after a hash of the source file. Later
+runs load the arrays directly.
+
+    python crop_dataset.py [path/to/crop.csv]
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Shared model utilities live with the Streamlit app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crop (1)', 'crop'))
+from feature_encoder import FeatureEncoder, Vocabulary
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CROP_CSV = os.environ.get("CROP_CSV", os.path.join(BASE_DIR, 'crop recommendation with project.csv'))
+DATASET_CACHE_DIR = os.environ.get("DATASET_CACHE_DIR", os.path.join(BASE_DIR, 'dataset_cache'))
+DATASET_FORMAT = 1
+
+crop_dict = {
+    'rice': 1, 'maize': 2, 'jute': 3, 'cotton': 4, 'coconut': 5,
+    'papaya': 6, 'orange': 7, 'apple': 8, 'muskmelon': 9, 'watermelon': 10,
+    'grapes': 11, 'mango': 12, 'banana': 13, 'pomegranate': 14,
+    'lentil': 15, 'blackgram': 16, 'mungbean': 17, 'mothbeans': 18,
+    'pigeonpeas': 19, 'kidneybeans': 20, 'chickpea': 21, 'coffee': 22,
+    'groundnut': 23, 'wheat': 24, 'onion': 25, 'barley': 26, 'clover': 27,
+    'oats': 28
+}
+
+soil_dict = {
+    'Clayey': 1, 'Sandy': 2, 'Loam': 3, 'Silty': 4, 'Peaty': 5,
+    'Saline': 6, 'Red': 7, 'Black': 8, 'Alluvial': 9
+}
+
+season_dict = {
+    'Kharif': 1, 'Rabi': 2
+}
+
+duration_dict = {'short': 0, 'long': 1}
+
+# Aliases cover spellings in the CSV that mean an existing category
+crop_vocabulary = Vocabulary.from_mapping(crop_dict, aliases={'pigeonpea': 'pigeonpeas'},
+                                          unknown='missing', name='crop')
+soil_vocabulary = Vocabulary.from_mapping(soil_dict, aliases={'clay': 'Clayey', 'slity': 'Silty'},
+                                          unknown='missing', name='soil type')
+season_vocabulary = Vocabulary.from_mapping(season_dict, unknown='missing', name='season')
+duration_vocabulary = Vocabulary.from_mapping(duration_dict, unknown='missing', name='duration')
+
+NUMERIC_COLUMNS = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+CATEGORICAL_COLUMNS = {
+    'Soil': soil_vocabulary,
+    'prev_crop': crop_vocabulary,
+    'prev_num': duration_vocabulary,
+    'season': season_vocabulary,
+    'rec_num': duration_vocabulary
+}
+FEATURE_COLUMNS = NUMERIC_COLUMNS + list(CATEGORICAL_COLUMNS)
+FEATURE_ENCODER = FeatureEncoder(FEATURE_COLUMNS, CATEGORICAL_COLUMNS, target=crop_vocabulary)
+LABEL_COLUMN = 'label'
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def vocabulary_hash():
+    state = {'format': DATASET_FORMAT, 'encoder': FEATURE_ENCODER.to_dict()}
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
+
+
+def cache_path_for(path, cache_dir=None):
+    cache_dir = cache_dir or DATASET_CACHE_DIR
+    key = hashlib.sha256((file_hash(path) + vocabulary_hash()).encode()).hexdigest()
+    return os.path.join(cache_dir, f"crop-{key[:16]}.npz")
+
+
+def encode_column(values, vocabulary):
+    """Map a column to int8 codes (-1 where unmapped). Also returns the
+    unmapped values with their counts."""
+    codes = vocabulary.encode(values)
+    unmapped = values[codes < 0].astype(str).value_counts().to_dict()
+    return codes.astype(np.int8), unmapped
+
+
+def encode_chunk(raw):
+    """Encode a block of CSV rows: float32 numeric features, int8 category
+    codes and crop numbers (-1 where unmapped), and the unmapped values per
+    column."""
+    labels, unmapped_labels = encode_column(raw[LABEL_COLUMN], crop_vocabulary)
+    codes = np.empty((len(raw), len(CATEGORICAL_COLUMNS)), dtype=np.int8)
+    unmapped = {LABEL_COLUMN: unmapped_labels} if unmapped_labels else {}
+    for i, (col, vocabulary) in enumerate(CATEGORICAL_COLUMNS.items()):
+        codes[:, i], unmapped_values = encode_column(raw[col], vocabulary)
+        if unmapped_values:
+            unmapped[col] = unmapped_values
+    return raw[NUMERIC_COLUMNS].to_numpy(dtype=np.float32), codes, labels, unmapped
+
+
+def merge_unmapped(total, unmapped):
+    for col, values in unmapped.items():
+        counts = total.setdefault(col, {})
+        for value, count in values.items():
+            counts[value] = counts.get(value, 0) + count
+    return total
+
+
+def estimate_rows(path, sample_lines=1000):
+    """Rough row count from the file size and the length of the first lines."""
+    with open(path, 'rb') as f:
+        f.readline()
+        sample = [len(line) for _, line in zip(range(sample_lines), f)]
+    if not sample:
+        return 0
+    return int(os.path.getsize(path) / (sum(sample) / len(sample)))
+
+
+def build_cache(path, cache_path):
+    raw = pd.read_csv(path)
+
+    features, codes, labels, unmapped = encode_chunk(raw)
+    keep = labels >= 0
+    report = {'source': os.path.abspath(path), 'rows': int(keep.sum()),
+              'dropped_rows': int((~keep).sum()), 'unmapped': unmapped}
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(cache_path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                features=features[keep],
+                codes=codes[keep],
+                labels=labels[keep],
+                report=np.array(json.dumps(report))
+            )
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return report
+
+
+def prepare_dataset(path=None, cache_dir=None, verbose=True):
+    """Build the cache for `path` unless an up-to-date one exists. Returns the
+    cache file and the preparation report."""
+    path = path or CROP_CSV
+    cache_path = cache_path_for(path, cache_dir)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return cache_path, json.loads(str(cached['report']))
+    report = build_cache(path, cache_path)
+    if verbose:
+        print_report(report)
+    return cache_path, report
+
+
+def print_report(report):
+    print(f"Encoded {report['rows']} rows from {report['source']}")
+    if report['dropped_rows']:
+        print(f"  dropped {report['dropped_rows']} rows with an unknown label")
+    for col, values in report['unmapped'].items():
+        listed = ', '.join(f"{value!r} x{count}" for value, count in values.items())
+        print(f"  unmapped {col}: {listed}")
+
+
+def load_dataset(path=None, cache_dir=None):
+    """Return the model inputs X and the crop numbers y. Unmapped categories
+    are filled with the column mean, as the original preprocessing did."""
+    cache_path, _ = prepare_dataset(path, cache_dir)
+    with np.load(cache_path) as cached:
+        X = pd.DataFrame(cached['features'], columns=NUMERIC_COLUMNS)
+        codes = cached['codes'].astype(np.float32)
+        codes[codes < 0] = np.nan
+        for i, col in enumerate(CATEGORICAL_COLUMNS):
+            X[col] = codes[:, i]
+        y = pd.Series(cached['labels'].astype(np.int64), name='crop_num')
+
+    X.fillna(X.mean(), inplace=True)
+    return X, y
+
+
+if __name__ == "__main__":
+    cache_path, report = prepare_dataset(sys.argv[1] if len(sys.argv) > 1 else None, verbose=False)
+    print_report(report)
+    print(f"Cache: {cache_path}")
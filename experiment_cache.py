@@ -0,0 +1,147 @@
+"""
+Disk-backed memoization for repeated crop.py experiments
+
+memoize() stores the result of a preprocessing stage (filling, splitting and
+scaling the dataset) under a hash of its input and parameters, so a rerun on
+the same data loads it instead of recomputing it.
+
+FoldCache keeps the forest fitted on each cross-validation fold, and the
+final fit, keyed by the data, the fold and every parameter except
+n_estimators. Trees are added in order from the same seeds, so a stored
+forest with more trees is cut down, and one with fewer is grown with
+warm_start; either way the result equals a fresh fit. Scoring extra metrics
+only needs predictions from the stored forests.
+
+    python experiment_cache.py [--clear]
+"""
+import copy
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import get_scorer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EXPERIMENT_CACHE_DIR = os.environ.get("EXPERIMENT_CACHE_DIR", os.path.join(BASE_DIR, 'experiment_cache'))
+EXPERIMENT_CACHE_FORMAT = 1
+
+
+def cache_key(*parts):
+    state = json.dumps([EXPERIMENT_CACHE_FORMAT, *parts], sort_keys=True, default=str)
+    return hashlib.sha256(state.encode()).hexdigest()[:16]
+
+
+def read_pickle(path):
+    """The object stored at `path`, or None if it is missing or unreadable."""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+
+
+def write_pickle(path, obj):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.pkl', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def memoize(stage, key, compute, cache_dir=None):
+    """Return (compute(), hit) for this stage and key, loading the value
+    from disk when a previous run stored it."""
+    path = os.path.join(cache_dir or EXPERIMENT_CACHE_DIR, stage, f"{key}.pkl")
+    cached = read_pickle(path)
+    if cached is not None:
+        return cached, True
+    value = compute()
+    write_pickle(path, value)
+    return value, False
+
+
+class FoldCache:
+    """Fitted forests for the folds of one dataset, identified by
+    `data_key` (None turns the cache off). Only forests with an integer
+    random_state are stored, since no other forest can be reproduced."""
+
+    def __init__(self, data_key, cache_dir=None):
+        self.data_key = data_key
+        self.cache_dir = os.path.join(cache_dir or EXPERIMENT_CACHE_DIR, 'folds')
+
+    def _path(self, params, fold):
+        shape = {name: value for name, value in params.items() if name != 'n_estimators'}
+        return os.path.join(self.cache_dir, f"{cache_key(self.data_key, fold, shape)}.pkl")
+
+    def fit(self, params, X, y, fold, n_jobs=None):
+        """Forest with `params` fitted on X, y, the training rows of `fold`.
+        Returns the forest and whether it was 'reused', 'grown' or 'fitted'."""
+        n_estimators = params['n_estimators']
+        cacheable = self.data_key is not None and isinstance(params.get('random_state'), int)
+        forest = read_pickle(self._path(params, fold)) if cacheable else None
+
+        if forest is not None and len(forest.estimators_) >= n_estimators:
+            trimmed = copy.copy(forest)
+            trimmed.estimators_ = forest.estimators_[:n_estimators]
+            trimmed.n_estimators = n_estimators
+            return trimmed, 'reused'
+
+        if forest is None:
+            forest, status = RandomForestClassifier(**params), 'fitted'
+        else:
+            forest.set_params(warm_start=True, n_estimators=n_estimators)
+            status = 'grown'
+        forest.set_params(n_jobs=n_jobs)
+        forest.fit(X, y)
+        # Single-row predictions are slower when spread over a thread pool.
+        forest.set_params(warm_start=False, n_jobs=None)
+        if cacheable:
+            write_pickle(self._path(params, fold), forest)
+        return forest, status
+
+
+def cross_validate_cached(fold_cache, params, X, y, cv, metrics=('accuracy',), n_jobs=None):
+    """Score `params` on each fold of `cv` with every scorer named in
+    `metrics`. Returns {'scores': {metric: [score per fold]}, 'folds':
+    [status per fold]}."""
+    scorers = {metric: get_scorer(metric) for metric in metrics}
+    scores = {metric: [] for metric in metrics}
+    statuses = []
+    for i, (train_idx, valid_idx) in enumerate(cv.split(X, y)):
+        forest, status = fold_cache.fit(params, X[train_idx], y[train_idx], f"{cv!r}:{i}", n_jobs)
+        statuses.append(status)
+        for metric, scorer in scorers.items():
+            scores[metric].append(float(scorer(forest, X[valid_idx], y[valid_idx])))
+    return {'scores': scores, 'folds': statuses}
+
+
+def fit_cached(fold_cache, params, X, y, n_jobs=None):
+    """The final fit on all training rows, through the same cache."""
+    return fold_cache.fit(params, X, y, 'full', n_jobs)
+
+
+def cache_size(cache_dir=None):
+    total = files = 0
+    for root, _, names in os.walk(cache_dir or EXPERIMENT_CACHE_DIR):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+            files += 1
+    return files, total
+
+
+if __name__ == "__main__":
+    if '--clear' in sys.argv[1:]:
+        shutil.rmtree(EXPERIMENT_CACHE_DIR, ignore_errors=True)
+        print(f"Cleared {EXPERIMENT_CACHE_DIR}")
+    else:
+        files, total = cache_size()
+        print(f"{EXPERIMENT_CACHE_DIR}: {files} file(s), {total / 1e6:.1f} MB")
@@ -0,0 +1,176 @@
+"""
+Model bundle for the Flask app
+
+The crop forest is stored as flat .npy node arrays that every worker
+memory-maps read-only, so gunicorn workers share the pages through the OS
+page cache instead of each unpickling its own copy. The small scaler and
+encoders are kept in a regular pickle next to them.
+
+    python model_bundle.py    # convert model.pkl, scaler.pkl, ... into model_bundle/
+"""
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crop (1)', 'crop'))
+from forest_engine import ARRAY_FIELDS, CompiledForest, compile_forest
+from feature_encoder import FeatureEncoder, Vocabulary
+
+MODEL_BUNDLE_DIR = os.environ.get('MODEL_BUNDLE_DIR', 'model_bundle')
+BUNDLE_FORMAT = 1
+
+pickle_files = {
+    'model': 'model.pkl',
+    'scaler': 'scaler.pkl',
+    'fertilizer_encoder': 'fertilizer.pkl',
+    'soil_encoder': 'soil_encoder.pkl',
+    'crop_encoder': 'crop_encoder.pkl'
+}
+label_encoder_keys = ['fertilizer_encoder', 'soil_encoder', 'crop_encoder']
+
+# Written by crop.py next to model.pkl; optional for older artifacts
+ENCODERS_FILE = 'encoders.json'
+# Student model written by `crop.py --distill`; optional
+FAST_PATH_FILE = 'fast_path.pkl'
+
+
+class MissingArtifactError(FileNotFoundError):
+    pass
+
+
+def load_pickles(directory='.'):
+    missing = [name for name in pickle_files.values() if not os.path.exists(os.path.join(directory, name))]
+    if missing:
+        raise MissingArtifactError(
+            f"Missing model artifacts in {os.path.abspath(directory)}: {', '.join(missing)}. "
+            "Run crop.py to train model.pkl and scaler.pkl, and provide the encoder pickles."
+        )
+
+    objects = {}
+    for key, name in pickle_files.items():
+        with open(os.path.join(directory, name), 'rb') as f:
+            objects[key] = pickle.load(f)
+    objects['feature_encoder'] = load_feature_encoder(directory)
+    fast_path_file = os.path.join(directory, FAST_PATH_FILE)
+    if os.path.exists(fast_path_file):
+        with open(fast_path_file, 'rb') as f:
+            objects['fast_path'] = pickle.load(f)
+    return as_vocabularies(objects)
+
+
+def load_feature_encoder(directory):
+    path = os.path.join(directory, ENCODERS_FILE)
+    return FeatureEncoder.load(path) if os.path.exists(path) else None
+
+
+def as_vocabularies(objects):
+    # Pickled LabelEncoders are swapped for vocabularies with the same
+    # classes, which look codes up in a dict/array instead of searchsorted.
+    for key in label_encoder_keys:
+        if not isinstance(objects.get(key), Vocabulary):
+            objects[key] = Vocabulary.from_label_encoder(objects[key], name=key)
+    return objects
+
+
+def check_fast_path(objects, forest):
+    # A student distilled from an older model.pkl would answer for the wrong forest
+    fast_path = objects.get('fast_path')
+    if fast_path is not None and fast_path.teacher_digest != forest.digest():
+        print(f"Ignoring {FAST_PATH_FILE}: it was distilled from a different model; rerun crop.py --distill")
+        objects['fast_path'] = None
+    return objects
+
+
+def build_bundle(objects, path=None):
+    path = path or MODEL_BUNDLE_DIR
+    forest = compile_forest(objects['model'])
+    check_fast_path(objects, forest)
+    feature_encoder = objects.get('feature_encoder')
+    small_objects = {key: value for key, value in objects.items() if key not in ('model', 'feature_encoder')}
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'version': forest.digest(),
+        'created_at': datetime.utcnow().isoformat(),
+        'objects': sorted(small_objects)
+    }
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix='.bundle-', dir=parent)
+    os.chmod(tmp_dir, 0o755)
+    try:
+        forest.save(os.path.join(tmp_dir, 'forest'))
+        with open(os.path.join(tmp_dir, 'objects.pkl'), 'wb') as f:
+            pickle.dump(small_objects, f, protocol=pickle.HIGHEST_PROTOCOL)
+        if feature_encoder is not None:
+            feature_encoder.save(os.path.join(tmp_dir, ENCODERS_FILE))
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        # Swap the new bundle in; workers that already mapped the old
+        # files keep reading them until they restart.
+        old_dir = None
+        if os.path.exists(path):
+            old_dir = tempfile.mkdtemp(prefix='.bundle-old-', dir=parent)
+            os.replace(path, os.path.join(old_dir, 'bundle'))
+        os.replace(tmp_dir, path)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return manifest
+
+
+def load_bundle(path=None, mmap_mode='r'):
+    path = path or MODEL_BUNDLE_DIR
+    manifest_path = os.path.join(path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        raise MissingArtifactError(
+            f"No model bundle at {os.path.abspath(path)}. "
+            "Run `python model_bundle.py` to build one from model.pkl, scaler.pkl and the encoder pickles."
+        )
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported model bundle format {manifest.get('format')} in {path}")
+
+    forest_dir = os.path.join(path, 'forest')
+    required = [os.path.join(forest_dir, f"{name}.npy") for name in ARRAY_FIELDS]
+    required += [os.path.join(forest_dir, 'forest.json'), os.path.join(path, 'objects.pkl')]
+    missing = [os.path.relpath(p, path) for p in required if not os.path.exists(p)]
+    if missing:
+        raise MissingArtifactError(f"Model bundle at {os.path.abspath(path)} is incomplete; missing {', '.join(missing)}")
+
+    forest = CompiledForest.load(forest_dir, mmap_mode=mmap_mode)
+    with open(os.path.join(path, 'objects.pkl'), 'rb') as f:
+        objects = pickle.load(f)
+    objects.update(model=forest, compiled_model=forest, version=manifest['version'],
+                   feature_encoder=load_feature_encoder(path))
+    return as_vocabularies(objects)
+
+
+def load_models(bundle_dir=None, pickle_dir='.'):
+    """Load the memory-mapped bundle, or fall back to the legacy pickles
+    when no bundle has been built yet."""
+    bundle_dir = bundle_dir or MODEL_BUNDLE_DIR
+    if os.path.exists(os.path.join(bundle_dir, 'manifest.json')):
+        return load_bundle(bundle_dir)
+
+    try:
+        objects = load_pickles(pickle_dir)
+    except MissingArtifactError as e:
+        raise MissingArtifactError(f"No model bundle at {os.path.abspath(bundle_dir)}. {e}") from None
+    objects['compiled_model'] = compile_forest(objects['model'])
+    check_fast_path(objects, objects['compiled_model'])
+    objects['version'] = str(os.path.getmtime(os.path.join(pickle_dir, pickle_files['model'])))
+    return objects
+
+
+if __name__ == '__main__':
+    manifest = build_bundle(load_pickles())
+    print(f"Model bundle {manifest['version']} written to {os.path.abspath(MODEL_BUNDLE_DIR)}")
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import crop1
+from weather_client import provider_clients
+from weather_stub import StubWeatherServer
+
+
+@pytest.fixture
+def stub():
+    with StubWeatherServer(retry_after=0) as server:
+        yield server
+
+
+@pytest.fixture
+def providers(stub, monkeypatch):
+    """crop1's fetchers pointed at the stand-in server, with fresh clients
+    that back off quickly."""
+    urls = stub.urls()
+    monkeypatch.setattr(crop1, 'WEATHERAPI_URL', urls['weatherapi'])
+    monkeypatch.setattr(crop1, 'TOMORROW_URL', urls['tomorrow'])
+    clients = provider_clients(read_timeout=2, backoff_base=0.01, backoff_max=0.05)
+    monkeypatch.setattr(crop1, 'CLIENTS', clients)
+    yield stub
+    for client in clients.values():
+        client.close()
+
+
+@pytest.fixture
+def fast_quotas():
+    return {'weatherapi': '1000/s', 'tomorrow': '1000/s'}
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+import crop1
+from weather_cache import WeatherCache
+from weather_collector import Collector
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = WeatherCache(str(tmp_path / 'cache.sqlite'), bucket_seconds=900, clock=FakeClock(1000.0))
+    yield cache
+    cache.close()
+
+
+def test_responses_last_until_the_bucket_ends(cache):
+    cache.put('weatherapi', 'Pune', {'Temperature': 30.0})
+    assert cache.get('weatherapi', 'Pune') == {'Temperature': 30.0}
+    assert cache.get('tomorrow', 'Pune') is None
+
+    cache.clock.now = 1799.0
+    assert cache.get('weatherapi', 'Pune') == {'Temperature': 30.0}
+    cache.clock.now = 1800.0
+    assert cache.get('weatherapi', 'Pune') is None
+    assert cache.purge() == 1
+    assert cache.clear() == 0
+
+
+def test_concurrent_fetches_share_one_call(cache):
+    calls = []
+
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        return {'Temperature': 30.0}
+
+    async def main():
+        return await asyncio.gather(*(cache.fetch('weatherapi', 'Pune', compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == [{'Temperature': 30.0}] * 5
+    assert asyncio.run(main()) == [{'Temperature': 30.0}] * 5
+    assert len(calls) == 1
+    assert (cache.misses, cache.joined, cache.hits) == ({'weatherapi': 1}, {'weatherapi': 4}, {'weatherapi': 5})
+
+
+def test_failed_fetches_are_not_stored(cache):
+    async def compute():
+        return None
+
+    assert asyncio.run(cache.fetch('weatherapi', 'Pune', compute)) is None
+    assert cache.get('weatherapi', 'Pune') is None
+
+
+def test_joiners_get_none_when_the_owner_is_cancelled(cache):
+    async def compute():
+        await asyncio.sleep(1)
+        return {'Temperature': 30.0}
+
+    async def main():
+        owner = asyncio.ensure_future(cache.fetch('weatherapi', 'Pune', compute))
+        await asyncio.sleep(0)
+        joiner = asyncio.ensure_future(cache.fetch('weatherapi', 'Pune', compute))
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        return await joiner
+
+    assert asyncio.run(main()) is None
+    assert cache.joined == {'weatherapi': 1}
+
+
+def test_repeated_cities_reach_each_provider_once(providers, fast_quotas, cache):
+    locations = crop1.LOCATIONS[:9]
+    cities = {location['city'] for location in locations}
+    collector = Collector(fast_quotas, concurrency=4, cache=cache)
+    records = collector.run(locations, crop1.fetch_weather_async)
+
+    assert all(record['Sources'] == 'tomorrow+weatherapi' for record in records)
+    assert providers.requests == {'weatherapi': len(cities), 'tomorrow': len(cities)}
+    assert collector.upstream_calls == {'weatherapi': len(cities), 'tomorrow': len(cities)}
+    for provider in ('weatherapi', 'tomorrow'):
+        assert cache.hits.get(provider, 0) + cache.joined.get(provider, 0) == len(locations) - len(cities)
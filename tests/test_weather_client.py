@@ -0,0 +1,109 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import crop1
+from weather_client import ProviderClient, percentiles, retry_after_seconds
+from weather_stub import StubWeatherServer
+
+
+class FakeResponse:
+    def __init__(self, retry_after=None):
+        self.headers = {} if retry_after is None else {'Retry-After': retry_after}
+
+
+def client(name='weatherapi', **kwargs):
+    kwargs = {'backoff_base': 0.01, 'backoff_max': 0.05, 'read_timeout': 2, **kwargs}
+    return ProviderClient(name, **kwargs)
+
+
+def test_percentiles():
+    assert percentiles([]) == {}
+    assert percentiles([i / 1000 for i in range(1, 101)]) == {'p50': 51.0, 'p95': 96.0, 'p99': 100.0}
+
+
+def test_retry_after_in_seconds_or_as_a_date():
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds(FakeResponse()) is None
+    assert retry_after_seconds(FakeResponse('7')) == 7.0
+    assert retry_after_seconds(FakeResponse(format_datetime(now + timedelta(seconds=30), usegmt=True)), now) == 30.0
+    assert retry_after_seconds(FakeResponse(format_datetime(now - timedelta(seconds=30), usegmt=True)), now) == 0.0
+    assert retry_after_seconds(FakeResponse('soon')) is None
+
+
+def test_backoff_is_capped_but_honors_retry_after():
+    c = client(backoff_base=1, backoff_max=2)
+    assert all(0 <= c.backoff(attempt) <= 2 for attempt in range(10))
+    assert c.backoff(0, FakeResponse('5')) == 5.0
+    c.close()
+
+
+def test_reuses_one_connection(stub):
+    c = client()
+    for _ in range(5):
+        assert c.get(stub.urls()['weatherapi'], {'key': 'k', 'q': 'Pune'}).ok
+    c.close()
+    assert stub.requests['weatherapi'] == 5
+    assert stub.connections == 1
+
+
+def test_retries_injected_failures():
+    throttled = []
+    with StubWeatherServer(fail_rate=0.5, retry_after=0, seed=3) as server:
+        c = client(max_retries=10, throttle=lambda: throttled.append(None))
+        for _ in range(10):
+            assert c.get(server.urls()['weatherapi'], {'key': 'k', 'q': 'Pune'}).ok
+        c.close()
+
+    failures = sum(server.failures.values())
+    assert failures > 0
+    stats = c.stats.stats()
+    assert stats['calls'] == 10
+    assert stats['failures'] == 0
+    assert stats['attempts'] == server.requests['weatherapi'] == 10 + failures
+    assert stats['retries'] == len(throttled) == failures
+
+
+def test_waits_as_long_as_retry_after_asks():
+    with StubWeatherServer(fail_rate=1.0, retry_after=0.2) as server:
+        c = client(max_retries=1)
+        response = c.get(server.urls()['tomorrow'], {'apikey': 'k', 'location': '1,2'})
+        c.close()
+    assert response.status_code in (429, 503)
+    assert server.requests['tomorrow'] == 2
+    assert c.stats.backoff_seconds == pytest.approx(0.2)
+    assert c.stats.stats()['failures'] == 1
+
+
+def test_client_errors_are_not_retried(stub):
+    c = client(max_retries=3)
+    response = c.get(stub.urls()['weatherapi'], {'q': 'Pune'})
+    c.close()
+    assert response.status_code == 401
+    assert stub.requests['weatherapi'] == 1
+
+
+def test_timeouts_are_retried_then_give_up():
+    with StubWeatherServer(latency=0.5) as server:
+        c = client(max_retries=1, read_timeout=0.05)
+        assert c.get(server.urls()['weatherapi'], {'key': 'k', 'q': 'Pune'}) is None
+        c.close()
+    assert server.requests['weatherapi'] == 2
+    assert c.stats.errors == {'timeout': 2}
+
+
+def test_unreachable_server_is_a_connection_error():
+    with StubWeatherServer() as server:
+        url = server.urls()['weatherapi']
+    c = client(max_retries=0)
+    assert c.get(url) is None
+    c.close()
+    assert c.stats.errors == {'connection': 1}
+
+
+def test_fetcher_returns_none_when_rejected(providers, monkeypatch):
+    monkeypatch.setattr(crop1, 'WEATHER_API_KEY', '')
+    assert crop1.fetch_weather_weatherapi(crop1.LOCATIONS[0]) is None
+    assert crop1.CLIENTS['weatherapi'].stats.stats()['errors'] == {'http 401': 1}
@@ -0,0 +1,201 @@
+import asyncio
+import random
+import threading
+import time
+
+import pytest
+
+import crop1
+from weather_collector import Collector, RateLimiter, TokenBucket, parse_quota
+from weather_stub import readings
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_parse_quota():
+    assert parse_quota("3/s, 25/h,500/d") == [(3, 1), (25, 3600), (500, 86400)]
+    with pytest.raises(ValueError):
+        parse_quota("3/week")
+
+
+def test_token_bucket_paces_after_burst():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+    assert [bucket.reserve() for _ in range(4)] == [0.0, 0.0, 0.5, 1.0]
+    clock.now = 10.0
+    # Refills to capacity, never beyond it
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.5]
+
+
+def test_rate_limiter_takes_the_strictest_bucket():
+    clock = FakeClock()
+    limiter = RateLimiter('tomorrow', "3/s,5/m", clock)
+    delays = [limiter._reserve() for _ in range(6)]
+    assert delays[:3] == [0.0, 0.0, 0.0]
+    assert delays[5] == pytest.approx(12.0)
+    assert limiter.calls == 6
+    assert limiter.minimum_seconds(3) == 0.0
+    assert limiter.minimum_seconds(11) == pytest.approx(72.0)
+
+
+def test_run_returns_results_in_item_order(fast_quotas):
+    async def fetch(collector, item, i):
+        await asyncio.sleep(random.random() / 100)
+        return item * 10
+
+    collector = Collector(fast_quotas, concurrency=4)
+    assert collector.run(range(20), fetch) == [i * 10 for i in range(20)]
+    assert collector.n_items == 20
+
+
+def test_run_skips_done_items_and_streams_results(fast_quotas):
+    seen = []
+
+    async def fetch(collector, item, i):
+        return item.upper()
+
+    collector = Collector(fast_quotas, concurrency=3)
+    returned = collector.run(list('abcdef'), fetch, lambda i, item, result: seen.append((i, result)), skip={1, 4})
+    assert returned is None
+    assert sorted(seen) == [(0, 'A'), (2, 'C'), (3, 'D'), (5, 'F')]
+
+
+def test_fetchers_parse_both_response_shapes(providers):
+    location = crop1.LOCATIONS[0]
+    weatherapi = crop1.fetch_weather_weatherapi(location)
+    expected = readings(location['city'])
+    assert weatherapi == {
+        'Temperature': expected['temperature'], 'Humidity': expected['humidity'], 'Rainfall': expected['rainfall']
+    }
+
+    tomorrow = crop1.fetch_weather_tomorrow(location)
+    expected = readings(f"{location['lat']:.1f},{location['lon']:.1f}")
+    assert tomorrow['Temperature'] == pytest.approx(expected['temperature'] + 0.4)
+    assert tomorrow['Humidity'] == expected['humidity']
+    assert tomorrow['Rainfall'] == expected['rainfall']
+
+
+def test_collects_records_from_both_providers(providers, fast_quotas):
+    locations = crop1.LOCATIONS[:6]
+    collector = Collector(fast_quotas, concurrency=4)
+    records = collector.run(locations, crop1.fetch_weather_async)
+
+    assert [record['Location'] for record in records] == [location['city'] for location in locations]
+    assert {record['Sources'] for record in records} == {'tomorrow+weatherapi'}
+    assert providers.requests == {'weatherapi': 6, 'tomorrow': 6}
+    # Same record as the serial path
+    assert records[0] == crop1.fetch_weather(locations[0], 0)
+
+
+def test_fan_out_leaves_out_providers_past_the_merge_window(fast_quotas):
+    async def value(result, delay):
+        await asyncio.sleep(delay)
+        return result
+
+    async def fetch(collector, item, i):
+        return await collector.fan_out({'weatherapi': value('fast', 0.01), 'tomorrow': value('slow', 1.0)})
+
+    collector = Collector(fast_quotas, concurrency=1, merge_window=0.05)
+    start = time.perf_counter()
+    assert collector.run([0], fetch) == [{'weatherapi': 'fast'}]
+    assert time.perf_counter() - start < 0.5
+    assert collector.late == {'weatherapi': 0, 'tomorrow': 1}
+
+
+def test_fan_out_waits_for_the_other_provider_after_a_failure(fast_quotas):
+    async def value(result, delay):
+        await asyncio.sleep(delay)
+        return result
+
+    async def fetch(collector, item, i):
+        return await collector.fan_out({'weatherapi': value(None, 0.01), 'tomorrow': value('late', 0.2)})
+
+    collector = Collector(fast_quotas, concurrency=1, merge_window=0.05)
+    assert collector.run([0], fetch) == [{'tomorrow': 'late'}]
+
+
+def test_hedge_answers_for_a_stalled_request(fast_quotas):
+    calls = []
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            calls.append(None)
+            first = len(calls) == 1
+        time.sleep(1.0 if first else 0.01)
+        return 'hedge' if not first else 'first'
+
+    async def fetch(collector, item, i):
+        return await collector.call('weatherapi', request)
+
+    collector = Collector(fast_quotas, concurrency=1, hedge_after=0.05)
+    start = time.perf_counter()
+    assert collector.run([0], fetch) == ['hedge']
+    assert time.perf_counter() - start < 0.5
+    assert collector.hedges['weatherapi'] == 1
+    assert collector.hedge_wins['weatherapi'] == 1
+
+
+def test_busy_pool_does_not_queue_new_requests(fast_quotas):
+    release = threading.Event()
+
+    def stalled():
+        release.wait(5)
+
+    def quick():
+        return 'ok'
+
+    async def fetch(collector, item, i):
+        if item == 'stall':
+            # Abandon the request, as the merge window does; its thread stays busy.
+            task = asyncio.ensure_future(collector.call('weatherapi', stalled))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            return None
+        start = time.perf_counter()
+        result = await collector.call('weatherapi', quick)
+        release.set()
+        return result, time.perf_counter() - start
+
+    collector = Collector({'weatherapi': '1000/s'}, concurrency=1)
+    results = collector.run(['stall', 'quick'], fetch)
+    assert results[1][0] == 'ok'
+    assert results[1][1] < 1.0
+    assert collector.overflow_threads == 1
+
+
+def test_a_provider_that_raises_is_left_out(providers, fast_quotas, monkeypatch):
+    respond = providers.respond
+
+    def malformed(provider, query):
+        status, body = respond(provider, query)
+        return (200, {'current': {}}) if provider == 'weatherapi' else (status, body)
+
+    monkeypatch.setattr(providers, 'respond', malformed)
+    locations = crop1.LOCATIONS[:4]
+    collector = Collector(fast_quotas, concurrency=2, merge_window=0.5)
+    records = collector.run(locations, crop1.fetch_weather_async)
+
+    assert [record['Sources'] for record in records] == ['tomorrow'] * 4
+    assert collector.errors == {'weatherapi': {'KeyError': 4}, 'tomorrow': {}}
+    assert 'errors KeyError x4' in collector.report()
+
+
+def test_location_fails_when_every_provider_raises(fast_quotas):
+    def broken():
+        raise ValueError("bad body")
+
+    async def fetch(collector, item, i):
+        return await collector.fan_out({
+            'weatherapi': collector.call('weatherapi', broken), 'tomorrow': collector.call('tomorrow', broken)
+        })
+
+    collector = Collector(fast_quotas, concurrency=1, hedge_after=0.05)
+    assert collector.run([0], fetch) == [{}]
+    assert collector.errors == {'weatherapi': {'ValueError': 1}, 'tomorrow': {'ValueError': 1}}
@@ -0,0 +1,124 @@
+import csv
+import os
+
+import pytest
+
+import crop1
+import weather_collector
+from weather_writer import CheckpointedCSVWriter, items_key
+
+COLUMNS = ['Location', 'Temperature']
+
+
+def row(i):
+    return {'Location': f"city {i}", 'Temperature': float(i)}
+
+
+def read_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def crash(writer):
+    """Leave the files as a killed process would: unflushed rows lost."""
+    writer._csv.close()
+    writer._checkpoint.close()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'weather.csv')
+
+
+def test_writes_batches_in_index_order_and_removes_the_checkpoint(path):
+    with CheckpointedCSVWriter(path, 'run', 4, COLUMNS, batch_size=2) as writer:
+        for i in (1, 0, 3, 2):
+            writer.write(i, row(i))
+    assert [r['Location'] for r in read_rows(path)] == ['city 0', 'city 1', 'city 2', 'city 3']
+    assert writer.complete
+    assert not os.path.exists(writer.checkpoint_path)
+
+
+def test_resumes_after_a_crash(path):
+    writer = CheckpointedCSVWriter(path, 'run', 5, COLUMNS, batch_size=2)
+    for i in range(3):
+        writer.write(i, row(i))
+    crash(writer)
+
+    writer = CheckpointedCSVWriter(path, 'run', 5, COLUMNS, batch_size=2)
+    assert writer.done == {0, 1}
+    assert writer.resumed == 2
+    for i in range(5):
+        if i not in writer.done:
+            writer.write(i, row(i))
+    writer.close()
+    assert writer.written == 3
+    assert read_rows(path) == [{k: str(v) for k, v in row(i).items()} for i in range(5)]
+
+
+def test_drops_rows_the_checkpoint_does_not_cover(path):
+    writer = CheckpointedCSVWriter(path, 'run', 5, COLUMNS, batch_size=2)
+    for i in range(2):
+        writer.write(i, row(i))
+    crash(writer)
+    # Rows written after the last checkpoint line, and a torn line.
+    with open(path, 'a', newline='') as f:
+        f.write("city 2,2.0\r\ncity")
+    with open(writer.checkpoint_path, 'a') as f:
+        f.write('{"offset": 99')
+
+    writer = CheckpointedCSVWriter(path, 'run', 5, COLUMNS, batch_size=2)
+    assert writer.done == {0, 1}
+    writer.close()
+    assert len(read_rows(path)) == 2
+
+
+@pytest.mark.parametrize('run_key, columns', [('other run', COLUMNS), ('run', COLUMNS + ['Humidity'])])
+def test_starts_over_for_other_items_or_columns(path, run_key, columns):
+    writer = CheckpointedCSVWriter(path, 'run', 5, COLUMNS, batch_size=2)
+    for i in range(2):
+        writer.write(i, row(i))
+    crash(writer)
+
+    writer = CheckpointedCSVWriter(path, run_key, 5, columns, batch_size=2)
+    assert writer.done == set()
+    writer.close()
+    assert not os.path.exists(path) or read_rows(path) == []
+
+
+def test_restart_ignores_the_checkpoint(path):
+    writer = CheckpointedCSVWriter(path, 'run', 5, COLUMNS, batch_size=2)
+    for i in range(2):
+        writer.write(i, row(i))
+    crash(writer)
+    assert CheckpointedCSVWriter(path, 'run', 5, COLUMNS, resume=False).done == set()
+
+
+def test_interrupted_collection_resumes_with_the_remaining_locations(providers, fast_quotas, path, monkeypatch):
+    monkeypatch.setattr(weather_collector, 'PROVIDER_QUOTAS', fast_quotas)
+    locations = crop1.LOCATIONS[:6]
+    key = items_key(locations)
+
+    class Interrupted(Exception):
+        pass
+
+    writer = CheckpointedCSVWriter(path, key, len(locations), crop1.WEATHER_COLUMNS, batch_size=1)
+    write = writer.write
+
+    def write_then_stop(i, data):
+        write(i, data)
+        if len(writer.done) == 3:
+            raise Interrupted
+
+    monkeypatch.setattr(writer, 'write', write_then_stop)
+    with pytest.raises(Interrupted):
+        crop1.collect(locations, writer, concurrency=1)
+    crash(writer)
+    assert providers.requests == {'weatherapi': 3, 'tomorrow': 3}
+
+    with CheckpointedCSVWriter(path, key, len(locations), crop1.WEATHER_COLUMNS, batch_size=1) as writer:
+        assert writer.resumed == 3
+        crop1.collect(locations, writer, concurrency=1)
+    assert writer.complete
+    assert providers.requests == {'weatherapi': 6, 'tomorrow': 6}
+    assert [r['Location'] for r in read_rows(path)] == [location['city'] for location in locations]
@@ -0,0 +1,167 @@
+"""
+Hyperparameter search for the crop.py random forest
+
+Candidates are sampled at random and trimmed by successive halving with
+n_estimators as the budget: each round keeps the best 1/HALVING_FACTOR of
+the candidates and re-scores them with HALVING_FACTOR times more trees.
+Scaled fold matrices are built once and shared by every fit, and each
+(candidate, budget, fold) score is appended to a JSON-lines log so an
+interrupted sweep resumes where it stopped.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import MinMaxScaler
+
+TUNING_RESULTS = os.environ.get("TUNING_RESULTS", "tuning_results.jsonl")
+HALVING_FACTOR = 3
+
+PARAM_SPACE = {
+    'max_depth': [4, 6, 8, 10, 12, 16, None],
+    'min_samples_split': [2, 5, 10, 20],
+    'min_samples_leaf': [1, 2, 5, 10],
+    'max_features': ['sqrt', 'log2', 0.5, None],
+    'criterion': ['gini', 'entropy'],
+    'bootstrap': [True, False]
+}
+
+
+def scaled_folds(X, y, n_splits=5, random_state=42):
+    """Split once and scale each fold with a scaler fitted on its training
+    part. Forests train on float32, so the matrices are stored that way to
+    avoid a copy per fit."""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    folds = []
+    kfold = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+    for train_idx, valid_idx in kfold.split(X, y):
+        scaler = MinMaxScaler().fit(X[train_idx])
+        folds.append((
+            np.ascontiguousarray(scaler.transform(X[train_idx]), dtype=np.float32),
+            y[train_idx],
+            np.ascontiguousarray(scaler.transform(X[valid_idx]), dtype=np.float32),
+            y[valid_idx]
+        ))
+    return folds
+
+
+def sweep_fingerprint(X, y, n_splits, random_state):
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+    digest.update(np.asarray(y).astype(str).tobytes())
+    digest.update(f"{n_splits}:{random_state}".encode())
+    return digest.hexdigest()
+
+
+def sample_candidates(n_candidates, random_state=42):
+    rng = np.random.default_rng(random_state)
+    candidates = []
+    seen = set()
+    max_distinct = math.prod(len(values) for values in PARAM_SPACE.values())
+    while len(candidates) < min(n_candidates, max_distinct):
+        params = {name: values[rng.integers(len(values))] for name, values in PARAM_SPACE.items()}
+        key = candidate_key(params)
+        if key not in seen:
+            seen.add(key)
+            candidates.append(params)
+    return candidates
+
+
+def candidate_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def load_results(path, fingerprint):
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partial line from an interrupted write
+            if record.get('fingerprint') == fingerprint:
+                done[(record['candidate'], record['n_estimators'], record['fold'])] = record['score']
+    return done
+
+
+def append_result(f, record):
+    f.write(json.dumps(record) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def score_fold(params, n_estimators, fold, random_state):
+    X_train, y_train, X_valid, y_valid = fold
+    start = time.perf_counter()
+    model = RandomForestClassifier(
+        n_estimators=n_estimators, random_state=random_state, n_jobs=1, **params
+    )
+    model.fit(X_train, y_train)
+    score = float(np.mean(model.predict(X_valid) == y_valid))
+    return score, time.perf_counter() - start
+
+
+def successive_halving(X, y, n_candidates=27, min_estimators=10, max_estimators=300,
+                       n_splits=5, n_jobs=-1, results_path=None, random_state=42, verbose=True):
+    results_path = results_path or TUNING_RESULTS
+    folds = scaled_folds(X, y, n_splits, random_state)
+    fingerprint = sweep_fingerprint(X, y, n_splits, random_state)
+    done = load_results(results_path, fingerprint)
+    if verbose and done:
+        print(f"Resuming sweep: {len(done)} fold scores loaded from {results_path}")
+
+    candidates = sample_candidates(n_candidates, random_state)
+    n_estimators = min_estimators
+    rounds = []
+    with open(results_path, 'a') as log, Parallel(n_jobs=n_jobs, return_as='generator') as parallel:
+        while True:
+            keys = [candidate_key(params) for params in candidates]
+            todo = [
+                (i, fold) for i in range(len(candidates)) for fold in range(n_splits)
+                if (keys[i], n_estimators, fold) not in done
+            ]
+            jobs = (
+                delayed(score_fold)(candidates[i], n_estimators, folds[fold], random_state)
+                for i, fold in todo
+            )
+            for (i, fold), (score, seconds) in zip(todo, parallel(jobs)):
+                done[(keys[i], n_estimators, fold)] = score
+                append_result(log, {
+                    'fingerprint': fingerprint, 'candidate': keys[i], 'n_estimators': n_estimators,
+                    'fold': fold, 'score': score, 'fit_seconds': round(seconds, 4)
+                })
+
+            scores = [
+                float(np.mean([done[(key, n_estimators, fold)] for fold in range(n_splits)]))
+                for key in keys
+            ]
+            order = np.argsort(-np.asarray(scores), kind='stable')
+            rounds.append({
+                'n_estimators': n_estimators, 'candidates': len(candidates),
+                'best_score': scores[order[0]], 'fits_run': len(todo)
+            })
+            if verbose:
+                print(f"  {len(candidates):3d} candidates x {n_estimators:4d} trees: "
+                      f"best CV accuracy {scores[order[0]]:.4f} ({len(todo)} new fits)")
+
+            next_estimators = n_estimators * HALVING_FACTOR
+            if len(candidates) <= 1 or next_estimators > max_estimators:
+                break
+            candidates = [candidates[i] for i in order[:max(1, math.ceil(len(candidates) / HALVING_FACTOR))]]
+            n_estimators = next_estimators
+
+    return {
+        'best_params': candidates[order[0]],
+        'n_estimators': n_estimators,
+        'cv_score': scores[order[0]],
+        'rounds': rounds
+    }
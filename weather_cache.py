@@ -0,0 +1,149 @@
+"""
+On-disk cache for weather provider responses
+
+Responses are stored in SQLite under (provider, location, time bucket),
+where the bucket is the current time divided into WEATHER_CACHE_BUCKET
+second windows. A location asked for again within the same window is
+answered from disk, so crop1.py's repeated cities only reach each provider
+once per window. Concurrent requests for a key that is already being
+fetched wait for that fetch instead of making their own.
+
+    python weather_cache.py [--purge | --clear]
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+WEATHER_CACHE_PATH = os.environ.get("WEATHER_CACHE_PATH", os.path.join(BASE_DIR, 'weather_cache.sqlite'))
+# Current conditions change slowly; 15 minutes matches how often the
+# providers refresh their own readings.
+WEATHER_CACHE_BUCKET = int(os.environ.get("WEATHER_CACHE_BUCKET", "900"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    provider TEXT NOT NULL,
+    location TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (provider, location, bucket)
+)
+"""
+
+
+class WeatherCache:
+    """Provider responses by location for the current time bucket. Used
+    from the collector's event loop thread only."""
+
+    def __init__(self, path=None, bucket_seconds=None, clock=time.time):
+        self.path = path or WEATHER_CACHE_PATH
+        self.bucket_seconds = bucket_seconds or WEATHER_CACHE_BUCKET
+        self.clock = clock
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self._inflight = {}
+        self.hits = {}
+        self.misses = {}
+        self.joined = {}
+
+    def bucket(self):
+        return int(self.clock() // self.bucket_seconds)
+
+    def get(self, provider, location):
+        row = self.db.execute(
+            "SELECT body FROM responses WHERE provider = ? AND location = ? AND bucket = ?",
+            (provider, location, self.bucket())
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, provider, location, value):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (provider, location, self.bucket(), self.clock(), json.dumps(value))
+            )
+
+    def purge(self):
+        """Delete responses from past buckets; returns how many."""
+        with self.db:
+            return self.db.execute("DELETE FROM responses WHERE bucket < ?", (self.bucket(),)).rowcount
+
+    def clear(self):
+        with self.db:
+            return self.db.execute("DELETE FROM responses").rowcount
+
+    def close(self):
+        self.db.close()
+
+    def _count(self, counts, provider):
+        counts[provider] = counts.get(provider, 0) + 1
+
+    async def fetch(self, provider, location, compute):
+        """The cached response, or `await compute()` stored for the rest
+        of the bucket. None results (failed fetches) are not stored."""
+        key = (provider, location, self.bucket())
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._count(self.joined, provider)
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The fetch we joined was abandoned by its own caller.
+                if pending.cancelled():
+                    return None
+                raise
+
+        cached = self.get(provider, location)
+        if cached is not None:
+            self._count(self.hits, provider)
+            return cached
+
+        self._count(self.misses, provider)
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await compute()
+            if value is not None:
+                self.put(provider, location, value)
+            pending.set_result(value)
+            return value
+        except Exception as e:
+            pending.set_exception(e)
+            # Waiters re-raise it; mark it retrieved in case there are none.
+            pending.exception()
+            raise
+        finally:
+            del self._inflight[key]
+            if not pending.done():
+                pending.cancel()
+
+    def report(self):
+        lines = [f"Weather cache ({self.bucket_seconds} s buckets, {self.path}):"]
+        for provider in sorted(set(self.hits) | set(self.misses) | set(self.joined)):
+            hits, misses, joined = (counts.get(provider, 0) for counts in (self.hits, self.misses, self.joined))
+            total = hits + misses + joined
+            lines.append(
+                f"  {provider}: {total} request(s), {hits} from disk, {joined} joined an in-flight fetch, "
+                f"{misses} upstream; hit rate {(hits + joined) / total:.0%}, {hits + joined} upstream call(s) saved"
+            )
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    cache = WeatherCache()
+    if '--clear' in sys.argv[1:]:
+        print(f"Removed {cache.clear()} response(s) from {cache.path}")
+    elif '--purge' in sys.argv[1:]:
+        print(f"Removed {cache.purge()} expired response(s) from {cache.path}")
+    else:
+        rows = cache.db.execute(
+            "SELECT provider, COUNT(*), SUM(bucket = ?) FROM responses GROUP BY provider", (cache.bucket(),)
+        ).fetchall()
+        for provider, total, current in rows:
+            print(f"{provider}: {total} response(s), {current} in the current bucket")
+    cache.close()
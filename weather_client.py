@@ -0,0 +1,196 @@
+"""
+HTTP client layer for the weather providers crop1.py calls
+
+Each provider gets one requests.Session whose connection pool keeps
+connections alive across calls, so only the first request per connection
+pays the TCP/TLS handshake. Every attempt has connect and read timeouts.
+Connection errors, timeouts, 429 and 5xx responses are retried with capped
+exponential backoff and full jitter, waiting at least as long as a
+Retry-After header asks. Latency and errors are counted per provider.
+
+Timeouts and retries are set with WEATHER_CONNECT_TIMEOUT,
+WEATHER_READ_TIMEOUT, WEATHER_MAX_RETRIES, WEATHER_BACKOFF_BASE and
+WEATHER_BACKOFF_MAX (seconds).
+"""
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+WEATHER_CONNECT_TIMEOUT = float(os.environ.get("WEATHER_CONNECT_TIMEOUT", "3.05"))
+WEATHER_READ_TIMEOUT = float(os.environ.get("WEATHER_READ_TIMEOUT", "10"))
+WEATHER_MAX_RETRIES = int(os.environ.get("WEATHER_MAX_RETRIES", "3"))
+WEATHER_BACKOFF_BASE = float(os.environ.get("WEATHER_BACKOFF_BASE", "0.5"))
+WEATHER_BACKOFF_MAX = float(os.environ.get("WEATHER_BACKOFF_MAX", "30"))
+WEATHER_POOL_SIZE = int(os.environ.get("WEATHER_POOL_SIZE", os.environ.get("COLLECTOR_CONCURRENCY", "16")))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+LATENCY_SAMPLES = 10000
+
+
+def percentiles(samples):
+    """p50/p95/p99 of `samples` in milliseconds, nearest-rank."""
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {
+        f"p{q}": round(samples[min(len(samples) - 1, int(q / 100 * len(samples)))] * 1000, 2)
+        for q in (50, 95, 99)
+    }
+
+
+def retry_after_seconds(response, now=None):
+    """Seconds the Retry-After header asks for, or None. The header is
+    either a number of seconds or an HTTP date."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = now or datetime.now(timezone.utc)
+    return max(0.0, (when - now).total_seconds())
+
+
+class ProviderStats:
+    """Attempts, retries, failures and errors by kind for one provider,
+    plus the latencies of the most recent attempts."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.backoff_seconds = 0.0
+        self.errors = Counter()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def record_attempt(self, seconds, error=None):
+        with self._lock:
+            self.attempts += 1
+            self._latencies.append(seconds)
+            if error is not None:
+                self.errors[error] += 1
+
+    def record_retry(self, delay):
+        with self._lock:
+            self.retries += 1
+            self.backoff_seconds += delay
+
+    def record_call(self, ok):
+        with self._lock:
+            self.calls += 1
+            self.failures += not ok
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'failures': self.failures,
+                'backoff_seconds': round(self.backoff_seconds, 3),
+                'errors': dict(self.errors),
+                'latency': percentiles(list(self._latencies))
+            }
+
+    def report(self):
+        stats = self.stats()
+        latency = ', '.join(f"{q} {ms} ms" for q, ms in stats['latency'].items()) or 'no samples'
+        errors = ', '.join(f"{kind} x{count}" for kind, count in sorted(stats['errors'].items())) or 'none'
+        return (
+            f"  {self.name}: {stats['calls']} call(s), {stats['attempts']} attempt(s), "
+            f"{stats['retries']} retr{'y' if stats['retries'] == 1 else 'ies'} "
+            f"({stats['backoff_seconds']:.1f} s backoff), {stats['failures']} failed; "
+            f"latency {latency}; errors {errors}"
+        )
+
+
+class ProviderClient:
+    """Pooled session with timeouts and retries for one provider.
+    `throttle`, if set, is called before every retry so retries are charged
+    against the provider's quota like first attempts."""
+
+    def __init__(self, name, pool_size=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_base=None, backoff_max=None, throttle=None):
+        self.name = name
+        self.timeout = (
+            WEATHER_CONNECT_TIMEOUT if connect_timeout is None else connect_timeout,
+            WEATHER_READ_TIMEOUT if read_timeout is None else read_timeout
+        )
+        self.max_retries = WEATHER_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base = WEATHER_BACKOFF_BASE if backoff_base is None else backoff_base
+        self.backoff_max = WEATHER_BACKOFF_MAX if backoff_max is None else backoff_max
+        self.throttle = throttle
+        self.stats = ProviderStats(name)
+
+        pool_size = pool_size or WEATHER_POOL_SIZE
+        # Retries are handled here rather than by urllib3, so they can be
+        # counted, throttled and honor Retry-After on every status.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff(self, attempt, response=None):
+        """Delay before retry number `attempt` (0-based): full jitter over a
+        capped exponential, but never shorter than Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = retry_after_seconds(response)
+        return delay if retry_after is None else max(delay, retry_after)
+
+    def get(self, url, params=None):
+        """The provider's response, retrying transient failures. Returns the
+        last response (which may be an error status), or None if every
+        attempt failed without one."""
+        response = None
+        for attempt in range(self.max_retries + 1):
+            if attempt and self.throttle is not None:
+                self.throttle()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except requests.Timeout:
+                response, error = None, 'timeout'
+            except requests.ConnectionError:
+                response, error = None, 'connection'
+            else:
+                error = None if response.ok else f"http {response.status_code}"
+            self.stats.record_attempt(time.perf_counter() - start, error)
+
+            transient = response is None or response.status_code in RETRY_STATUSES
+            if not transient or attempt == self.max_retries:
+                break
+            delay = self.backoff(attempt, response)
+            self.stats.record_retry(delay)
+            if response is not None:
+                # Hand the connection back to the pool before sleeping.
+                response.close()
+            time.sleep(delay)
+
+        self.stats.record_call(response is not None and response.ok)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+def provider_clients(names=('weatherapi', 'tomorrow'), **kwargs):
+    return {name: ProviderClient(name, **kwargs) for name in names}
+
+
+def format_report(clients):
+    return "\n".join(["Provider clients:"] + [client.stats.report() for client in clients.values()])
@@ -0,0 +1,349 @@
+"""
+Concurrent weather collection under per-provider rate limits
+
+Locations are fetched by asyncio tasks, at most COLLECTOR_CONCURRENCY at a
+time, and the blocking provider calls run on a thread pool. Before each call
+the provider's token buckets are charged; a call waits only as long as its
+provider's quota requires, instead of crop1.py's fixed 1 s pause after every
+location and 60 s after every 50.
+
+Quotas are comma-separated limits such as "3/s,25/h,500/d" (count per
+second, minute, hour or day), one bucket per limit, set with
+WEATHERAPI_QUOTA and TOMORROW_QUOTA.
+
+fan_out() queries the providers for a location at the same time. Once the
+first answer arrives the others get MERGE_WINDOW more seconds; any still
+running after that are abandoned and the location is built from the
+answers that came back. A provider call that raises, such as on a
+response body of an unexpected shape, is counted in the report and
+treated as no answer. With HEDGE_AFTER set, a provider that has not
+answered that many seconds after its request went out is sent a second,
+identical request, and whichever returns first is used.
+
+A cancelled request cannot stop the thread running it, so hedges and
+abandoned requests keep their threads until they return. The pool is
+sized for one request per provider per location in flight; a request
+that finds every pool thread busy runs on a thread of its own instead of
+queueing behind them.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from weather_client import percentiles
+
+COLLECTOR_CONCURRENCY = int(os.environ.get("COLLECTOR_CONCURRENCY", "16"))
+# tomorrow.io's free plan allows 3 requests a second, 25 an hour and 500 a
+# day. weatherapi.com's free plan only caps calls per month, so its bucket
+# just keeps bursts polite.
+PROVIDER_QUOTAS = {
+    'weatherapi': os.environ.get("WEATHERAPI_QUOTA", "10/s"),
+    'tomorrow': os.environ.get("TOMORROW_QUOTA", "3/s,25/h,500/d")
+}
+
+MERGE_WINDOW = float(os.environ.get("WEATHER_MERGE_WINDOW", "2.0"))
+# 0 turns hedging off
+HEDGE_AFTER = float(os.environ.get("WEATHER_HEDGE_AFTER", "0"))
+
+QUOTA_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# crop1.py's pacing before the collector: 1 s after every location, 60 s
+# after every 50th
+SERIAL_PAUSE = 1.0
+SERIAL_BATCH = 50
+SERIAL_BATCH_PAUSE = 60.0
+
+
+def parse_quota(spec):
+    """[(count, seconds), ...] for a spec such as "3/s,25/h"."""
+    limits = []
+    for part in filter(None, (part.strip() for part in spec.split(','))):
+        count, _, unit = part.partition('/')
+        if unit not in QUOTA_UNITS:
+            raise ValueError(f"Bad quota {part!r}: expected <count>/<{'|'.join(QUOTA_UNITS)}>")
+        limits.append((int(count), QUOTA_UNITS[unit]))
+    return limits
+
+
+def run_in_thread(loop, fn):
+    """Future for `fn()` run on a new daemon thread. Nothing waits for the
+    thread if the future is cancelled or the loop has closed."""
+    future = loop.create_future()
+
+    def settle(result, error):
+        if future.cancelled():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def target():
+        try:
+            result, error = fn(), None
+        except Exception as e:
+            result, error = None, e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            # The run finished without this request.
+            pass
+
+    threading.Thread(target=target, daemon=True).start()
+    return future
+
+
+class TokenBucket:
+    """Holds up to `capacity` tokens, refilled at `rate` per second."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def reserve(self):
+        """Take one token and return how long to wait before using it. The
+        balance may go negative, which queues later callers behind this one."""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+
+class RateLimiter:
+    """One provider's quota: every bucket must grant a call before it goes out."""
+
+    def __init__(self, name, quota, clock=time.monotonic):
+        self.name = name
+        self.quota = quota
+        self.buckets = [TokenBucket(count / seconds, count, clock) for count, seconds in parse_quota(quota)]
+        self.calls = 0
+        self.waited = 0.0
+        # Retries reserve from worker threads while first attempts reserve
+        # on the event loop.
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        with self._lock:
+            delay = max((bucket.reserve() for bucket in self.buckets), default=0.0)
+            self.calls += 1
+            self.waited += delay
+        return delay
+
+    async def acquire(self):
+        # Reservations are handed out in call order, so waiters queue fairly.
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self):
+        """Blocking acquire() for code running on the thread pool."""
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def minimum_seconds(self, n_calls):
+        """Shortest time in which the quota admits `n_calls` calls."""
+        return max(
+            (max(0.0, n_calls - bucket.capacity) / bucket.rate for bucket in self.buckets), default=0.0
+        )
+
+
+class Collector:
+    """Runs provider calls for many locations at once. `call()` waits for
+    the provider's quota and then runs the blocking function on a thread,
+    timing it there. With a weather_cache.WeatherCache, calls given a
+    `cache_key` are answered from the cache when possible and never touch
+    the quota."""
+
+    def __init__(self, quotas=None, concurrency=None, cache=None, merge_window=None, hedge_after=None):
+        quotas = PROVIDER_QUOTAS if quotas is None else quotas
+        self.concurrency = concurrency or COLLECTOR_CONCURRENCY
+        self.limiters = {name: RateLimiter(name, quota) for name, quota in quotas.items()}
+        self.cache = cache
+        self.merge_window = MERGE_WINDOW if merge_window is None else merge_window
+        self.hedge_after = HEDGE_AFTER if hedge_after is None else hedge_after
+        self.request_seconds = {name: 0.0 for name in quotas}
+        self.upstream_calls = {name: 0 for name in quotas}
+        self.late = {name: 0 for name in quotas}
+        self.hedges = {name: 0 for name in quotas}
+        self.hedge_wins = {name: 0 for name in quotas}
+        self.errors = {name: Counter() for name in quotas}
+        self.item_seconds = deque(maxlen=10000)
+        self.executor = None
+        self.pool_size = self.concurrency * len(self.limiters)
+        self.busy = 0
+        self.overflow_threads = 0
+        self._lock = threading.Lock()
+        self.wall_seconds = 0.0
+        self.n_items = 0
+
+    async def call(self, provider, fn, *args, cache_key=None):
+        if self.cache is not None and cache_key is not None:
+            return await self.cache.fetch(provider, cache_key, lambda: self._call(provider, fn, *args))
+        return await self._call(provider, fn, *args)
+
+    async def _call(self, provider, fn, *args):
+        await self.limiters[provider].acquire()
+        first = asyncio.ensure_future(self._request(provider, fn, *args))
+        tasks = {first}
+        try:
+            if self.hedge_after:
+                done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+                if not done:
+                    await self.limiters[provider].acquire()
+                    self.hedges[provider] += 1
+                    tasks.add(asyncio.ensure_future(self._request(provider, fn, *args)))
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = self._outcome(provider, task)
+                    if result is not None:
+                        self.hedge_wins[provider] += task is not first
+                        return result
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _outcome(self, provider, task):
+        """The finished task's result, or None if it raised. The error is
+        counted against the provider rather than failing the location."""
+        error = task.exception()
+        if error is None:
+            return task.result()
+        self.errors[provider][type(error).__name__] += 1
+        return None
+
+    async def _request(self, provider, fn, *args):
+        def timed():
+            # Timed on its own thread, so any wait for a thread is not
+            # counted as request time.
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.request_seconds[provider] += time.perf_counter() - start
+                    self.busy -= 1
+
+        loop = asyncio.get_running_loop()
+        self.upstream_calls[provider] += 1
+        with self._lock:
+            pooled = self.busy < self.pool_size
+            self.busy += 1
+        if pooled:
+            return await loop.run_in_executor(self.executor, timed)
+        self.overflow_threads += 1
+        return await run_in_thread(loop, timed)
+
+    async def fan_out(self, calls):
+        """Await the coroutines in `calls` ({provider: coroutine}) together
+        and return {provider: result} for those that returned something.
+        After the first result, the rest get `merge_window` seconds. A
+        provider that raised is left out like one that returned None."""
+        loop = asyncio.get_running_loop()
+        tasks = {asyncio.ensure_future(coroutine): provider for provider, coroutine in calls.items()}
+        pending = set(tasks)
+        results = {}
+        deadline = None
+        try:
+            while pending:
+                timeout = None if deadline is None else max(0.0, deadline - loop.time())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    result = self._outcome(tasks[task], task)
+                    if result is not None:
+                        results[tasks[task]] = result
+                if results and deadline is None:
+                    deadline = loop.time() + self.merge_window
+        finally:
+            for task in pending:
+                task.cancel()
+                self.late[tasks[task]] += 1
+        return results
+
+    async def _run(self, items, fetch, on_result):
+        results = None if on_result is not None else {}
+        # A fixed set of workers pulls from one iterator, so only
+        # `concurrency` tasks exist however many items there are.
+        pending = iter(items)
+
+        async def worker():
+            for i, item in pending:
+                start = time.perf_counter()
+                result = await fetch(self, item, i)
+                self.item_seconds.append(time.perf_counter() - start)
+                if results is None:
+                    on_result(i, item, result)
+                else:
+                    results[i] = result
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return None if results is None else [results[i] for i, _ in items]
+
+    def run(self, items, fetch, on_result=None, skip=()):
+        """`await fetch(collector, item, i)` for every item whose index is
+        not in `skip`. Returns the results in item order, or, when
+        `on_result(i, item, result)` is given, hands each result to it as
+        it finishes and keeps none."""
+        items = [(i, item) for i, item in enumerate(items) if i not in skip]
+        self.n_items += len(items)
+        start = time.perf_counter()
+        self.executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        try:
+            return asyncio.run(self._run(items, fetch, on_result))
+        finally:
+            self.wall_seconds += time.perf_counter() - start
+            # Abandoned requests finish on their own; their results are
+            # not wanted, so the run does not wait for them.
+            self.executor.shutdown(wait=False)
+
+    def serial_seconds(self):
+        """How long crop1.py's serial loop would have taken for the same
+        items: every request one after another, plus its fixed pauses. The
+        serial loop calls every provider once per item, uncached."""
+        n = self.n_items
+        batches = n // SERIAL_BATCH
+        pauses = batches * SERIAL_BATCH_PAUSE + (n - batches) * SERIAL_PAUSE
+        requests = sum(
+            seconds / self.upstream_calls[name] * n
+            for name, seconds in self.request_seconds.items() if self.upstream_calls[name]
+        )
+        return requests + pauses
+
+    def report(self):
+        serial = self.serial_seconds()
+        lines = [
+            f"Collected {self.n_items} location(s) in {self.wall_seconds:.1f} s "
+            f"(serial script: about {serial:.1f} s, {serial / max(self.wall_seconds, 1e-9):.1f}x)",
+            "  per location: " + (
+                ', '.join(f"{q} {ms} ms" for q, ms in percentiles(list(self.item_seconds)).items()) or 'no samples'
+            )
+        ]
+        for name, limiter in self.limiters.items():
+            line = (
+                f"  {name}: {limiter.calls} call(s), {self.request_seconds[name]:.1f} s in requests, "
+                f"{limiter.waited:.1f} s waiting for quota {limiter.quota}, "
+                f"{self.late[name]} late past the {self.merge_window:g} s merge window"
+            )
+            if self.hedge_after:
+                line += f", {self.hedges[name]} hedged ({self.hedge_wins[name]} won by the hedge)"
+            if self.errors[name]:
+                line += "; errors " + ', '.join(
+                    f"{kind} x{count}" for kind, count in sorted(self.errors[name].items())
+                )
+            lines.append(line)
+        if self.overflow_threads:
+            lines.append(f"  {self.overflow_threads} request(s) ran outside the {self.pool_size}-thread pool "
+                         "while hedges or abandoned requests held it")
+        if self.cache is not None:
+            lines.append(self.cache.report())
+        return "\n".join(lines)
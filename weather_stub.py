@@ -0,0 +1,206 @@
+"""
+Local stand-in for the weatherapi.com and tomorrow.io endpoints crop1.py calls
+
+Serves GET /v1/current.json (weatherapi.com) and GET /v4/weather/realtime
+(tomorrow.io) with responses shaped like the real ones, after an artificial
+latency. Readings depend only on the location, so repeated calls agree.
+A fraction of requests can be failed with 429/503 and a Retry-After header
+to exercise the client's retries, or held for a long tail latency to
+exercise hedging and the merge window.
+
+    python weather_stub.py [--port 8765] [--latency 0.2] [--fail-rate 0.1] [--tail-rate 0.05]
+    WEATHERAPI_URL=http://127.0.0.1:8765/v1/current.json \\
+    TOMORROW_URL=http://127.0.0.1:8765/v4/weather/realtime python crop1.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+WEATHERAPI_PATH = '/v1/current.json'
+TOMORROW_PATH = '/v4/weather/realtime'
+PROVIDER_PATHS = {WEATHERAPI_PATH: 'weatherapi', TOMORROW_PATH: 'tomorrow'}
+
+
+def readings(place):
+    """Stable, plausible temperature, humidity and rainfall for a place name."""
+    seed = zlib.crc32(place.strip().lower().encode())
+    return {
+        'temperature': round(18 + seed % 1700 / 100, 1),
+        'humidity': 40 + seed % 55,
+        'rainfall': round(seed % 300 / 100, 2)
+    }
+
+
+def weatherapi_body(query):
+    values = readings(query)
+    now = datetime.now(timezone.utc)
+    return {
+        'location': {'name': query, 'localtime_epoch': int(now.timestamp())},
+        'current': {
+            'last_updated_epoch': int(now.timestamp()),
+            'temp_c': values['temperature'],
+            'humidity': values['humidity'],
+            'precip_mm': values['rainfall']
+        }
+    }
+
+
+def tomorrow_body(location):
+    lat, _, lon = location.partition(',')
+    # Round like a grid lookup, so nearby coordinates share a reading.
+    values = readings(f"{float(lat):.1f},{float(lon):.1f}")
+    return {
+        'data': {
+            'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'values': {
+                'temperature': values['temperature'] + 0.4,
+                'humidity': values['humidity'],
+                'precipitationIntensity': values['rainfall']
+            }
+        },
+        'location': {'lat': float(lat), 'lon': float(lon)}
+    }
+
+
+class StubWeatherServer:
+    """Threaded stand-in server on 127.0.0.1. `latency` (seconds) delays
+    every response, and a `tail_rate` share of them by `tail_latency`
+    instead; a `fail_rate` share of requests is answered with 429 or 503 and
+    `Retry-After: retry_after`. `requests` counts calls per provider
+    and `connections` counts TCP connections accepted."""
+
+    def __init__(self, port=0, latency=0.0, fail_rate=0.0, retry_after=1, seed=0, tail_rate=0.0,
+                 tail_latency=3.0):
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self.failures = Counter()
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def urls(self):
+        return {'weatherapi': self.base_url + WEATHERAPI_PATH, 'tomorrow': self.base_url + TOMORROW_PATH}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _latency(self):
+        with self._lock:
+            return self.tail_latency if self._random.random() < self.tail_rate else self.latency
+
+    def _injected_failure(self, provider):
+        with self._lock:
+            if self._random.random() >= self.fail_rate:
+                return None
+            status = self._random.choice((429, 503))
+            self.failures[provider, status] += 1
+        return status
+
+    def respond(self, provider, query):
+        """(status, body) for one request."""
+        if provider == 'weatherapi':
+            if not query.get('key') or not query.get('q'):
+                return 401, {'error': {'code': 1002, 'message': 'API key or q parameter missing.'}}
+            return 200, weatherapi_body(query['q'])
+        if not query.get('apikey') or not query.get('location'):
+            return 401, {'code': 401001, 'type': 'Invalid Auth', 'message': 'The method requires authentication.'}
+        return 200, tomorrow_body(query['location'])
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                provider = PROVIDER_PATHS.get(url.path)
+                if provider is None:
+                    return self.send(404, {'error': f"unknown path {url.path}"})
+                with server._lock:
+                    server.requests[provider] += 1
+                latency = server._latency()
+                if latency:
+                    time.sleep(latency)
+                failure = server._injected_failure(provider)
+                if failure is not None:
+                    return self.send(failure, {'error': 'injected failure'},
+                                     {'Retry-After': str(server.retry_after)})
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                status, body = server.respond(provider, query)
+                self.send(status, body)
+
+            def send(self, status, body, headers=None):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client timed out and hung up first.
+                    self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve stand-in weatherapi.com and tomorrow.io endpoints.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds added to every response")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="share of requests answered with 429/503")
+    parser.add_argument('--tail-rate', type=float, default=0.0, help="share of requests delayed by --tail-latency")
+    parser.add_argument('--tail-latency', type=float, default=3.0)
+    args = parser.parse_args()
+    server = StubWeatherServer(args.port, args.latency, args.fail_rate, tail_rate=args.tail_rate,
+                               tail_latency=args.tail_latency)
+    print(f"Serving on {server.base_url} ({WEATHERAPI_PATH}, {TOMORROW_PATH})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,152 @@
+"""
+Streaming, resumable CSV output for crop1.py
+
+Rows are buffered and appended to the CSV every WEATHER_WRITE_BATCH rows.
+After each batch is on disk, one line is appended to a checkpoint file
+next to it, recording the CSV's size and the item indices in that batch.
+A restarted run with the same items and columns reads the checkpoint and
+cuts the CSV back to the last recorded size, which drops rows that were
+written but not checkpointed. It then skips the recorded indices. The
+checkpoint is removed once every item has been written, so the next run
+starts afresh.
+
+Batches are appended as they fill, so rows follow completion order; within
+a batch they are sorted by item index.
+"""
+import csv
+import hashlib
+import json
+import os
+
+WEATHER_WRITE_BATCH = int(os.environ.get("WEATHER_WRITE_BATCH", "25"))
+CHECKPOINT_SUFFIX = '.checkpoint'
+
+
+def items_key(items):
+    """Identifies a list of items, so a checkpoint is only resumed by a run
+    over the same list."""
+    return hashlib.sha256(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class CheckpointedCSVWriter:
+    """Appends rows for items `0..n_items-1` of the run identified by
+    `run_key`. With `columns` given, a checkpoint written with other
+    columns is not resumed; otherwise they come from the first row. `done`
+    holds the indices already written, including those from an interrupted
+    earlier run."""
+
+    def __init__(self, path, run_key, n_items, columns=None, checkpoint_path=None, batch_size=None,
+                 resume=True):
+        self.path = path
+        self.run_key = run_key
+        self.n_items = n_items
+        self.columns = list(columns) if columns is not None else None
+        self.checkpoint_path = checkpoint_path or path + CHECKPOINT_SUFFIX
+        self.batch_size = batch_size or WEATHER_WRITE_BATCH
+        self.done = set()
+        self.resumed = 0
+        self.written = 0
+        self._rows = []
+        self._indices = []
+        self._columns = None
+        self._header_written = False
+
+        offset = self._resume() if resume else None
+        if offset is None:
+            self._start()
+        else:
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+            self.resumed = len(self.done)
+            self._header_written = True
+        self._csv = open(self.path, 'a', newline='')
+        self._checkpoint = open(self.checkpoint_path, 'a')
+
+    def _resume(self):
+        """CSV size recorded by the last complete checkpoint line, or None
+        if there is nothing to resume."""
+        if not (os.path.exists(self.checkpoint_path) and os.path.exists(self.path)):
+            return None
+        with open(self.checkpoint_path) as f:
+            lines = f.read().split('\n')
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return None
+        if header.get('run') != self.run_key:
+            return None
+        if self.columns is not None and header.get('columns') != self.columns:
+            # Rows of the new shape cannot be appended under the old header.
+            return None
+
+        offset = header['offset']
+        self._columns = header['columns']
+        # The last line may be cut short by a crash; it is ignored along
+        # with the rows it would have covered.
+        for line in lines[1:-1]:
+            entry = json.loads(line)
+            offset = entry['offset']
+            self.done.update(entry['done'])
+        if os.path.getsize(self.path) < offset:
+            self.done.clear()
+            return None
+        return offset
+
+    def _start(self):
+        for path in (self.path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._columns = self.columns
+        self.done.clear()
+
+    def write(self, i, row):
+        self._rows.append(row)
+        self._indices.append(i)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        batch = sorted(zip(self._indices, self._rows), key=lambda entry: entry[0])
+        self._indices, self._rows = [i for i, _ in batch], [row for _, row in batch]
+        if not self._header_written:
+            self._columns = self._columns or list(self._rows[0])
+            self._header_written = True
+            writer = csv.DictWriter(self._csv, fieldnames=self._columns)
+            writer.writeheader()
+            _sync(self._csv)
+            self._checkpoint.write(json.dumps(
+                {'run': self.run_key, 'columns': self._columns, 'offset': self._csv.tell()}
+            ) + '\n')
+        csv.DictWriter(self._csv, fieldnames=self._columns).writerows(self._rows)
+        _sync(self._csv)
+        # Only once the rows are durable may the checkpoint claim them.
+        self._checkpoint.write(json.dumps({'offset': self._csv.tell(), 'done': self._indices}) + '\n')
+        _sync(self._checkpoint)
+
+        self.done.update(self._indices)
+        self.written += len(self._rows)
+        self._rows, self._indices = [], []
+
+    def close(self):
+        self.flush()
+        self._csv.close()
+        self._checkpoint.close()
+        if self.complete:
+            os.remove(self.checkpoint_path)
+
+    @property
+    def complete(self):
+        return len(self.done) >= self.n_items
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()